@@ -3,12 +3,20 @@ from flask_cors import CORS
 from config import Config
 from models import db, jwt, mail
 from routes import auth_bp, ops_bp, client_bp, init_services
+import routes
+from mailer import start_outbox_sender
+from maintenance import start_maintenance_scheduler
+from processing import start_processing_workers
+from database import configure_database
+from migrations import run_migrations
 import os
 
-def create_app():
-    """Application factory"""
+def create_app(config=None):
+    """Application factory; `config` overrides settings from Config (tests use it)"""
     app = Flask(__name__)
     app.config.from_object(Config)
+    if config:
+        app.config.update(config)
     
     # Initialize extensions
     db.init_app(app)
@@ -41,9 +49,10 @@ def create_app():
         from flask import send_from_directory
         return send_from_directory('.', 'api_tester.html')
     
-    # Create database tables
+    # Create or upgrade database tables
     with app.app_context():
-        db.create_all()
+        configure_database(app)
+        run_migrations(db.engine)
         
         # Create default ops user if it doesn't exist
         from models import User
@@ -61,6 +70,18 @@ def create_app():
             db.session.commit()
             print("Default ops user created: ops@example.com / ops123")
     
+    # Deliver queued emails in the background
+    if app.config['MAIL_OUTBOX_SENDER']:
+        start_outbox_sender(app)
+    
+    # Process uploaded files (verification, validation) in background worker threads
+    if app.config['PROCESSING_WORKERS'] > 0:
+        start_processing_workers(app, routes.blob_store)
+    
+    # Purge stale tokens and keep the database tidy in the background
+    if app.config['MAINTENANCE_SCHEDULER']:
+        start_maintenance_scheduler(app)
+    
     @app.route('/health', methods=['GET'])
     def health_check():
         """Health check endpoint"""
@@ -80,12 +101,25 @@ def create_app():
                     'client_login': 'POST /api/auth/client/login'
                 },
                 'ops': {
-                    'upload_file': 'POST /api/ops/upload (requires JWT)'
+                    'upload_file': 'POST /api/ops/upload (requires JWT)',
+                    'delete_file': 'DELETE /api/ops/files/{file_id} (requires JWT)',
+                    'processing_status': 'GET /api/ops/files/{file_id}/processing (requires JWT)',
+                    'hot_file_cache_stats': 'GET /api/ops/hot-file-cache (requires JWT)',
+                    'create_upload': 'POST /api/ops/uploads (requires JWT)',
+                    'upload_offset': 'HEAD /api/ops/uploads/{upload_id} (requires JWT)',
+                    'append_chunk': 'PATCH /api/ops/uploads/{upload_id} (requires JWT)',
+                    'complete_upload': 'POST /api/ops/uploads/{upload_id}/complete (requires JWT)',
+                    'abort_upload': 'DELETE /api/ops/uploads/{upload_id} (requires JWT)'
                 },
                 'client': {
                     'list_files': 'GET /api/client/files (requires JWT)',
+                    'search_files': 'GET /api/client/search?q={words} (requires JWT)',
+                    'list_package_members': 'GET /api/client/files/{file_id}/members (requires JWT)',
+                    'get_package_member': 'GET /api/client/files/{file_id}/members/{member_name} (requires JWT)',
+                    'get_file_preview': 'GET /api/client/files/{file_id}/preview (requires JWT)',
                     'get_download_link': 'GET /api/client/download-file/{assignment_id} (requires JWT)',
-                    'download_file': 'GET /api/client/download-file/{encrypted_token}'
+                    'download_file': 'GET /api/client/download-file/{encrypted_token}',
+                    'download_zip': 'POST /api/client/download-zip (requires JWT)'
                 }
             },
             'default_ops_user': {
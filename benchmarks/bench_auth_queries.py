@@ -0,0 +1,64 @@
+"""
+Benchmark for database queries per authenticated request
+
+Counts SQL statements issued by authenticated client requests with the identity
+cache disabled (every request reads the user row, as before role claims) and
+enabled, and reports requests per second for both.
+
+Usage: python benchmarks/bench_auth_queries.py [requests]
+"""
+
+import io
+import os
+import sys
+import tempfile
+import time
+
+WORK_DIR = tempfile.mkdtemp(prefix='bench-auth-')
+os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(WORK_DIR, 'bench.db')}"
+os.environ['UPLOAD_FOLDER'] = os.path.join(WORK_DIR, 'uploads')
+os.environ['PASSWORD_HASH_EXECUTOR'] = 'inline'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from app import create_app
+from models import db
+import routes
+from utils import IdentityCache
+
+def login(client, user_type, email, password):
+    response = client.post(f'/api/auth/{user_type}/login', json={'email': email, 'password': password})
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+if __name__ == '__main__':
+    requests_per_run = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    
+    app = create_app()
+    client = app.test_client()
+    ops_headers = login(client, 'ops', 'ops@example.com', 'ops123')
+    client.post('/api/auth/client/signup', json={'email': 'bench@example.com', 'password': 'bench'})
+    client_headers = login(client, 'client', 'bench@example.com', 'bench')
+    file_id = client.post('/api/ops/upload', headers=ops_headers,
+                          data={'file': (io.BytesIO(b'benchmark'), 'bench.docx')}).get_json()['file_id']
+    
+    statements = [0]
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.__setitem__(0, statements[0] + 1))
+    
+    endpoints = [
+        ('GET /api/client/files', lambda: client.get('/api/client/files?limit=10', headers=client_headers)),
+        ('GET /api/client/download-file/<id>', lambda: client.get(f'/api/client/download-file/{file_id}', headers=client_headers)),
+    ]
+    
+    for label, ttl in [('before: no identity cache', 0), ('after: identity cache', app.config['IDENTITY_CACHE_TTL'])]:
+        routes.identity_cache = IdentityCache(ttl=ttl)
+        print(label)
+        for name, call in endpoints:
+            call()  # warm up
+            statements[0] = 0
+            start = time.perf_counter()
+            for _ in range(requests_per_run):
+                assert call().status_code == 200
+            elapsed = time.perf_counter() - start
+            print(f"  {name:<36} {statements[0] / requests_per_run:5.2f} queries/request"
+                  f"   {requests_per_run / elapsed:8.0f} requests/s")
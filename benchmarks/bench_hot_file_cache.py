@@ -0,0 +1,90 @@
+"""
+Download throughput for a skewed (Zipf) mix with the hot-file cache off and on
+
+Uploads files of 16-512 KB and a few large ones, then downloads them in an
+order drawn from a Zipf distribution (a few popular documents make up most
+requests) through GET /download-file/<token>, with the in-process cache
+disabled and then enabled, and reports requests per second and the cache
+counters. Tokens are issued up front, so only the download path is timed.
+
+Usage: python benchmarks/bench_hot_file_cache.py [requests] [files] [zipf_exponent]
+       (set STORAGE_ENCRYPTION=true to measure encrypted storage)
+"""
+
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+WORK_DIR = tempfile.mkdtemp(prefix='bench-hot-cache-')
+os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(WORK_DIR, 'bench.db')}"
+os.environ['UPLOAD_FOLDER'] = os.path.join(WORK_DIR, 'uploads')
+os.environ['PASSWORD_HASH_EXECUTOR'] = 'inline'
+os.environ['MAIL_OUTBOX_SENDER'] = 'false'
+os.environ['MAINTENANCE_SCHEDULER'] = 'false'
+os.environ['PROCESSING_WORKERS'] = '0'
+os.environ['DOWNLOAD_TOKEN_FORMAT'] = 'compact'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from utils import HotFileCache
+import routes
+
+LARGE_FILE_SIZE = 8 * 1024 * 1024
+
+def login(client, user_type, email, password):
+    response = client.post(f'/api/auth/{user_type}/login', json={'email': email, 'password': password})
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+def zipf_order(count, exponent, length, seed=42):
+    """``length`` indexes into ``count`` items, item i drawn with weight 1 / (i + 1) ** exponent"""
+    weights = [1 / (i + 1) ** exponent for i in range(count)]
+    return random.Random(seed).choices(range(count), weights, k=length)
+
+if __name__ == '__main__':
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    exponent = float(sys.argv[3]) if len(sys.argv) > 3 else 1.1
+
+    app = create_app()
+    client = app.test_client()
+    ops_headers = login(client, 'ops', 'ops@example.com', 'ops123')
+
+    rng = random.Random(7)
+    file_ids = []
+    for i in range(files):
+        # Every 50th file is large and bypasses the cache
+        size = LARGE_FILE_SIZE if i % 50 == 49 else rng.randint(16, 512) * 1024
+        response = client.post('/api/ops/upload', headers=ops_headers,
+                               data={'file': (io.BytesIO(os.urandom(size)), f'doc{i}.docx')})
+        file_ids.append(response.get_json()['file_id'])
+    order = [file_ids[i] for i in zipf_order(files, exponent, requests)]
+    top = sum(1 for file_id in order if file_id in file_ids[:10]) / requests
+    print(f"{requests} downloads of {files} files, Zipf exponent {exponent}: "
+          f"the 10 most popular files get {top:.0%} of requests")
+
+    try:
+        for label, cache in [('cache off', None),
+                             ('cache on', HotFileCache(app.config['HOT_FILE_CACHE_MAX_BYTES'],
+                                                       app.config['HOT_FILE_CACHE_MAX_OBJECT']))]:
+            routes.hot_file_cache = cache
+            with app.app_context():
+                tokens = [routes.token_service.generate_compact_token(file_id, 1) for file_id in order]
+            transferred = 0
+            start = time.perf_counter()
+            for token in tokens:
+                response = client.get(f'/download-file/{token}')
+                assert response.status_code == 200, response.status_code
+                transferred += len(response.get_data())
+                response.close()
+            elapsed = time.perf_counter() - start
+            print(f"  {label:<10} {requests / elapsed:8.0f} requests/s  {transferred / elapsed / 2 ** 20:8.0f} MB/s")
+            if cache is not None:
+                stats = cache.stats()
+                print(f"             hits {stats['hits']}  misses {stats['misses']}  evictions {stats['evictions']}"
+                      f"  bypasses {stats['bypasses']}  ({stats['bytes'] / 2 ** 20:.1f} MB cached in {stats['entries']} files)")
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
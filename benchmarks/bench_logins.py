@@ -0,0 +1,60 @@
+"""
+Load benchmark for login throughput
+
+Runs concurrent client logins through the Flask test client with password
+hashing inline on the request thread (the original behaviour) and in the
+bounded process pool, and reports logins per second and shed (503) requests.
+
+Usage: python benchmarks/bench_logins.py [logins] [concurrency]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+WORK_DIR = tempfile.mkdtemp(prefix='bench-logins-')
+os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(WORK_DIR, 'bench.db')}"
+os.environ['UPLOAD_FOLDER'] = os.path.join(WORK_DIR, 'uploads')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+import routes
+from passwords import PasswordHasher
+
+EMAIL = 'bench@example.com'
+PASSWORD = 'bench-password'
+
+def run(app, executor, logins, concurrency):
+    config = app.config
+    routes.password_hasher = PasswordHasher(
+        method=config['PASSWORD_HASH_METHOD'],
+        executor=executor,
+        workers=config['PASSWORD_HASH_WORKERS'],
+        max_pending=config['PASSWORD_HASH_MAX_PENDING'],
+        retry_after=config['PASSWORD_HASH_RETRY_AFTER']
+    )
+    
+    def login(_):
+        with app.test_client() as client:
+            return client.post('/api/auth/client/login', json={'email': EMAIL, 'password': PASSWORD}).status_code
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        statuses = list(pool.map(login, range(logins)))
+    elapsed = time.perf_counter() - start
+    
+    ok = statuses.count(200)
+    print(f"  {executor:<8} {ok / elapsed:8.1f} logins/s   ok {ok:5d}   busy(503) {statuses.count(503):5d}   {elapsed:6.2f}s")
+
+if __name__ == '__main__':
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    
+    app = create_app()
+    app.test_client().post('/api/auth/client/signup', json={'email': EMAIL, 'password': PASSWORD})
+    
+    print(f"{logins} logins, {concurrency} concurrent clients, method {app.config['PASSWORD_HASH_METHOD']}")
+    run(app, 'inline', logins, concurrency)
+    run(app, 'process', logins, concurrency)
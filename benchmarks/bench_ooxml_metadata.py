@@ -0,0 +1,109 @@
+"""
+Document property extraction time against file size
+
+Builds .docx files of growing size (the bulk is incompressible embedded
+media, as in real documents with images) and times extract_metadata, which
+reads only the central directory and the two docProps parts, against reading
+every member of the package. Also reports how many bytes each approach reads.
+
+Usage: python benchmarks/bench_ooxml_metadata.py [sizes_mb] [rounds]
+       e.g. python benchmarks/bench_ooxml_metadata.py 0.1,1,10,100 20
+"""
+
+import io
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ooxml import extract_metadata
+
+CORE_XML = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+            'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+            '<dc:title>Quarterly report</dc:title><dc:creator>Jane Doe</dc:creator>'
+            '<dcterms:created xsi:type="dcterms:W3CDTF">2024-05-01T09:30:00Z</dcterms:created>'
+            '</cp:coreProperties>')
+APP_XML = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+           '<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/extended-properties">'
+           '<Pages>12</Pages><Words>3400</Words></Properties>')
+MEDIA_PART_SIZE = 1024 * 1024
+
+class CountingReader(io.RawIOBase):
+    """Wraps a file and counts the bytes read through it"""
+    
+    def __init__(self, f):
+        self.f = f
+        self.bytes_read = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.f.seek(offset, whence)
+    
+    def tell(self):
+        return self.f.tell()
+    
+    def readinto(self, buffer):
+        n = self.f.readinto(buffer)
+        self.bytes_read += n
+        return n
+
+def build_docx(path, size):
+    """Write a minimal .docx padded to about ``size`` bytes with stored media parts"""
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as package:
+        package.writestr('[Content_Types].xml', '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"/>')
+        package.writestr('word/document.xml', '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"/>')
+        package.writestr('docProps/core.xml', CORE_XML)
+        package.writestr('docProps/app.xml', APP_XML)
+        remaining, index = size, 0
+        while remaining > 0:
+            chunk = min(remaining, MEDIA_PART_SIZE)
+            package.writestr(f'word/media/image{index}.png', os.urandom(chunk), zipfile.ZIP_STORED)
+            remaining -= chunk
+            index += 1
+
+def read_everything(f):
+    """The naive approach: decompress every member of the package"""
+    with zipfile.ZipFile(f) as package:
+        for info in package.infolist():
+            package.read(info)
+
+def measure(path, func, rounds):
+    """Return (median milliseconds, bytes read per call)"""
+    times = []
+    for _ in range(rounds):
+        with open(path, 'rb', buffering=0) as raw:
+            f = CountingReader(raw)
+            start = time.perf_counter()
+            func(f)
+            times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000, f.bytes_read
+
+if __name__ == '__main__':
+    sizes = [float(n) for n in (sys.argv[1] if len(sys.argv) > 1 else '0.1,1,10,100').split(',')]
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    root = tempfile.mkdtemp(prefix='bench-ooxml-')
+    
+    print(f"{'size MB':>8}  {'extract ms':>10} {'read KB':>9}  {'read all ms':>11} {'read KB':>9}")
+    try:
+        for size_mb in sizes:
+            path = os.path.join(root, f'{size_mb}.docx')
+            build_docx(path, int(size_mb * 1024 * 1024))
+            assert extract_metadata(open(path, 'rb'), 'docx')['page_count'] == 12
+            extract_ms, extract_bytes = measure(path, lambda f: extract_metadata(f, 'docx'), rounds)
+            full_ms, full_bytes = measure(path, read_everything, max(1, rounds // 4))
+            print(f"{size_mb:>8g}  {extract_ms:>10.2f} {extract_bytes / 1024:>9.1f}  {full_ms:>11.2f} {full_bytes / 1024:>9.1f}")
+            os.remove(path)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
@@ -0,0 +1,113 @@
+"""
+Opening one package member: persisted member index against zipfile
+
+Builds .pptx files with a growing number of members (small slide parts
+plus incompressible media) and times reading docProps/thumbnail.jpeg the
+way the member API does (MemberReader at the indexed data offset) against
+opening the package with zipfile, which parses the whole central directory
+and the member's local header on every open. Also reports the bytes and
+read calls each approach makes.
+
+Usage: python benchmarks/bench_package_members.py [member_counts] [rounds]
+       e.g. python benchmarks/bench_package_members.py 100,1000,10000,50000 20
+"""
+
+import io
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from package_members import read_member_index, MemberReader
+
+THUMBNAIL = 'docProps/thumbnail.jpeg'
+THUMBNAIL_SIZE = 32 * 1024
+MEDIA_SIZE = 20 * 1024 * 1024
+
+class CountingReader(io.RawIOBase):
+    """Wraps a file and counts the bytes and read calls made through it"""
+    
+    def __init__(self, f):
+        self.f = f
+        self.bytes_read = 0
+        self.reads = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.f.seek(offset, whence)
+    
+    def tell(self):
+        return self.f.tell()
+    
+    def readinto(self, buffer):
+        n = self.f.readinto(buffer)
+        self.bytes_read += n
+        self.reads += 1
+        return n
+
+def build_pptx(path, members):
+    """Write a .pptx with ``members`` slide parts, 20MB of stored media and a thumbnail"""
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as package:
+        package.writestr('[Content_Types].xml', '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"/>')
+        package.writestr('ppt/presentation.xml', '<p:presentation xmlns:p="http://schemas.openxmlformats.org/presentationml/2006/main"/>')
+        package.writestr(zipfile.ZipInfo(THUMBNAIL), os.urandom(THUMBNAIL_SIZE), zipfile.ZIP_STORED)
+        package.writestr(zipfile.ZipInfo('ppt/media/video1.mp4'), os.urandom(MEDIA_SIZE), zipfile.ZIP_STORED)
+        for i in range(members):
+            package.writestr(f'ppt/slides/slide{i + 1}.xml', f'<p:sld><a:t>Slide {i + 1}</a:t></p:sld>' * 20)
+
+def read_with_zipfile(f):
+    with zipfile.ZipFile(f) as package:
+        return package.read(THUMBNAIL)
+
+def measure(path, func, rounds):
+    """Return (median milliseconds, bytes read per call, read calls per call)"""
+    times = []
+    for _ in range(rounds):
+        with open(path, 'rb', buffering=0) as raw:
+            f = CountingReader(raw)
+            start = time.perf_counter()
+            func(f)
+            times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000, f.bytes_read, f.reads
+
+if __name__ == '__main__':
+    counts = [int(n) for n in (sys.argv[1] if len(sys.argv) > 1 else '100,1000,10000,50000').split(',')]
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    root = tempfile.mkdtemp(prefix='bench-members-')
+    
+    print(f"{'members':>8}  {'index ms':>9}  {'indexed ms':>10} {'KB':>6} {'reads':>5}  {'zipfile ms':>10} {'KB':>6} {'reads':>5}")
+    try:
+        for count in counts:
+            path = os.path.join(root, f'{count}.pptx')
+            build_pptx(path, count)
+            
+            # Built once per file (by the index_members processing stage), then reused
+            start = time.perf_counter()
+            with open(path, 'rb') as f:
+                members = {member.name: member for member in read_member_index(f)}
+            index_ms = (time.perf_counter() - start) * 1000
+            thumbnail = members[THUMBNAIL]
+            
+            def read_indexed(f):
+                with MemberReader(f, thumbnail) as reader:
+                    return reader.read()
+            
+            with open(path, 'rb') as f, open(path, 'rb') as g:
+                assert read_indexed(f) == read_with_zipfile(g)
+            indexed = measure(path, read_indexed, rounds)
+            plain = measure(path, read_with_zipfile, rounds)
+            print(f"{count:>8}  {index_ms:>9.1f}  {indexed[0]:>10.3f} {indexed[1] / 1024:>6.1f} {indexed[2]:>5}"
+                  f"  {plain[0]:>10.3f} {plain[1] / 1024:>6.1f} {plain[2]:>5}")
+            os.remove(path)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
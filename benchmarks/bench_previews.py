@@ -0,0 +1,121 @@
+"""
+Thumbnail latency: first request, cached, revalidated and under a burst
+
+Uploads packages with an embedded thumbnail (plus incompressible media, as
+in real decks) and files without one, then times GET /files/<id>/preview
+when the preview is generated, when it is served from the disk cache, and
+when the browser revalidates it with its ETag (304). Finally a burst of
+concurrent requests for previews that are not cached yet is sent, to count
+how many generations it triggers (one per preview when deduplicated).
+
+Usage: python benchmarks/bench_previews.py [files] [threads]
+"""
+
+import io
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+WORK_DIR = tempfile.mkdtemp(prefix='bench-previews-')
+os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(WORK_DIR, 'bench.db')}"
+os.environ['UPLOAD_FOLDER'] = os.path.join(WORK_DIR, 'uploads')
+os.environ['PASSWORD_HASH_EXECUTOR'] = 'inline'
+os.environ['MAIL_OUTBOX_SENDER'] = 'false'
+os.environ['MAINTENANCE_SCHEDULER'] = 'false'
+os.environ['PROCESSING_WORKERS'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+import routes
+
+MEDIA_SIZE = 5 * 1024 * 1024
+
+def login(client, user_type, email, password):
+    response = client.post(f'/api/auth/{user_type}/login', json={'email': email, 'password': password})
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+def build_pptx(with_thumbnail):
+    package = io.BytesIO()
+    with zipfile.ZipFile(package, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', '<Types/>')
+        archive.writestr('ppt/presentation.xml', '<p:presentation/>')
+        archive.writestr(zipfile.ZipInfo('ppt/media/video1.mp4'), os.urandom(MEDIA_SIZE), zipfile.ZIP_STORED)
+        if with_thumbnail:
+            archive.writestr(zipfile.ZipInfo('docProps/thumbnail.jpeg'), os.urandom(30 * 1024), zipfile.ZIP_STORED)
+    return package.getvalue()
+
+def clear_cache():
+    folder = routes.preview_cache.folder
+    for name in os.listdir(folder):
+        os.remove(os.path.join(folder, name))
+    routes.preview_cache._load()
+
+def timed(calls):
+    """Median and p95 milliseconds of the given request functions"""
+    times = []
+    for call in calls:
+        start = time.perf_counter()
+        call()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return statistics.median(times), times[int(len(times) * 0.95)]
+
+if __name__ == '__main__':
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    
+    app = create_app()
+    client = app.test_client()
+    ops_headers = login(client, 'ops', 'ops@example.com', 'ops123')
+    client.post('/api/auth/client/signup', json={'email': 'bench@example.com', 'password': 'bench'})
+    headers = login(client, 'client', 'bench@example.com', 'bench')
+    
+    file_ids = []
+    for i in range(files):
+        data = build_pptx(with_thumbnail=i % 2 == 0)
+        response = client.post('/api/ops/upload', headers=ops_headers, data={'file': (io.BytesIO(data), f'deck{i}.pptx')})
+        file_ids.append(response.get_json()['file_id'])
+    
+    def preview(file_id, extra=None):
+        response = client.get(f'/api/client/files/{file_id}/preview', headers={**headers, **(extra or {})})
+        assert response.status_code in (200, 304), response.status_code
+        return response
+    
+    try:
+        # Includes indexing each package's members, as for files processed before the index existed
+        print('first request   median %.2f ms  p95 %.2f ms' % timed(lambda f=f: preview(f) for f in file_ids))
+        clear_cache()
+        print('generated       median %.2f ms  p95 %.2f ms' % timed(lambda f=f: preview(f) for f in file_ids))
+        print('cached          median %.2f ms  p95 %.2f ms' % timed(lambda f=f: preview(f) for f in file_ids * 5))
+        etags = {f: preview(f).headers['ETag'] for f in file_ids}
+        print('revalidated     median %.2f ms  p95 %.2f ms'
+              % timed(lambda f=f: preview(f, {'If-None-Match': etags[f]}) for f in file_ids * 5))
+        
+        clear_cache()
+        generations = [0]
+        put = routes.preview_cache.put
+        def counting_put(key, data):
+            generations[0] += 1
+            put(key, data)
+        routes.preview_cache.put = counting_put
+        barrier = threading.Barrier(threads)
+        def burst(worker):
+            barrier.wait()
+            for file_id in file_ids:
+                preview(file_id)
+        workers = [threading.Thread(target=burst, args=(i,)) for i in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        unique = len({*(etags.values())})
+        print(f'burst of {threads} x {files} requests: {generations[0]} generations for {unique} distinct previews'
+              f' in {(time.perf_counter() - start) * 1000:.0f} ms')
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
@@ -0,0 +1,104 @@
+"""
+Full-text search latency against index size
+
+Fills a file_search table (the schema the migration creates) with synthetic
+documents whose words follow a Zipf distribution, like real text, then times
+the search endpoint's queries for rare, medium and common words: the first
+page and a page deep into the results (reached through the keyset cursor)
+with SEARCH_MAX_CANDIDATES, and the first page when every match is ranked.
+
+Usage: python benchmarks/bench_search.py [documents] [words_per_document] [max_candidates]
+       e.g. python benchmarks/bench_search.py 300000 100 10000
+"""
+
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from search import create_search_index, search_sql, FLOOR_SQL
+
+VOCABULARY = 50000
+PAGE_SIZE = 20
+SAMPLES = 50
+
+def word(rank):
+    return f"w{rank}"
+
+def build_index(path, documents, words_per_document):
+    engine = create_engine(f'sqlite:///{path}')
+    with engine.begin() as connection:
+        connection.exec_driver_sql('CREATE TABLE uploaded_files (id INTEGER PRIMARY KEY, original_filename TEXT, title TEXT, author TEXT)')
+        create_search_index(connection)
+    engine.dispose()
+    
+    # Zipf: the word of rank r appears with probability proportional to 1/r
+    weights = [1 / r for r in range(1, VOCABULARY + 1)]
+    ranks = range(1, VOCABULARY + 1)
+    connection = sqlite3.connect(path)
+    batch = []
+    for doc_id in range(1, documents + 1):
+        words = ' '.join(word(r) for r in random.choices(ranks, weights, k=words_per_document))
+        batch.append((doc_id, f'document-{doc_id}.docx', None, None, words))
+        if len(batch) == 5000:
+            connection.executemany('INSERT INTO file_search (rowid, original_filename, title, author, content) VALUES (?, ?, ?, ?, ?)', batch)
+            connection.commit()
+            batch = []
+    connection.executemany('INSERT INTO file_search (rowid, original_filename, title, author, content) VALUES (?, ?, ?, ?, ?)', batch)
+    connection.execute("INSERT INTO file_search (file_search) VALUES ('optimize')")
+    connection.commit()
+    return connection
+
+def time_query(connection, term, pages, max_candidates):
+    """Median and p99 milliseconds to fetch page ``pages`` (1 = first) by following the cursor"""
+    query = f'"{term}"'
+    times = []
+    for _ in range(SAMPLES):
+        start = time.perf_counter()
+        floor = 0
+        if max_candidates:
+            row = connection.execute(FLOOR_SQL, {'query': query, 'offset': max_candidates - 1}).fetchone()
+            floor = row[0] if row else 0
+        rows = connection.execute(search_sql(False), {'query': query, 'floor': floor, 'limit': PAGE_SIZE}).fetchall()
+        for _ in range(pages - 1):
+            if len(rows) < PAGE_SIZE:
+                break
+            page_start = time.perf_counter()  # later pages skip the floor lookup
+            rows = connection.execute(search_sql(True), {'query': query, 'floor': floor, 'limit': PAGE_SIZE,
+                                                         'rank': rows[-1][1], 'id': rows[-1][0]}).fetchall()
+            start = page_start
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return statistics.median(times) * 1000, times[int(len(times) * 0.99)] * 1000
+
+if __name__ == '__main__':
+    documents = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+    words_per_document = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    max_candidates = int(sys.argv[3]) if len(sys.argv) > 3 else 10000
+    path = os.path.join(tempfile.mkdtemp(prefix='bench-search-'), 'search.db')
+    
+    start = time.perf_counter()
+    connection = build_index(path, documents, words_per_document)
+    print(f"{documents} documents x {words_per_document} words indexed in {time.perf_counter() - start:.1f} s "
+          f"({os.path.getsize(path) / 1024 / 1024:.0f} MB)")
+    
+    print(f"  {'word rank':>9} {'matches':>8}  {'page 1 p50':>10} {'p99':>7}  {'page 10 p50':>11} {'p99':>7}"
+          f"  {'rank all p50':>12} {'p99':>7}  (ms; max_candidates={max_candidates})")
+    try:
+        for rank in (20000, 2000, 200, 20):
+            term = word(rank)
+            matches = connection.execute('SELECT count(*) FROM file_search WHERE file_search MATCH ?', (f'"{term}"',)).fetchone()[0]
+            first_p50, first_p99 = time_query(connection, term, 1, max_candidates)
+            deep_p50, deep_p99 = time_query(connection, term, 10, max_candidates)
+            all_p50, all_p99 = time_query(connection, term, 1, 0)
+            print(f"  {rank:>9} {matches:>8}  {first_p50:>10.2f} {first_p99:>7.2f}  {deep_p50:>11.2f} {deep_p99:>7.2f}"
+                  f"  {all_p50:>12.2f} {all_p99:>7.2f}")
+    finally:
+        connection.close()
+        os.remove(path)
@@ -0,0 +1,72 @@
+"""
+Concurrency benchmark for the SQLite tuning profile
+
+Runs a mixed workload of file listings (reads) and download-link creation
+(writes to download_tokens) from many threads, once with default SQLite
+settings and once with the tuning profile (WAL, synchronous=NORMAL,
+busy_timeout, mmap and cache size), and reports throughput and failures.
+
+Usage: python benchmarks/bench_sqlite.py [requests] [threads] [write_ratio]
+"""
+
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_workload(requests_total, threads, write_ratio):
+    """Run in a child process so each profile gets its own app and database"""
+    work_dir = tempfile.mkdtemp(prefix='bench-sqlite-')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    os.environ['UPLOAD_FOLDER'] = os.path.join(work_dir, 'uploads')
+    os.environ['PASSWORD_HASH_EXECUTOR'] = 'inline'
+    os.environ['DOWNLOAD_TOKEN_FORMAT'] = 'legacy'  # every link is a database write
+    os.environ['MAIL_OUTBOX_SENDER'] = 'false'
+    sys.path.insert(0, ROOT)
+    
+    from app import create_app
+    
+    app = create_app()
+    client = app.test_client()
+    ops = client.post('/api/auth/ops/login', json={'email': 'ops@example.com', 'password': 'ops123'}).get_json()
+    ops_headers = {'Authorization': f"Bearer {ops['access_token']}"}
+    for i in range(200):
+        client.post('/api/ops/upload', headers=ops_headers, data={'file': (io.BytesIO(os.urandom(64)), f'seed{i}.docx')})
+    client.post('/api/auth/client/signup', json={'email': 'bench@example.com', 'password': 'bench'})
+    login = client.post('/api/auth/client/login', json={'email': 'bench@example.com', 'password': 'bench'}).get_json()
+    headers = {'Authorization': f"Bearer {login['access_token']}"}
+    write_every = max(1, round(1 / write_ratio)) if write_ratio > 0 else 0
+    
+    def request(i):
+        with app.test_client() as worker:
+            if write_every and i % write_every == 0:
+                return worker.get(f'/api/client/download-file/{i % 200 + 1}', headers=headers).status_code
+            return worker.get('/api/client/files?limit=50', headers=headers).status_code
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        statuses = list(pool.map(request, range(requests_total)))
+    elapsed = time.perf_counter() - start
+    
+    failed = len(statuses) - statuses.count(200)
+    profile = 'tuned' if app.config['SQLITE_TUNING'] else 'default'
+    print(f"  {profile:<8} {requests_total / elapsed:8.0f} requests/s   failed {failed:5d}   {elapsed:6.2f}s")
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        run_workload(int(sys.argv[2]), int(sys.argv[3]), float(sys.argv[4]))
+        sys.exit(0)
+    
+    requests_total = sys.argv[1] if len(sys.argv) > 1 else '2000'
+    threads = sys.argv[2] if len(sys.argv) > 2 else '16'
+    write_ratio = sys.argv[3] if len(sys.argv) > 3 else '0.2'
+    print(f"{requests_total} requests, {threads} threads, write ratio {write_ratio}")
+    for tuning in ('false', 'true'):
+        env = dict(os.environ, SQLITE_TUNING=tuning)
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--child', requests_total, threads, write_ratio],
+                       env=env, check=True)
@@ -0,0 +1,93 @@
+"""
+Upload and download throughput of the storage backends
+
+Stores files through BlobStore (the path every upload takes: hash while
+streaming, then publish under the digest) and reads them back through
+open_file (the path every download takes), once per backend:
+
+- local: a temporary directory
+- s3:    the server in S3_ENDPOINT_URL / S3_BUCKET (e.g. a local MinIO), or an
+         in-process moto server when moto is installed and no endpoint is set
+
+Usage: python benchmarks/bench_storage_backends.py [file_size_mb] [files]
+"""
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import BlobStore, LocalBackend, S3Backend
+
+BUFFER_SIZE = 65536
+
+def _s3_backend():
+    """Backend for the configured S3 server, or for a throwaway moto server; None if neither is available"""
+    endpoint_url, bucket = os.environ.get('S3_ENDPOINT_URL'), os.environ.get('S3_BUCKET')
+    if not endpoint_url:
+        try:
+            from moto.server import ThreadedMotoServer
+        except ImportError:
+            return None, None
+        server = ThreadedMotoServer(port=5055, verbose=False)
+        server.start()
+        endpoint_url, bucket = 'http://127.0.0.1:5055', 'bench'
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    else:
+        server = None
+    
+    backend = S3Backend(bucket, prefix='bench/', endpoint_url=endpoint_url,
+                        region_name=os.environ.get('S3_REGION') or 'us-east-1')
+    if server is not None:
+        backend.client.create_bucket(Bucket=bucket)
+    return backend, server
+
+def measure(store, file_size, files):
+    """Return (upload MB/s, download MB/s) for ``files`` random files of ``file_size`` bytes"""
+    payloads = [os.urandom(file_size) for _ in range(files)]
+    
+    start = time.perf_counter()
+    locators = [store.store_stream(io.BytesIO(payload))[2] for payload in payloads]
+    upload_seconds = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    for locator in locators:
+        with store.open_file(locator) as f:
+            while f.read(BUFFER_SIZE):
+                pass
+    download_seconds = time.perf_counter() - start
+    
+    for locator in locators:
+        store.backend.delete(locator)
+    megabytes = file_size * files / 1024 / 1024
+    return megabytes / upload_seconds, megabytes / download_seconds
+
+if __name__ == '__main__':
+    file_size = int(float(sys.argv[1]) * 1024 * 1024) if len(sys.argv) > 1 else 32 * 1024 * 1024
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    
+    print(f"{files} files of {file_size / 1024 / 1024:.1f} MB")
+    print(f"  {'backend':<8} {'upload MB/s':>12} {'download MB/s':>14}")
+    
+    local_root = tempfile.mkdtemp(prefix='bench-backends-')
+    try:
+        upload, download = measure(BlobStore(LocalBackend(local_root), BUFFER_SIZE), file_size, files)
+        print(f"  {'local':<8} {upload:>12.1f} {download:>14.1f}")
+    finally:
+        shutil.rmtree(local_root, ignore_errors=True)
+    
+    backend, server = _s3_backend()
+    if backend is None:
+        print("  s3       skipped (set S3_ENDPOINT_URL and S3_BUCKET, or install moto)")
+    else:
+        try:
+            upload, download = measure(BlobStore(backend, BUFFER_SIZE), file_size, files)
+            print(f"  {'s3':<8} {upload:>12.1f} {download:>14.1f}")
+        finally:
+            if server is not None:
+                server.stop()
@@ -0,0 +1,79 @@
+"""
+Benchmark of the on-disk storage layout
+
+Fills a flat directory and a sharded one (STORAGE_SHARD_DEPTH levels of
+hash-prefix subdirectories) up to each directory size, then measures the
+latency of creating new files and of stat()-ing random existing ones, the
+two operations every upload and download performs.
+
+Usage: python benchmarks/bench_storage_layout.py [sizes] [depth]
+       e.g. python benchmarks/bench_storage_layout.py 1000,10000,100000 2
+"""
+
+import hashlib
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import shard_path
+
+SAMPLES = 1000
+
+def _digest(i):
+    return hashlib.sha256(str(i).encode()).hexdigest()
+
+def _percentiles(latencies):
+    latencies = sorted(latencies)
+    return (statistics.median(latencies) * 1e6, latencies[int(len(latencies) * 0.99)] * 1e6)
+
+def _create(path):
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_WRONLY | os.O_EXCL)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_CREAT | os.O_WRONLY | os.O_EXCL)
+    os.close(fd)
+
+def measure(root, depth, size):
+    """Fill root with ``size`` files, then time SAMPLES creates and SAMPLES stats"""
+    for i in range(size):
+        _create(shard_path(root, _digest(i), depth))
+    
+    create_times = []
+    for i in range(size, size + SAMPLES):
+        path = shard_path(root, _digest(i), depth)
+        start = time.perf_counter()
+        _create(path)
+        create_times.append(time.perf_counter() - start)
+    
+    stat_times = []
+    for i in random.sample(range(size + SAMPLES), SAMPLES):
+        path = shard_path(root, _digest(i), depth)
+        start = time.perf_counter()
+        os.stat(path)
+        stat_times.append(time.perf_counter() - start)
+    
+    return _percentiles(create_times), _percentiles(stat_times)
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in (sys.argv[1] if len(sys.argv) > 1 else '1000,10000,100000').split(',')]
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    base = tempfile.mkdtemp(prefix='bench-layout-')
+    
+    print(f"{'files':>8}  {'layout':<10} {'create p50':>11} {'create p99':>11} {'stat p50':>9} {'stat p99':>9}  (microseconds)")
+    try:
+        for size in sizes:
+            for name, layout_depth in (('flat', 0), (f'sharded/{depth}', depth)):
+                root = os.path.join(base, f'{name.replace("/", "-")}-{size}')
+                os.makedirs(root)
+                (create_p50, create_p99), (stat_p50, stat_p99) = measure(root, layout_depth, size)
+                print(f"{size:>8}  {name:<10} {create_p50:>11.1f} {create_p99:>11.1f} {stat_p50:>9.1f} {stat_p99:>9.1f}")
+                shutil.rmtree(root)
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
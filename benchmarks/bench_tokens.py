@@ -0,0 +1,80 @@
+"""
+Benchmark for download token encryption and worker cold start
+
+Compares the original setup (a password-derived key, encrypted legacy tokens)
+with the keyring setup (raw keys, compact signed tokens). Cold start is timed
+in a fresh interpreter per sample, so nothing derived by an earlier sample is
+reused.
+
+Usage: python benchmarks/bench_tokens.py [iterations]
+"""
+
+import base64
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils import EncryptionService, TokenService, derive_key
+
+PASSWORD = 'benchmark-encryption-password'
+RAW_KEY_B64 = b'tIUBYy-QKS7lO0dGEaXtrgMxcgSw5RAJTX0aWH2J_XU='
+RAW_KEY = base64.urlsafe_b64decode(RAW_KEY_B64)
+
+# Runs in a fresh interpreter: imports first, then times only the service construction
+COLD_START = """
+import base64, sys, time
+sys.path.insert(0, {root!r})
+from utils import EncryptionService, TokenService
+start = time.perf_counter()
+TokenService(EncryptionService({args}))
+print(time.perf_counter() - start)
+"""
+
+def cold_start(args, samples=5):
+    """Median seconds to build the token services in a new process"""
+    code = COLD_START.format(root=ROOT, args=args)
+    return statistics.median(
+        float(subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout)
+        for _ in range(samples)
+    )
+
+def bench_cold_start():
+    print("Worker cold start (EncryptionService + TokenService construction, fresh process)")
+    
+    results = [
+        ('before: password key (PBKDF2 on start)', cold_start(repr(PASSWORD))),
+        ('after: raw key from keyring', cold_start(f"keys={{1: base64.urlsafe_b64decode({RAW_KEY_B64!r})}}")),
+    ]
+    for label, seconds in results:
+        print(f"  {label:<40} {seconds * 1000:10.3f} ms")
+    print("  (a worker forked after the app is loaded inherits the derived keys and pays neither)")
+
+def bench_tokens(iterations):
+    print(f"\nToken throughput ({iterations} tokens)")
+    token_service = TokenService(EncryptionService(keys={0: derive_key(PASSWORD), 1: RAW_KEY}))
+    
+    for label, generate in [
+        ('before: legacy encrypted token', token_service.generate_download_token),
+        ('after: compact signed token', token_service.generate_compact_token),
+    ]:
+        start = time.perf_counter()
+        tokens = [generate(i, 1) for i in range(iterations)]
+        generate_seconds = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        for token in tokens:
+            assert token_service.validate_download_token(token)
+        validate_seconds = time.perf_counter() - start
+        
+        print(f"  {label:<40} generate {iterations / generate_seconds:10.0f}/s"
+              f"   validate {iterations / validate_seconds:10.0f}/s   length {len(tokens[0])}")
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    bench_cold_start()
+    bench_tokens(iterations)
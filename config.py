@@ -9,6 +9,57 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_DATABASE_URI') or 'sqlite:///file_sharing.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Connection pool sizing (only options that are set are passed to the engine)
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        key: int(os.environ[env])
+        for key, env in [('pool_size', 'DB_POOL_SIZE'), ('max_overflow', 'DB_MAX_OVERFLOW'),
+                         ('pool_timeout', 'DB_POOL_TIMEOUT'), ('pool_recycle', 'DB_POOL_RECYCLE')]
+        if os.environ.get(env)
+    }
+    
+    # SQLite tuning profile, applied to every pooled connection
+    SQLITE_TUNING = os.environ.get('SQLITE_TUNING', 'true').lower() in ['true', 'on', '1']
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE') or 'WAL'
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL'
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 10000)  # ms
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 268435456)  # 256MB
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE') or -65536)  # 64MB (negative = KiB)
+    
+    # Password hashing: runs in a bounded pool ('process', 'thread' or 'inline'); logins get
+    # 503 + Retry-After when PASSWORD_HASH_MAX_PENDING jobs are queued. Stored hashes made
+    # with a different PASSWORD_HASH_METHOD are upgraded on the next successful login
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'pbkdf2:sha256:600000'
+    PASSWORD_HASH_EXECUTOR = (os.environ.get('PASSWORD_HASH_EXECUTOR') or 'process').lower()
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or 0) or None  # default: CPU count
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING') or 0) or None  # default: 4 x workers
+    PASSWORD_HASH_RETRY_AFTER = int(os.environ.get('PASSWORD_HASH_RETRY_AFTER') or 1)
+    
+    # Seconds a user's role/token version is cached in-process for JWT authorization
+    IDENTITY_CACHE_TTL = float(os.environ.get('IDENTITY_CACHE_TTL') or 30)
+    
+    # Background maintenance (token purge, incremental vacuum, ANALYZE); safe to run in every
+    # worker process, each job is leased to one process at a time
+    MAINTENANCE_SCHEDULER = os.environ.get('MAINTENANCE_SCHEDULER', 'true').lower() in ['true', 'on', '1']
+    MAINTENANCE_POLL_INTERVAL = float(os.environ.get('MAINTENANCE_POLL_INTERVAL') or 30)
+    MAINTENANCE_JOB_LEASE = int(os.environ.get('MAINTENANCE_JOB_LEASE') or 900)
+    MAINTENANCE_BATCH_SIZE = int(os.environ.get('MAINTENANCE_BATCH_SIZE') or 500)
+    MAINTENANCE_BATCH_PAUSE = float(os.environ.get('MAINTENANCE_BATCH_PAUSE') or 0.05)  # seconds between batches
+    MAINTENANCE_VACUUM_PAGES = int(os.environ.get('MAINTENANCE_VACUUM_PAGES') or 2000)
+    MAINTENANCE_HISTORY_DAYS = int(os.environ.get('MAINTENANCE_HISTORY_DAYS') or 30)
+    MAINTENANCE_TOKEN_PURGE_INTERVAL = int(os.environ.get('MAINTENANCE_TOKEN_PURGE_INTERVAL') or 600)
+    MAINTENANCE_VACUUM_INTERVAL = int(os.environ.get('MAINTENANCE_VACUUM_INTERVAL') or 3600)
+    MAINTENANCE_ANALYZE_INTERVAL = int(os.environ.get('MAINTENANCE_ANALYZE_INTERVAL') or 86400)
+    MAINTENANCE_HISTORY_PURGE_INTERVAL = int(os.environ.get('MAINTENANCE_HISTORY_PURGE_INTERVAL') or 86400)
+    MAINTENANCE_RECONCILE_INTERVAL = int(os.environ.get('MAINTENANCE_RECONCILE_INTERVAL') or 300)
+    MAINTENANCE_UPLOAD_PURGE_INTERVAL = int(os.environ.get('MAINTENANCE_UPLOAD_PURGE_INTERVAL') or 3600)
+    
+    # Upload directory reconciliation: files no row references are orphans ('quarantine', 'delete'
+    # or 'report', the default, which only logs them); files younger than the grace period may
+    # belong to an upload still in flight
+    RECONCILE_ACTION = os.environ.get('RECONCILE_ACTION') or 'report'
+    RECONCILE_GRACE = int(os.environ.get('RECONCILE_GRACE') or 3600)
+    RECONCILE_SCAN_LIMIT = int(os.environ.get('RECONCILE_SCAN_LIMIT') or 20000)  # files + rows examined per run
+    
     # Email settings
     MAIL_SERVER = os.environ.get('MAIL_SERVER') or 'smtp.gmail.com'
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 587)
@@ -17,12 +68,106 @@ class Config:
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER')
     
+    # Email outbox: requests only queue emails; a background thread sends them in
+    # batches over one SMTP connection and retries failures with exponential backoff
+    MAIL_OUTBOX_SENDER = os.environ.get('MAIL_OUTBOX_SENDER', 'true').lower() in ['true', 'on', '1']
+    MAIL_OUTBOX_POLL_INTERVAL = float(os.environ.get('MAIL_OUTBOX_POLL_INTERVAL') or 5)
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE') or 50)
+    MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS') or 8)
+    MAIL_RETRY_BACKOFF = int(os.environ.get('MAIL_RETRY_BACKOFF') or 30)  # seconds before the first retry
+    MAIL_RETRY_BACKOFF_MAX = int(os.environ.get('MAIL_RETRY_BACKOFF_MAX') or 3600)
+    MAIL_SEND_LEASE = int(os.environ.get('MAIL_SEND_LEASE') or 300)  # seconds before a stuck claim is retried
+    
+    # Post-upload processing: uploads only queue a job; worker threads run the registered stages
+    # (digest verification, format validation) and retry failed ones with exponential backoff
+    PROCESSING_WORKERS = int(os.environ.get('PROCESSING_WORKERS') or 2)  # threads per app process; 0 = only `python processing.py`
+    PROCESSING_POLL_INTERVAL = float(os.environ.get('PROCESSING_POLL_INTERVAL') or 5)
+    PROCESSING_MAX_ATTEMPTS = int(os.environ.get('PROCESSING_MAX_ATTEMPTS') or 5)
+    PROCESSING_RETRY_BACKOFF = int(os.environ.get('PROCESSING_RETRY_BACKOFF') or 30)  # seconds before the first retry
+    PROCESSING_RETRY_BACKOFF_MAX = int(os.environ.get('PROCESSING_RETRY_BACKOFF_MAX') or 3600)
+    PROCESSING_JOB_LEASE = int(os.environ.get('PROCESSING_JOB_LEASE') or 600)  # seconds per stage before a stuck job is retried
+    
     # File upload settings
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or 'uploads'
+    BLOB_FOLDER = os.environ.get('BLOB_FOLDER') or os.path.join(UPLOAD_FOLDER, 'blobs')  # content-addressed storage
+    # Where stored files live: 'local' (BLOB_FOLDER) or 's3' (any S3-compatible server; needs boto3).
+    # S3 credentials fall back to the usual AWS environment variables and config files
+    STORAGE_BACKEND = (os.environ.get('STORAGE_BACKEND') or 'local').lower()
+    S3_BUCKET = os.environ.get('S3_BUCKET')
+    S3_PREFIX = os.environ.get('S3_PREFIX') or ''
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')  # e.g. http://localhost:9000 for MinIO
+    S3_REGION = os.environ.get('S3_REGION')
+    S3_ACCESS_KEY_ID = os.environ.get('S3_ACCESS_KEY_ID')
+    S3_SECRET_ACCESS_KEY = os.environ.get('S3_SECRET_ACCESS_KEY')
+    S3_PART_SIZE = int(os.environ.get('S3_PART_SIZE') or 8388608)  # 8MB multipart upload parts (min 5MB)
+    # At-rest encryption of new stored files (AES-256-GCM segments, per-file data keys wrapped with a key
+    # derived from ENCRYPTION_KEY/ENCRYPTION_KEYS); files are decrypted on read whatever this is set to
+    STORAGE_ENCRYPTION = os.environ.get('STORAGE_ENCRYPTION', 'false').lower() in ['true', 'on', '1']
+    STORAGE_ENCRYPTION_SEGMENT_SIZE = int(os.environ.get('STORAGE_ENCRYPTION_SEGMENT_SIZE') or 65536)  # 64KB
+    # Files are spread over this many levels of hash-prefix subdirectories (256 per level, 0 = flat);
+    # run `python shard_migration.py` after changing it
+    STORAGE_SHARD_DEPTH = int(os.environ.get('STORAGE_SHARD_DEPTH') or 2)
+    QUARANTINE_FOLDER = os.environ.get('QUARANTINE_FOLDER') or os.path.join(UPLOAD_FOLDER, '.quarantine')  # orphaned files
     MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH') or 16777216)  # 16MB
     
+    # Chunked (resumable) upload settings
+    MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE') or 2147483648)  # 2GB
+    UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE') or 8388608)  # 8MB, must stay below MAX_CONTENT_LENGTH
+    UPLOAD_STREAM_BUFFER = int(os.environ.get('UPLOAD_STREAM_BUFFER') or 65536)  # 64KB
+    UPLOAD_CHUNK_LEASE = int(os.environ.get('UPLOAD_CHUNK_LEASE') or 300)  # seconds a PATCH may hold an upload
+    UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL') or 86400)  # idle uploads are purged after this
+    
+    # Downloads: after the first request a used token still serves Range/conditional
+    # requests for this many seconds (bounded by the token's own expiry)
+    DOWNLOAD_RESUME_WINDOW = int(os.environ.get('DOWNLOAD_RESUME_WINDOW') or 3600)
+    
+    # In-process cache of small, popular files' bytes for direct downloads (per worker process);
+    # files larger than HOT_FILE_CACHE_MAX_OBJECT are always read from storage
+    HOT_FILE_CACHE = os.environ.get('HOT_FILE_CACHE', 'false').lower() in ['true', 'on', '1']
+    HOT_FILE_CACHE_MAX_BYTES = int(os.environ.get('HOT_FILE_CACHE_MAX_BYTES') or 67108864)  # 64MB
+    HOT_FILE_CACHE_MAX_OBJECT = int(os.environ.get('HOT_FILE_CACHE_MAX_OBJECT') or 1048576)  # 1MB
+    
+    # Download link format: 'legacy' (encrypted token stored in download_tokens, single use across
+    # all processes) or 'compact' (short signed token, no database row, one-time use enforced by an
+    # in-process replay filter, so only strictly single use in single-process deployments)
+    DOWNLOAD_TOKEN_FORMAT = (os.environ.get('DOWNLOAD_TOKEN_FORMAT') or 'legacy').lower()
+    TOKEN_REPLAY_FILTER_CAPACITY = int(os.environ.get('TOKEN_REPLAY_FILTER_CAPACITY') or 100000)  # redemptions per expiry hour
+    TOKEN_REPLAY_FILTER_ERROR_RATE = float(os.environ.get('TOKEN_REPLAY_FILTER_ERROR_RATE') or 1e-6)
+    
+    # How file bytes are served: 'direct' (Flask streams the file), 'x-accel-redirect'
+    # (nginx) or 'x-sendfile' (lighttpd/Apache); in proxy modes Python only checks the token
+    DOWNLOAD_SERVE_MODE = (os.environ.get('DOWNLOAD_SERVE_MODE') or 'direct').lower()
+    X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX') or '/protected-files/'  # internal location mapped to UPLOAD_FOLDER
+    
+    # File listing page sizes
+    FILES_PAGE_SIZE = int(os.environ.get('FILES_PAGE_SIZE') or 100)
+    FILES_MAX_PAGE_SIZE = int(os.environ.get('FILES_MAX_PAGE_SIZE') or 500)
+    
+    # Full-text search (SQLite FTS5): result page sizes and characters of document text indexed per file
+    SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE') or 20)
+    SEARCH_MAX_PAGE_SIZE = int(os.environ.get('SEARCH_MAX_PAGE_SIZE') or 100)
+    SEARCH_MAX_TEXT = int(os.environ.get('SEARCH_MAX_TEXT') or 1000000)
+    # Only the newest this many matches of a query are ranked, which bounds the cost of very common words
+    SEARCH_MAX_CANDIDATES = int(os.environ.get('SEARCH_MAX_CANDIDATES') or 10000)
+    
+    # Seconds clients may cache a package member (members of a stored file never change)
+    MEMBER_CACHE_MAX_AGE = int(os.environ.get('MEMBER_CACHE_MAX_AGE') or 3600)
+    
+    # Document thumbnails: built on first request and kept in a size-bounded LRU disk cache
+    PREVIEW_CACHE_FOLDER = os.environ.get('PREVIEW_CACHE_FOLDER') or os.path.join(UPLOAD_FOLDER, '.previews')
+    PREVIEW_CACHE_MAX_BYTES = int(os.environ.get('PREVIEW_CACHE_MAX_BYTES') or 268435456)  # 256MB
+    PREVIEW_CACHE_MAX_AGE = int(os.environ.get('PREVIEW_CACHE_MAX_AGE') or 86400)  # seconds clients may reuse a preview
+    PREVIEW_MAX_SOURCE_SIZE = int(os.environ.get('PREVIEW_MAX_SOURCE_SIZE') or 2097152)  # larger embedded thumbnails get a placeholder
+    
+    # Maximum number of files in one bulk ZIP download
+    BULK_DOWNLOAD_MAX_FILES = int(os.environ.get('BULK_DOWNLOAD_MAX_FILES') or 50)
+    
     # Encryption
     ENCRYPTION_KEY = os.environ.get('ENCRYPTION_KEY') or b'default-key-32-bytes-long-here!'
+    # Optional keyring for rotation, e.g. "0:<old ENCRYPTION_KEY>,1:raw:<urlsafe base64 32-byte key>";
+    # when set it replaces ENCRYPTION_KEY. New tokens use ENCRYPTION_ACTIVE_KEY_ID (default: highest id)
+    ENCRYPTION_KEYS = os.environ.get('ENCRYPTION_KEYS')
+    ENCRYPTION_ACTIVE_KEY_ID = int(os.environ['ENCRYPTION_ACTIVE_KEY_ID']) if os.environ.get('ENCRYPTION_ACTIVE_KEY_ID') else None
     
     # Allowed file extensions
     ALLOWED_EXTENSIONS = {'pptx', 'docx', 'xlsx'}
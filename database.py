@@ -0,0 +1,35 @@
+from sqlalchemy import event
+from models import db
+
+def sqlite_pragmas(config):
+    """PRAGMA statements applied to every new SQLite connection, in order"""
+    return [
+        "PRAGMA auto_vacuum=INCREMENTAL",  # only takes effect on a new, empty database
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",  # WAL: readers no longer block the writer
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",  # NORMAL is durable at checkpoints and safe with WAL
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT'])}",  # wait for locks instead of failing at once
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+        f"PRAGMA cache_size={int(config['SQLITE_CACHE_SIZE'])}",  # negative values are KiB
+        "PRAGMA foreign_keys=ON",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+def configure_database(app):
+    """Apply the SQLite tuning profile to every pooled connection of the app's engine.
+    
+    Must run inside an app context before the first connection is opened.
+    """
+    engine = db.engine
+    if engine.dialect.name != 'sqlite' or not app.config['SQLITE_TUNING']:
+        return
+    
+    pragmas = sqlite_pragmas(app.config)
+    
+    @event.listens_for(engine, 'connect')
+    def _apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
@@ -0,0 +1,219 @@
+"""
+Streaming at-rest encryption for stored files
+
+Each file gets a random 256-bit data key, wrapped (AES-GCM) with a key
+derived from the application keyring and stored in the file header, so
+rotating the master key never requires re-encrypting file contents. The
+content is split into fixed-size segments, each sealed with AES-GCM under
+its own nonce (a per-file random prefix, the segment index and a flag
+marking the final segment), so segments cannot be reordered, truncated or
+moved between files, and any byte range can be decrypted by reading only
+the segments it touches.
+
+Layout: header | segment 0 | segment 1 | ... | final segment
+  header  = magic "SFE1", key id (1 byte), segment size (4 bytes),
+            nonce prefix (7 bytes), wrap nonce (12 bytes), wrapped data key (48 bytes)
+  segment = ciphertext of up to segment-size bytes + 16-byte tag
+"""
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+import io
+import os
+import struct
+
+MAGIC = b'SFE1'
+TAG_SIZE = 16
+_HEADER = struct.Struct('>4sBI7s12s48s')
+HEADER_SIZE = _HEADER.size
+_HEADER_AAD_SIZE = 4 + 1 + 4 + 7  # the wrapped key is bound to the header fields before it
+
+class FileCipher:
+    """Encrypts new files with the active key and decrypts files written with any key in the ring"""
+    
+    def __init__(self, keys: dict, active_key_id: int, segment_size: int = 65536):
+        self.keys = {key_id: AESGCM(key) for key_id, key in keys.items()}
+        self.active_key_id = active_key_id
+        self.segment_size = segment_size
+    
+    @classmethod
+    def from_encryption_service(cls, encryption_service, segment_size: int = 65536):
+        """Derive one key-wrapping key per key in the application keyring"""
+        keys = {key_id: encryption_service.derive_subkey(b'file-encryption-v1', key_id)
+                for key_id in encryption_service.keys}
+        return cls(keys, encryption_service.active_key_id, segment_size)
+    
+    def encryptor(self):
+        return SegmentEncryptor(self)
+    
+    def open(self, raw, probe: bool = True):
+        """Return a plaintext view of an encrypted file opened in binary mode.
+        
+        With ``probe`` (files whose encryption was not recorded), a file without
+        a valid header is taken to be plaintext and returned as it is.
+        """
+        header = _read_exactly(raw, HEADER_SIZE)
+        if not header.startswith(MAGIC) or (probe and not self.is_header(header)):
+            if not probe:
+                raise ValueError('Stored file has no encryption header')
+            raw.seek(0)
+            return raw
+        return DecryptingReader(raw, self, header)
+    
+    def is_header(self, header: bytes) -> bool:
+        """True if ``header`` is an encryption header, checked by unwrapping its data key.
+        
+        Plaintext that merely starts with the magic bytes fails the key's
+        authentication (or names a key id missing from the ring, which is why
+        retired keys must stay in the keyring).
+        """
+        if len(header) != HEADER_SIZE or not header.startswith(MAGIC) or header[4] not in self.keys:
+            return False
+        try:
+            self._unwrap(header)
+        except InvalidTag:
+            return False
+        return True
+    
+    def is_encrypted(self, raw) -> bool:
+        """True if a stored file opened in binary mode (at its start) has a valid encryption header"""
+        return self.is_header(_read_exactly(raw, HEADER_SIZE))
+    
+    def _unwrap(self, header: bytes):
+        magic, key_id, segment_size, nonce_prefix, wrap_nonce, wrapped_key = _HEADER.unpack(header)
+        if key_id not in self.keys:
+            raise ValueError(f'Stored file was encrypted with unknown key id {key_id}')
+        data_key = self.keys[key_id].decrypt(wrap_nonce, wrapped_key, header[:_HEADER_AAD_SIZE])
+        return AESGCM(data_key), segment_size, nonce_prefix
+
+def _segment_nonce(nonce_prefix: bytes, index: int, final: bool) -> bytes:
+    return nonce_prefix + struct.pack('>I?', index, final)
+
+def _read_exactly(raw, size: int) -> bytes:
+    """Read ``size`` bytes unless the stream ends first (raw reads may return less)"""
+    data = bytearray()
+    while len(data) < size:
+        chunk = raw.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return bytes(data)
+
+class SegmentEncryptor:
+    """Incremental encryption: ``header``, then ``update()`` per chunk and ``finalize()`` once"""
+    
+    def __init__(self, cipher: FileCipher):
+        data_key = AESGCM.generate_key(bit_length=256)
+        self.aead = AESGCM(data_key)
+        self.segment_size = cipher.segment_size
+        self.nonce_prefix = os.urandom(7)
+        self.index = 0
+        self.buffer = bytearray()
+        
+        wrap_nonce = os.urandom(12)
+        fields = (MAGIC, cipher.active_key_id, self.segment_size, self.nonce_prefix)
+        aad = struct.pack('>4sBI7s', *fields)
+        wrapped_key = cipher.keys[cipher.active_key_id].encrypt(wrap_nonce, data_key, aad)
+        self.header = _HEADER.pack(*fields, wrap_nonce, wrapped_key)
+    
+    def _seal(self, plaintext: bytes, final: bool) -> bytes:
+        sealed = self.aead.encrypt(_segment_nonce(self.nonce_prefix, self.index, final), plaintext, None)
+        self.index += 1
+        return sealed
+    
+    def update(self, chunk: bytes) -> bytes:
+        """Encrypt every complete segment; one segment is held back until it is known not to be the last"""
+        self.buffer += chunk
+        output = []
+        while len(self.buffer) > self.segment_size:
+            output.append(self._seal(bytes(self.buffer[:self.segment_size]), final=False))
+            del self.buffer[:self.segment_size]
+        return b''.join(output)
+    
+    def finalize(self) -> bytes:
+        sealed = self._seal(bytes(self.buffer), final=True)
+        self.buffer = bytearray()
+        return sealed
+
+class DecryptingReader(io.RawIOBase):
+    """Seekable plaintext view of an encrypted file; only the segments that are read get decrypted"""
+    
+    def __init__(self, raw, cipher: FileCipher, header: bytes):
+        self.raw = raw
+        self.aead, self.segment_size, self.nonce_prefix = cipher._unwrap(header)
+        self.position = 0
+        self.segment_index = None
+        self.segment = b''
+        self.segment_final = False
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def tell(self):
+        return self.position
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self._plaintext_size()
+        self.position = offset
+        return self.position
+    
+    def _plaintext_size(self):
+        stored = self.raw.seek(0, io.SEEK_END) - HEADER_SIZE
+        sealed_segment = self.segment_size + TAG_SIZE
+        full_segments, last = divmod(stored, sealed_segment)
+        if last == 0:  # the final segment is full-sized
+            full_segments, last = full_segments - 1, sealed_segment
+        return full_segments * self.segment_size + last - TAG_SIZE
+    
+    def _load(self, index):
+        offset = HEADER_SIZE + index * (self.segment_size + TAG_SIZE)
+        if self.raw.tell() != offset:
+            self.raw.seek(offset)
+        sealed = _read_exactly(self.raw, self.segment_size + TAG_SIZE)
+        if not sealed:
+            return False
+        
+        # A full-sized segment is normally followed by more; a short one can only be the last
+        attempts = (False, True) if len(sealed) == self.segment_size + TAG_SIZE else (True,)
+        for final in attempts:
+            try:
+                self.segment = self.aead.decrypt(_segment_nonce(self.nonce_prefix, index, final), sealed, None)
+                break
+            except InvalidTag:
+                continue
+        else:
+            raise ValueError(f'Stored file segment {index} failed authentication')
+        self.segment_index, self.segment_final = index, final
+        return True
+    
+    def readinto(self, buffer):
+        """Fill ``buffer`` from as many segments as needed; returns 0 at the end of the file"""
+        view = memoryview(buffer)
+        filled = 0
+        while filled < len(view):
+            index, offset = divmod(self.position, self.segment_size)
+            if self.segment_index != index and not self._load(index):
+                self._check_complete(index)
+                break
+            available = self.segment[offset:offset + len(view) - filled]
+            if not available:
+                break  # end of the final segment
+            view[filled:filled + len(available)] = available
+            filled += len(available)
+            self.position += len(available)
+        return filled
+    
+    def _check_complete(self, index):
+        """Running out of segments is only the end of the file if the last one was marked final"""
+        if index == 0 or (self.segment_index != index - 1 and not self._load(index - 1)) or not self.segment_final:
+            raise ValueError('Stored file is truncated')
+    
+    def close(self):
+        self.raw.close()
+        super().close()
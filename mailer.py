@@ -0,0 +1,129 @@
+from flask_mail import Message
+from models import db, mail, OutboxEmail
+from sqlalchemy import update, or_, and_
+from datetime import datetime, timedelta
+import smtplib
+import threading
+
+# Wakes the sender thread of this process as soon as something is queued
+_outbox_event = threading.Event()
+
+def enqueue_email(subject, recipients, body=None, html=None):
+    """Queue an email in the outbox; it is sent when the caller's transaction commits"""
+    email = OutboxEmail(
+        recipients=','.join(recipients),
+        subject=subject,
+        body=body,
+        html=html
+    )
+    db.session.add(email)
+    return email
+
+def notify_outbox():
+    """Wake this process's sender after queued emails have been committed"""
+    _outbox_event.set()
+
+def _claim_batch(batch_size, lease_seconds):
+    """Claim due outbox rows with conditional UPDATEs so concurrent senders never share a message"""
+    now = datetime.utcnow()
+    due = or_(
+        and_(OutboxEmail.status == 'pending', OutboxEmail.next_attempt_at <= now),
+        and_(OutboxEmail.status == 'sending', OutboxEmail.locked_until < now)  # lease of a crashed sender
+    )
+    candidates = [row.id for row in db.session.query(OutboxEmail.id).filter(due)
+                  .order_by(OutboxEmail.next_attempt_at).limit(batch_size)]
+    
+    claimed = []
+    for email_id in candidates:
+        result = db.session.execute(
+            update(OutboxEmail)
+            .where(OutboxEmail.id == email_id, due)
+            .values(status='sending', locked_until=now + timedelta(seconds=lease_seconds))
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            claimed.append(email_id)
+    db.session.commit()
+    return OutboxEmail.query.filter(OutboxEmail.id.in_(claimed)).all() if claimed else []
+
+def _record_failure(email, error, config):
+    email.attempts += 1
+    email.last_error = str(error)[:1000]
+    email.locked_until = None
+    if email.attempts >= config['MAIL_MAX_ATTEMPTS']:
+        email.status = 'failed'
+    else:
+        # Exponential backoff: base, 2 x base, 4 x base, ... capped
+        delay = min(config['MAIL_RETRY_BACKOFF'] * 2 ** (email.attempts - 1), config['MAIL_RETRY_BACKOFF_MAX'])
+        email.status = 'pending'
+        email.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+
+def send_outbox_batch(app):
+    """Send one batch of due outbox emails over a single SMTP connection; returns the number sent"""
+    config = app.config
+    emails = _claim_batch(config['MAIL_BATCH_SIZE'], config['MAIL_SEND_LEASE'])
+    if not emails:
+        return 0
+    
+    sent = 0
+    pending = list(emails)
+    connected = False
+    try:
+        with mail.connect() as connection:
+            connected = True
+            while pending:
+                email = pending[0]
+                message = Message(email.subject, recipients=email.recipients.split(','),
+                                  body=email.body, html=email.html)
+                try:
+                    connection.send(message)
+                except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                    # The connection is gone: this message failed, the rest of the batch
+                    # was never handed to the server and is released below
+                    _record_failure(email, e, config)
+                    pending.pop(0)
+                    raise
+                except Exception as e:
+                    # Refused recipients (SMTPRecipientsRefused), a rejected message
+                    # (SMTPResponseException) and the like only fail this message; every
+                    # SMTP error is an OSError, so these must not abort the batch
+                    _record_failure(email, e, config)
+                else:
+                    email.status = 'sent'
+                    email.sent_at = datetime.utcnow()
+                    email.locked_until = None
+                    sent += 1
+                pending.pop(0)
+                db.session.commit()
+    except Exception as e:
+        for email in pending:
+            if not connected:
+                # No connection at all (the server is down): every message backs off, and
+                # fails for good after MAIL_MAX_ATTEMPTS like any other failure
+                _record_failure(email, e, config)
+            else:
+                # The connection dropped: messages that were not attempted go back to the
+                # queue without using up an attempt
+                email.status = 'pending'
+                email.locked_until = None
+                email.last_error = str(e)[:1000]
+        db.session.commit()
+    return sent
+
+def _sender_loop(app):
+    while True:
+        _outbox_event.wait(app.config['MAIL_OUTBOX_POLL_INTERVAL'])
+        _outbox_event.clear()
+        try:
+            with app.app_context():
+                # Keep draining while full batches come back
+                while send_outbox_batch(app) >= app.config['MAIL_BATCH_SIZE']:
+                    pass
+        except Exception as e:
+            app.logger.warning('Email outbox sender error: %s', e)
+
+def start_outbox_sender(app):
+    """Start the background thread that delivers queued emails"""
+    thread = threading.Thread(target=_sender_loop, args=(app,), name='email-outbox-sender', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,199 @@
+from models import db, DownloadToken, MaintenanceJob, MaintenanceRun, UploadSession
+from reconcile import reconcile_uploads
+from sqlalchemy import update, delete, select, or_, and_, text
+from datetime import datetime, timedelta
+import os
+import socket
+import threading
+import time
+
+# Identifies this process in job leases
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+def purge_download_tokens(app):
+    """Delete expired tokens and used tokens past their resume window, in small batches"""
+    config = app.config
+    batch_size = config['MAINTENANCE_BATCH_SIZE']
+    deleted = 0
+    while True:
+        now = datetime.utcnow()
+        stale = or_(
+            DownloadToken.expires_at < now,
+            and_(DownloadToken.is_used == True,
+                 DownloadToken.used_at < now - timedelta(seconds=config['DOWNLOAD_RESUME_WINDOW']))
+        )
+        ids = select(DownloadToken.id).where(stale).limit(batch_size).scalar_subquery()
+        result = db.session.execute(delete(DownloadToken).where(DownloadToken.id.in_(ids))
+                                    .execution_options(synchronize_session=False))
+        db.session.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+        # Release the write lock between batches so requests are not starved
+        time.sleep(config['MAINTENANCE_BATCH_PAUSE'])
+
+def purge_maintenance_runs(app):
+    """Trim the maintenance run history"""
+    cutoff = datetime.utcnow() - timedelta(days=app.config['MAINTENANCE_HISTORY_DAYS'])
+    result = db.session.execute(delete(MaintenanceRun).where(MaintenanceRun.started_at < cutoff))
+    db.session.commit()
+    return result.rowcount
+
+def purge_upload_sessions(app):
+    """Delete resumable uploads idle for longer than UPLOAD_SESSION_TTL, with their partial files"""
+    config = app.config
+    batch_size = config['MAINTENANCE_BATCH_SIZE']
+    deleted = 0
+    while True:
+        now = datetime.utcnow()
+        # Never purge an upload while a PATCH holds its write lease
+        stale = and_(UploadSession.updated_at < now - timedelta(seconds=config['UPLOAD_SESSION_TTL']),
+                     or_(UploadSession.locked_until.is_(None), UploadSession.locked_until < now))
+        rows = db.session.execute(
+            select(UploadSession.id, UploadSession.temp_path).where(stale).limit(batch_size)
+        ).all()
+        purged = []
+        for upload_id, temp_path in rows:
+            # Conditional per row, so an upload resumed since the SELECT is kept
+            result = db.session.execute(delete(UploadSession).where(UploadSession.id == upload_id, stale)
+                                        .execution_options(synchronize_session=False))
+            if result.rowcount:
+                purged.append(temp_path)
+        db.session.commit()
+        for temp_path in purged:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        deleted += len(purged)
+        if len(rows) < batch_size:
+            break
+        time.sleep(config['MAINTENANCE_BATCH_PAUSE'])
+    
+    # Partial files left without a session (a request that failed before its commit)
+    partial_folder = os.path.join(config['UPLOAD_FOLDER'], '.partial')
+    cutoff = time.time() - config['UPLOAD_SESSION_TTL']
+    if os.path.isdir(partial_folder):
+        for entry in os.scandir(partial_folder):
+            upload_id = entry.name.rsplit('.', 1)[0]
+            try:
+                if entry.stat().st_mtime < cutoff and db.session.get(UploadSession, upload_id) is None:
+                    os.remove(entry.path)
+                    deleted += 1
+            except FileNotFoundError:
+                pass
+    return deleted
+
+def incremental_vacuum(app):
+    """Return free pages to the filesystem (SQLite databases with auto_vacuum=INCREMENTAL)"""
+    if db.engine.dialect.name != 'sqlite':
+        return 0
+    with db.engine.connect() as connection:
+        if connection.exec_driver_sql('PRAGMA auto_vacuum').scalar() != 2:
+            return 0
+        free_before = connection.exec_driver_sql('PRAGMA freelist_count').scalar()
+        connection.commit()
+        # The pragma frees one page per step; executescript steps it to completion
+        connection.connection.driver_connection.executescript(
+            f"PRAGMA incremental_vacuum({int(app.config['MAINTENANCE_VACUUM_PAGES'])})"
+        )
+        return free_before - connection.exec_driver_sql('PRAGMA freelist_count').scalar()
+
+def analyze(app):
+    """Refresh the query planner statistics"""
+    with db.engine.connect() as connection:
+        if db.engine.dialect.name == 'sqlite':
+            # Sample at most this many rows per index so ANALYZE stays cheap on large tables
+            connection.exec_driver_sql('PRAGMA analysis_limit=1000')
+        connection.execute(text('ANALYZE'))
+        connection.commit()
+    return None
+
+# name -> (function, config key holding its interval in seconds)
+JOBS = {
+    'purge_download_tokens': (purge_download_tokens, 'MAINTENANCE_TOKEN_PURGE_INTERVAL'),
+    'purge_maintenance_runs': (purge_maintenance_runs, 'MAINTENANCE_HISTORY_PURGE_INTERVAL'),
+    'incremental_vacuum': (incremental_vacuum, 'MAINTENANCE_VACUUM_INTERVAL'),
+    'analyze': (analyze, 'MAINTENANCE_ANALYZE_INTERVAL'),
+    'reconcile_uploads': (reconcile_uploads, 'MAINTENANCE_RECONCILE_INTERVAL'),
+    'purge_upload_sessions': (purge_upload_sessions, 'MAINTENANCE_UPLOAD_PURGE_INTERVAL'),
+}
+
+def _claim_job(name, lease_seconds):
+    """Take the job's lease if it is due; only one process across all workers wins"""
+    now = datetime.utcnow()
+    if db.session.get(MaintenanceJob, name) is None:
+        db.session.add(MaintenanceJob(name=name, next_run_at=now))
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()  # created concurrently by another worker
+    
+    result = db.session.execute(
+        update(MaintenanceJob)
+        .where(MaintenanceJob.name == name, MaintenanceJob.next_run_at <= now,
+               or_(MaintenanceJob.locked_until.is_(None), MaintenanceJob.locked_until < now))
+        .values(locked_until=now + timedelta(seconds=lease_seconds), locked_by=WORKER_ID)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+def run_job(app, name):
+    """Run one job now, record its duration and schedule its next run"""
+    func, interval_key = JOBS[name]
+    started_at = datetime.utcnow()
+    start = time.perf_counter()
+    rows_affected, error = None, None
+    try:
+        rows_affected = func(app)
+    except Exception as e:
+        db.session.rollback()
+        error = str(e)[:1000]
+        app.logger.warning('Maintenance job %s failed: %s', name, e)
+    duration_ms = int((time.perf_counter() - start) * 1000)
+    
+    db.session.add(MaintenanceRun(job=name, started_at=started_at, duration_ms=duration_ms,
+                                  rows_affected=rows_affected, error=error))
+    db.session.execute(
+        update(MaintenanceJob)
+        .where(MaintenanceJob.name == name)
+        .values(next_run_at=datetime.utcnow() + timedelta(seconds=app.config[interval_key]),
+                locked_until=None, locked_by=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    app.logger.info('Maintenance job %s finished in %d ms (rows: %s)', name, duration_ms, rows_affected)
+
+def run_due_jobs(app):
+    """Run every job that is due and not leased by another process"""
+    for name in JOBS:
+        if _claim_job(name, app.config['MAINTENANCE_JOB_LEASE']):
+            run_job(app, name)
+
+def _scheduler_loop(app):
+    while True:
+        time.sleep(app.config['MAINTENANCE_POLL_INTERVAL'])
+        try:
+            with app.app_context():
+                run_due_jobs(app)
+        except Exception as e:
+            app.logger.warning('Maintenance scheduler error: %s', e)
+
+def _warn_if_vacuum_disabled(app):
+    """Log a warning when incremental_vacuum cannot reclaim anything in this database"""
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            return
+        with db.engine.connect() as connection:
+            mode = connection.exec_driver_sql('PRAGMA auto_vacuum').scalar()
+        if mode != 2:
+            app.logger.warning(
+                'SQLite auto_vacuum is %s, not INCREMENTAL: the incremental_vacuum job will not free any pages. '
+                'Run "PRAGMA auto_vacuum=INCREMENTAL; VACUUM;" once (with the app stopped) to enable it.',
+                {0: 'NONE', 1: 'FULL'}.get(mode, mode))
+
+def start_maintenance_scheduler(app):
+    """Start the background thread that runs maintenance jobs"""
+    _warn_if_vacuum_disabled(app)
+    thread = threading.Thread(target=_scheduler_loop, args=(app,), name='maintenance-scheduler', daemon=True)
+    thread.start()
+    return thread
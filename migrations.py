@@ -0,0 +1,208 @@
+"""
+Versioned schema migrations
+
+Each migration runs once, in order, and is recorded in the schema_migrations
+table. Migrations inspect the live schema before changing it, so databases
+created by older versions of the app with db.create_all() (at any revision)
+are brought up to date as well as fresh ones. A migration belongs in the
+same commit as the model change that needs it, so every revision can start
+against an existing database.
+
+Usage: python migrations.py  (applies pending migrations and prints their status)
+"""
+
+from sqlalchemy import inspect, text
+from contextlib import contextmanager
+from datetime import datetime
+from models import db
+from search import create_search_index
+
+def _create_missing_tables(connection):
+    """Create every model table that does not exist yet"""
+    db.metadata.create_all(connection, checkfirst=True)
+
+def _add_columns(*columns):
+    """Migration that adds the given (table, column, DDL) columns if missing"""
+    def migration(connection):
+        inspector = inspect(connection)
+        for table, column, ddl in columns:
+            existing = {c['name'] for c in inspector.get_columns(table)}
+            if column not in existing:
+                connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+    return migration
+
+# Columns added to existing tables since the original schema
+_add_missing_columns = _add_columns(
+    ('users', 'token_version', 'INTEGER NOT NULL DEFAULT 0'),
+    ('uploaded_files', 'blob_digest', 'VARCHAR(64) REFERENCES blobs (digest)'),
+    ('download_tokens', 'used_at', 'DATETIME'),
+)
+
+def _widen_columns(*columns):
+    """Migration that widens the given (table, column, length) VARCHAR columns if shorter.
+    
+    SQLite does not enforce VARCHAR lengths, so it is left alone; PostgreSQL and
+    MySQL reject (or truncate) longer values until the column is altered.
+    """
+    def migration(connection):
+        dialect = connection.dialect.name
+        if dialect == 'sqlite':
+            return
+        inspector = inspect(connection)
+        for table, column, length in columns:
+            current = next(c for c in inspector.get_columns(table) if c['name'] == column)
+            if getattr(current['type'], 'length', None) is None or current['type'].length >= length:
+                continue  # already wide enough, or not length-limited
+            if dialect in ('mysql', 'mariadb'):
+                # MODIFY restates the whole column definition, so keep its NOT NULL
+                null = 'NULL' if current['nullable'] else 'NOT NULL'
+                connection.execute(text(f'ALTER TABLE {table} MODIFY {column} VARCHAR({length}) {null}'))
+            else:
+                connection.execute(text(f'ALTER TABLE {table} ALTER COLUMN {column} TYPE VARCHAR({length})'))
+    return migration
+
+def _record_encryption(connection):
+    """Add the encrypted flags; files stored before deduplication were never encrypted"""
+    _add_columns(
+        ('blobs', 'encrypted', 'BOOLEAN'),
+        ('uploaded_files', 'encrypted', 'BOOLEAN'),
+    )(connection)
+    connection.execute(text('UPDATE uploaded_files SET encrypted = :no WHERE blob_digest IS NULL'), {'no': False})
+
+def _create_indexes(*names):
+    """Migration that creates the named model indexes if missing"""
+    def migration(connection):
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name in names:
+                    index.create(connection, checkfirst=True)
+    return migration
+
+def _create_tables(*names):
+    """Migration that creates the named model tables (and their indexes) if missing"""
+    def migration(connection):
+        db.metadata.create_all(connection, tables=[db.metadata.tables[name] for name in names], checkfirst=True)
+    return migration
+
+MIGRATIONS = [
+    ('0001_create_tables', _create_missing_tables),
+    ('0002_add_missing_columns', _add_missing_columns),
+    ('0003_performance_indexes', _create_indexes(  # composite indexes for the hot queries in routes.py
+        'ix_users_email_user_type',
+        'ix_uploaded_files_uploaded_at_id',
+        'ix_uploaded_files_file_type_uploaded_at',
+        'ix_uploaded_files_uploaded_by_uploaded_at',
+        'ix_uploaded_files_original_filename_id',
+        'ix_uploaded_files_file_size_id',
+        'ix_uploaded_files_blob_digest',
+        'ix_email_outbox_status_next_attempt_at',
+        'ix_download_tokens_file_id',
+        'ix_download_tokens_user_id',
+        'ix_download_tokens_expires_at',
+    )),
+    ('0004_maintenance_tables', _create_tables('maintenance_jobs', 'maintenance_runs')),
+    ('0005_token_purge_index', _create_indexes('ix_download_tokens_is_used_used_at')),
+    ('0006_reconcile_columns', _add_columns(
+        ('uploaded_files', 'missing_at', 'DATETIME'),
+        ('maintenance_jobs', 'cursor', 'VARCHAR(1000)'),
+    )),
+    ('0007_file_path_index', _create_indexes('ix_uploaded_files_file_path')),
+    ('0008_processing_tables', _create_tables('processing_jobs', 'processing_stage_runs')),
+    ('0009_document_properties', _add_columns(
+        ('uploaded_files', 'title', 'VARCHAR(255)'),
+        ('uploaded_files', 'author', 'VARCHAR(255)'),
+        ('uploaded_files', 'doc_created_at', 'DATETIME'),
+        ('uploaded_files', 'doc_modified_at', 'DATETIME'),
+        ('uploaded_files', 'page_count', 'INTEGER'),
+        ('uploaded_files', 'word_count', 'INTEGER'),
+        ('uploaded_files', 'slide_count', 'INTEGER'),
+        ('uploaded_files', 'sheet_count', 'INTEGER'),
+        ('uploaded_files', 'metadata_extracted_at', 'DATETIME'),
+    )),
+    ('0010_document_property_indexes', _create_indexes(
+        'ix_uploaded_files_title_id',
+        'ix_uploaded_files_author_uploaded_at',
+        'ix_uploaded_files_page_count_id',
+        'ix_uploaded_files_slide_count_id',
+        'ix_uploaded_files_sheet_count_id',
+    )),
+    ('0011_search_index', create_search_index),
+    ('0012_package_members', _create_tables('package_members')),
+    ('0013_members_indexed_at', _add_columns(('uploaded_files', 'members_indexed_at', 'DATETIME'))),
+    ('0014_upload_session_lease', _add_columns(
+        ('upload_sessions', 'locked_until', 'DATETIME'),
+        ('upload_sessions', 'locked_by', 'VARCHAR(32)'),
+    )),
+    ('0015_upload_session_purge_index', _create_indexes('ix_upload_sessions_updated_at')),
+    ('0016_encrypted_flags', _record_encryption),
+    ('0017_widen_password_hash', _widen_columns(('users', 'password_hash', 255))),  # scrypt hashes exceed 128
+]
+
+def _ensure_version_table(connection):
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version VARCHAR(100) PRIMARY KEY, applied_at DATETIME NOT NULL)'
+    ))
+
+def applied_migrations(engine):
+    """Return the set of migration versions recorded in the database"""
+    with engine.begin() as connection:
+        _ensure_version_table(connection)
+        return {row[0] for row in connection.execute(text('SELECT version FROM schema_migrations'))}
+
+# pg_advisory_xact_lock key serialising migrations across PostgreSQL workers
+MIGRATION_LOCK_KEY = 0x5346534D
+
+@contextmanager
+def _locked_transaction(engine):
+    """Transaction that holds the database's migration lock from its first statement.
+    
+    SQLite starts it with BEGIN IMMEDIATE (taking the write lock up front) and
+    PostgreSQL takes an advisory lock, so a worker that reads schema_migrations
+    waits until another worker's migration has committed instead of applying it
+    a second time.
+    """
+    if engine.dialect.name == 'sqlite':
+        # pysqlite would otherwise open a deferred transaction on the first write
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except BaseException:
+                if connection.connection.driver_connection.in_transaction:
+                    connection.exec_driver_sql('ROLLBACK')
+                raise
+            connection.exec_driver_sql('COMMIT')
+    else:
+        with engine.begin() as connection:
+            if engine.dialect.name == 'postgresql':
+                connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+            yield connection
+
+def run_migrations(engine):
+    """Apply pending migrations in order; returns the versions that were applied"""
+    applied = applied_migrations(engine)
+    newly_applied = []
+    for version, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        # One locked transaction per migration: the check, the schema change and its record commit together
+        with _locked_transaction(engine) as connection:
+            if connection.execute(text('SELECT 1 FROM schema_migrations WHERE version = :v'), {'v': version}).first():
+                continue  # applied meanwhile by another worker
+            migration(connection)
+            connection.execute(text('INSERT INTO schema_migrations (version, applied_at) VALUES (:v, :t)'),
+                               {'v': version, 't': datetime.utcnow()})
+        newly_applied.append(version)
+    return newly_applied
+
+if __name__ == '__main__':
+    import sys
+    from app import create_app
+    
+    app = create_app()  # applies pending migrations on start-up
+    with app.app_context():
+        applied = applied_migrations(db.engine)
+        for version, _ in MIGRATIONS:
+            print(f"{'applied' if version in applied else 'pending'}  {version}")
+    sys.exit(0)
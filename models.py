@@ -1,8 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
 from flask_mail import Mail
-from datetime import datetime
+from sqlalchemy import update, delete, select, or_, func, event, inspect
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
 import secrets
+import os
 import string
 
 db = SQLAlchemy()
@@ -11,14 +14,18 @@ mail = Mail()
 
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_email_user_type', 'email', 'user_type'),  # login lookups
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)  # long enough for scrypt hashes
     user_type = db.Column(db.String(20), nullable=False)  # 'ops' or 'client'
     is_verified = db.Column(db.Boolean, default=False)
     verification_token = db.Column(db.String(100), unique=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    token_version = db.Column(db.Integer, nullable=False, default=0)  # carried in JWTs; bumping it revokes them
     
     # Relationship with uploaded files
     uploaded_files = db.relationship('UploadedFile', backref='uploader', lazy=True)
@@ -26,22 +33,159 @@ class User(db.Model):
     def __repr__(self):
         return f'<User {self.email}>'
     
+    def jwt_claims(self):
+        """Claims embedded in access tokens so authorization needs no user lookup"""
+        return {'role': self.user_type, 'ver': self.token_version}
+    
     def generate_verification_token(self):
         """Generate a unique verification token"""
         self.verification_token = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(50))
         return self.verification_token
 
+@event.listens_for(User, 'before_update')
+def _bump_token_version(mapper, connection, user):
+    """Revoke issued access tokens when a user's role or verification state changes"""
+    state = inspect(user)
+    if state.attrs.user_type.history.has_changes() or state.attrs.is_verified.history.has_changes():
+        user.token_version = (user.token_version or 0) + 1
+
+class Blob(db.Model):
+    __tablename__ = 'blobs'
+    
+    digest = db.Column(db.String(64), primary_key=True)  # SHA-256 of the content
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    encrypted = db.Column(db.Boolean)  # how the content was first stored; NULL for blobs from before it was recorded
+    
+    def __repr__(self):
+        return f'<Blob {self.digest}>'
+    
+    @classmethod
+    def acquire(cls, digest, size, stored_encrypted=None, retries=3):
+        """Add a reference to a blob, creating its row on first use.
+        
+        A new row records ``stored_encrypted(digest)``, the form the content is
+        actually stored in (it may have been kept from an earlier write rather
+        than written by this upload); existing rows keep theirs, which
+        ``is_encrypted`` returns.
+        
+        The increment takes the row's write lock, so it waits for a concurrent
+        ``purge`` of the same blob to finish; callers must check that the blob's
+        content still exists before committing. Two requests inserting the same
+        new digest at once are resolved by retrying the increment.
+        """
+        for attempt in range(retries):
+            updated = db.session.execute(
+                update(cls).where(cls.digest == digest).values(ref_count=cls.ref_count + 1)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if updated:
+                return
+            encrypted = stored_encrypted(digest) if stored_encrypted else None
+            try:
+                with db.session.begin_nested():
+                    db.session.add(cls(digest=digest, size=size, ref_count=1, encrypted=encrypted))
+                return
+            except IntegrityError:
+                # Inserted concurrently; the next increment finds the row
+                if attempt == retries - 1:
+                    raise
+    
+    @classmethod
+    def is_encrypted(cls, digest):
+        """Whether a blob's content is stored encrypted (None if not recorded)"""
+        return db.session.execute(select(cls.encrypted).where(cls.digest == digest)).scalar()
+    
+    @classmethod
+    def release(cls, digest):
+        """Drop a reference to a blob; returns True when nothing uses it any more.
+        
+        The row is kept (with ref_count 0) so ``purge`` can lock it while it
+        removes the content; call ``purge`` after committing.
+        """
+        db.session.execute(
+            update(cls).where(cls.digest == digest).values(ref_count=cls.ref_count - 1)
+            .execution_options(synchronize_session=False)
+        )
+        remaining = db.session.execute(select(cls.ref_count).where(cls.digest == digest)).scalar()
+        return remaining is not None and remaining <= 0
+    
+    @classmethod
+    def drop_if_unused(cls, digest):
+        """Delete a blob's row if nothing references it; returns True if it was deleted"""
+        return db.session.execute(
+            delete(cls).where(cls.digest == digest, cls.ref_count <= 0)
+            .execution_options(synchronize_session=False)
+        ).rowcount == 1
+    
+    @classmethod
+    def purge(cls, digest, remove):
+        """Remove an unreferenced blob's content with ``remove(digest)`` and delete its row.
+        
+        The reference count is re-checked with a conditional UPDATE that locks
+        the row until the commit, so an upload reusing the blob either takes its
+        reference first (and the content is kept) or waits and finds the content
+        gone. Returns True if the content was removed.
+        """
+        locked = db.session.execute(
+            update(cls).where(cls.digest == digest, cls.ref_count <= 0).values(ref_count=0)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not locked:
+            db.session.commit()
+            return False
+        try:
+            remove(digest)
+            cls.drop_if_unused(digest)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return True
+
 class UploadedFile(db.Model):
     __tablename__ = 'uploaded_files'
+    __table_args__ = (
+        # Keyset pagination in list_files: each sort order and filter has an index ending in id
+        db.Index('ix_uploaded_files_uploaded_at_id', 'uploaded_at', 'id'),
+        db.Index('ix_uploaded_files_file_type_uploaded_at', 'file_type', 'uploaded_at', 'id'),
+        db.Index('ix_uploaded_files_uploaded_by_uploaded_at', 'uploaded_by', 'uploaded_at', 'id'),
+        db.Index('ix_uploaded_files_original_filename_id', 'original_filename', 'id'),
+        db.Index('ix_uploaded_files_file_size_id', 'file_size', 'id'),
+        db.Index('ix_uploaded_files_blob_digest', 'blob_digest'),
+        db.Index('ix_uploaded_files_file_path', 'file_path'),  # upload directory reconciliation
+        # Document property filters in list_files
+        db.Index('ix_uploaded_files_title_id', 'title', 'id'),
+        db.Index('ix_uploaded_files_author_uploaded_at', 'author', 'uploaded_at', 'id'),
+        db.Index('ix_uploaded_files_page_count_id', 'page_count', 'id'),
+        db.Index('ix_uploaded_files_slide_count_id', 'slide_count', 'id'),
+        db.Index('ix_uploaded_files_sheet_count_id', 'sheet_count', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     original_filename = db.Column(db.String(255), nullable=False)
     stored_filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)
-    file_size = db.Column(db.Integer, nullable=False)
+    file_size = db.Column(db.BigInteger, nullable=False)
     file_type = db.Column(db.String(10), nullable=False)
     uploaded_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    blob_digest = db.Column(db.String(64), db.ForeignKey('blobs.digest'))  # NULL for files stored before deduplication
+    missing_at = db.Column(db.DateTime)  # set by the reconciler when the file is gone from disk
+    encrypted = db.Column(db.Boolean)  # copied from the blob; NULL if not recorded (the file header is checked)
+    
+    # Document properties from docProps/core.xml and docProps/app.xml (extract_metadata processing stage)
+    title = db.Column(db.String(255))
+    author = db.Column(db.String(255))
+    doc_created_at = db.Column(db.DateTime)
+    doc_modified_at = db.Column(db.DateTime)
+    page_count = db.Column(db.Integer)  # docx
+    word_count = db.Column(db.Integer)  # docx, pptx
+    slide_count = db.Column(db.Integer)  # pptx
+    sheet_count = db.Column(db.Integer)  # xlsx
+    metadata_extracted_at = db.Column(db.DateTime)  # NULL until the properties have been read
+    members_indexed_at = db.Column(db.DateTime)  # NULL until package_members holds its ZIP members
     
     def __repr__(self):
         return f'<UploadedFile {self.original_filename}>'
@@ -53,11 +197,243 @@ class UploadedFile(db.Model):
             'file_size': self.file_size,
             'file_type': self.file_type,
             'uploaded_at': self.uploaded_at.isoformat(),
-            'uploaded_by': self.uploader.email
+            'uploaded_by': self.uploader.email,
+            'sha256': self.blob_digest,
+            'missing': self.missing_at is not None,
+            'title': self.title,
+            'author': self.author,
+            'doc_created_at': self.doc_created_at.isoformat() if self.doc_created_at else None,
+            'doc_modified_at': self.doc_modified_at.isoformat() if self.doc_modified_at else None,
+            'page_count': self.page_count,
+            'word_count': self.word_count,
+            'slide_count': self.slide_count,
+            'sheet_count': self.sheet_count
+        }
+
+class PackageMember(db.Model):
+    """One member of a stored ZIP package (every OOXML file is one), from its central directory"""
+    __tablename__ = 'package_members'
+    __table_args__ = (
+        db.Index('ix_package_members_file_id_name', 'file_id', 'name', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('uploaded_files.id'), nullable=False)
+    name = db.Column(db.String(1000), nullable=False)
+    compress_type = db.Column(db.Integer, nullable=False)  # zipfile.ZIP_STORED, ZIP_DEFLATED, ...
+    compressed_size = db.Column(db.BigInteger, nullable=False)
+    file_size = db.Column(db.BigInteger, nullable=False)
+    crc = db.Column(db.BigInteger, nullable=False)  # CRC-32 of the uncompressed bytes
+    data_offset = db.Column(db.BigInteger, nullable=False)  # where the member's bytes start in the stored file
+    
+    def __repr__(self):
+        return f'<PackageMember {self.file_id}:{self.name}>'
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'size': self.file_size,
+            'compressed_size': self.compressed_size,
+            'compression': {0: 'stored', 8: 'deflated'}.get(self.compress_type, str(self.compress_type))
+        }
+
+class UploadSession(db.Model):
+    __tablename__ = 'upload_sessions'
+    __table_args__ = (
+        db.Index('ix_upload_sessions_updated_at', 'updated_at'),  # maintenance purge
+    )
+    
+    id = db.Column(db.String(32), primary_key=True)
+    original_filename = db.Column(db.String(255), nullable=False)
+    file_type = db.Column(db.String(10), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=False)
+    temp_path = db.Column(db.String(500), nullable=False)
+    uploaded_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)  # lease held by the request appending a chunk
+    locked_by = db.Column(db.String(32))
+    
+    def __repr__(self):
+        return f'<UploadSession {self.id}>'
+    
+    @classmethod
+    def claim_writer(cls, upload_id, lease_seconds):
+        """Take the write lease of an upload; returns the lease holder id, or None if it is held.
+        
+        The lease is taken with one conditional UPDATE, so of two concurrent
+        requests for the same upload (PATCH, complete or abort) only one may
+        touch its partial file. An expired lease (a crashed request) can be
+        taken over.
+        """
+        now = datetime.utcnow()
+        holder = secrets.token_hex(16)
+        claimed = db.session.execute(
+            update(cls)
+            .where(cls.id == upload_id, or_(cls.locked_until.is_(None), cls.locked_until < now))
+            .values(locked_until=now + timedelta(seconds=lease_seconds), locked_by=holder)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        return holder if claimed else None
+    
+    @classmethod
+    def release_writer(cls, upload_id, holder):
+        """Give up a write lease taken with claim_writer (a no-op if it was taken over)"""
+        db.session.execute(
+            update(cls)
+            .where(cls.id == upload_id, cls.locked_by == holder)
+            .values(locked_until=None, locked_by=None, updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    
+    @property
+    def offset(self):
+        """Number of bytes received so far (the partial file on disk is the source of truth)"""
+        try:
+            return os.path.getsize(self.temp_path)
+        except OSError:
+            return 0
+    
+    def to_dict(self):
+        return {
+            'upload_id': self.id,
+            'original_filename': self.original_filename,
+            'total_size': self.total_size,
+            'offset': self.offset,
+            'created_at': self.created_at.isoformat()
+        }
+
+class OutboxEmail(db.Model):
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    recipients = db.Column(db.Text, nullable=False)  # comma-separated
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending, sending, sent or failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)  # claim lease held by a sender while status is 'sending'
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<OutboxEmail {self.id} {self.status}>'
+
+class MaintenanceJob(db.Model):
+    __tablename__ = 'maintenance_jobs'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    next_run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)  # lease held by the process running the job
+    locked_by = db.Column(db.String(100))
+    cursor = db.Column(db.String(1000))  # resume position of incremental jobs
+    
+    def __repr__(self):
+        return f'<MaintenanceJob {self.name}>'
+
+class MaintenanceRun(db.Model):
+    __tablename__ = 'maintenance_runs'
+    __table_args__ = (
+        db.Index('ix_maintenance_runs_started_at', 'started_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job = db.Column(db.String(50), nullable=False)
+    started_at = db.Column(db.DateTime, nullable=False)
+    duration_ms = db.Column(db.Integer, nullable=False)
+    rows_affected = db.Column(db.Integer)
+    error = db.Column(db.Text)
+    
+    def to_dict(self):
+        return {
+            'job': self.job,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': self.duration_ms,
+            'rows_affected': self.rows_affected,
+            'error': self.error
+        }
+
+class ProcessingJob(db.Model):
+    __tablename__ = 'processing_jobs'
+    __table_args__ = (
+        db.Index('ix_processing_jobs_status_next_attempt_at', 'status', 'next_attempt_at'),
+        db.Index('ix_processing_jobs_file_id', 'file_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('uploaded_files.id'), nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending, running, done or failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)  # lease held by a worker while status is 'running'
+    locked_by = db.Column(db.String(100))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    file = db.relationship('UploadedFile')
+    stage_runs = db.relationship('ProcessingStageRun', backref='job', lazy=True,
+                                 order_by='ProcessingStageRun.id')
+    
+    def __repr__(self):
+        return f'<ProcessingJob {self.id} {self.status}>'
+    
+    @classmethod
+    def delete_for_file(cls, file_id):
+        """Delete the processing history of a file that is about to be deleted"""
+        job_ids = select(cls.id).where(cls.file_id == file_id).scalar_subquery()
+        ProcessingStageRun.query.filter(ProcessingStageRun.job_id.in_(job_ids)).delete(synchronize_session=False)
+        cls.query.filter_by(file_id=file_id).delete(synchronize_session=False)
+    
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'file_id': self.file_id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'stages': [run.to_dict() for run in self.stage_runs]
+        }
+
+class ProcessingStageRun(db.Model):
+    __tablename__ = 'processing_stage_runs'
+    __table_args__ = (
+        db.Index('ix_processing_stage_runs_job_id', 'job_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('processing_jobs.id'), nullable=False)
+    stage = db.Column(db.String(50), nullable=False)
+    started_at = db.Column(db.DateTime, nullable=False)
+    duration_ms = db.Column(db.Integer, nullable=False)
+    error = db.Column(db.Text)  # NULL when the stage succeeded
+    
+    def to_dict(self):
+        return {
+            'stage': self.stage,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': self.duration_ms,
+            'error': self.error
         }
 
 class DownloadToken(db.Model):
     __tablename__ = 'download_tokens'
+    __table_args__ = (
+        db.Index('ix_download_tokens_file_id', 'file_id'),
+        db.Index('ix_download_tokens_user_id', 'user_id'),
+        db.Index('ix_download_tokens_expires_at', 'expires_at'),
+        db.Index('ix_download_tokens_is_used_used_at', 'is_used', 'used_at'),  # maintenance purge
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     token = db.Column(db.String(255), unique=True, nullable=False)
@@ -66,6 +442,7 @@ class DownloadToken(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     expires_at = db.Column(db.DateTime, nullable=False)
     is_used = db.Column(db.Boolean, default=False)
+    used_at = db.Column(db.DateTime)  # first redemption; starts the resume window for range requests
     
     # Relationships
     file = db.relationship('UploadedFile', backref='download_tokens')
@@ -73,3 +450,50 @@ class DownloadToken(db.Model):
     
     def __repr__(self):
         return f'<DownloadToken {self.token}>'
+    
+    @classmethod
+    def redeem(cls, token, file_id, user_id, allow_resume=False, resume_window=0):
+        """Atomically mark a token as used and return the metadata of its file.
+        
+        The check and the update are one conditional UPDATE, so of several
+        concurrent redemptions of the same token exactly one succeeds. With
+        ``allow_resume`` an already used token is accepted again for
+        ``resume_window`` seconds after its first use. Returns a row with the
+        file's ``id``, ``file_path``, ``original_filename``, ``blob_digest``,
+        ``file_size`` and ``encrypted``, or None if the token cannot be redeemed.
+        """
+        now = datetime.utcnow()
+        redeemable = cls.is_used == False
+        if allow_resume:
+            redeemable = or_(redeemable, cls.used_at >= now - timedelta(seconds=resume_window))
+        
+        stmt = (
+            update(cls)
+            .where(cls.token == token, cls.file_id == file_id, cls.user_id == user_id,
+                   cls.expires_at > now, redeemable)
+            .values(is_used=True, used_at=func.coalesce(cls.used_at, now))
+            .execution_options(synchronize_session=False)
+        )
+        file_columns = (UploadedFile.id, UploadedFile.file_path, UploadedFile.original_filename,
+                        UploadedFile.blob_digest, UploadedFile.file_size, UploadedFile.encrypted)
+        dialect = db.session.get_bind().dialect
+        
+        if dialect.update_returning and dialect.name == 'sqlite':
+            # SQLite's RETURNING cannot name columns of an UPDATE ... FROM table,
+            # so the file columns come from correlated subqueries in the same statement
+            stmt = stmt.returning(*(
+                select(column).where(UploadedFile.id == cls.file_id).scalar_subquery().label(column.key)
+                for column in file_columns
+            ))
+            row = db.session.execute(stmt).first()
+        elif dialect.update_returning:
+            stmt = stmt.where(UploadedFile.id == cls.file_id).returning(*file_columns)
+            row = db.session.execute(stmt).first()
+        else:
+            # No RETURNING support: the UPDATE still decides the winner, the file is read afterwards
+            row = None
+            if db.session.execute(stmt).rowcount == 1:
+                row = db.session.execute(select(*file_columns).where(UploadedFile.id == file_id)).first()
+        
+        db.session.commit()
+        return row
@@ -0,0 +1,179 @@
+"""
+Document properties of Office Open XML files (.docx, .pptx, .xlsx)
+
+Every OOXML file is a ZIP package whose core properties (title, author,
+dates) live in docProps/core.xml and whose application statistics (pages,
+words, slides, sheets) live in docProps/app.xml. zipfile locates them through
+the central directory at the end of the archive, so only the directory and
+those two small parts are read, however large the embedded media is; this
+also holds for remote files opened with ranged reads.
+
+Document text (for the search index) is streamed out of the body parts with
+an expat parser fed one decompressed chunk at a time, so neither the XML nor
+a tree of it is ever held in memory.
+"""
+
+from xml.etree import ElementTree
+from xml.parsers import expat
+from datetime import datetime, timezone
+import re
+import zipfile
+
+CORE_PART = 'docProps/core.xml'
+APP_PART = 'docProps/app.xml'
+# Property parts are a few KB; anything far larger is not worth parsing (or is a decompression bomb)
+MAX_PART_SIZE = 1024 * 1024
+
+_DC = '{http://purl.org/dc/elements/1.1/}'
+_DCTERMS = '{http://purl.org/dc/terms/}'
+_APP = '{http://schemas.openxmlformats.org/officeDocument/2006/extended-properties}'
+_VT = '{http://schemas.openxmlformats.org/officeDocument/2006/docPropsVTypes}'
+
+# Lengths of the UploadedFile columns the text properties are stored in
+TITLE_LENGTH = 255
+AUTHOR_LENGTH = 255
+
+class MetadataError(ValueError):
+    """The package or one of its property parts is unreadable"""
+
+def _read_part(package, name):
+    try:
+        info = package.getinfo(name)
+    except KeyError:
+        return None  # both parts are optional
+    if info.file_size > MAX_PART_SIZE:
+        raise MetadataError(f'{name} is too large ({info.file_size} bytes)')
+    try:
+        return ElementTree.fromstring(package.read(info))
+    except ElementTree.ParseError as e:
+        raise MetadataError(f'{name} is not well-formed XML: {e}')
+
+def _text(root, tag, length=None):
+    element = root.find(tag) if root is not None else None
+    value = (element.text or '').strip() if element is not None else ''
+    return value[:length] if value else None
+
+def _int(root, tag):
+    value = _text(root, tag)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+def _datetime(root, tag):
+    """W3CDTF timestamp (e.g. 2024-05-01T09:30:00Z) as a naive UTC datetime"""
+    value = _text(root, tag)
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def _sheet_count(app):
+    """Worksheet count from the HeadingPairs vector: (name, count) pairs such as ("Worksheets", 3)"""
+    if app is None:
+        return None
+    variants = app.findall(f'{_APP}HeadingPairs/{_VT}vector/{_VT}variant')
+    for name, count in zip(variants[::2], variants[1::2]):
+        label = name.find(f'{_VT}lpstr')
+        number = count.find(f'{_VT}i4')
+        if label is not None and number is not None and label.text in ('Worksheets', 'Sheets'):
+            try:
+                return int(number.text)
+            except (TypeError, ValueError):
+                return None
+    return None
+
+def extract_metadata(fileobj, file_type):
+    """Return the document properties of a seekable OOXML file as UploadedFile column values.
+    
+    Properties missing from the file are None. Raises MetadataError if the
+    package or a property part cannot be read.
+    """
+    try:
+        with zipfile.ZipFile(fileobj) as package:
+            core = _read_part(package, CORE_PART)
+            app = _read_part(package, APP_PART)
+    except zipfile.BadZipFile as e:
+        raise MetadataError(f'Not a ZIP package: {e}')
+    
+    return {
+        'title': _text(core, f'{_DC}title', TITLE_LENGTH),
+        'author': _text(core, f'{_DC}creator', AUTHOR_LENGTH),
+        'doc_created_at': _datetime(core, f'{_DCTERMS}created'),
+        'doc_modified_at': _datetime(core, f'{_DCTERMS}modified'),
+        'page_count': _int(app, f'{_APP}Pages') if file_type == 'docx' else None,
+        'word_count': _int(app, f'{_APP}Words') if file_type in ('docx', 'pptx') else None,
+        'slide_count': _int(app, f'{_APP}Slides') if file_type == 'pptx' else None,
+        'sheet_count': _sheet_count(app) if file_type == 'xlsx' else None,
+    }
+
+# Text of each document type: (parts, text element, element ending a paragraph or cell).
+# Element names are "<namespace URI>}<local name>", as expat reports them with namespace_separator='}'
+_W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_A = 'http://schemas.openxmlformats.org/drawingml/2006/main}'
+_S = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_SLIDE_PART = re.compile(r'^ppt/slides/slide(\d+)\.xml$')
+
+def _text_parts(package, file_type):
+    if file_type == 'docx':
+        return ['word/document.xml'], _W + 't', _W + 'p'
+    if file_type == 'pptx':
+        slides = sorted((int(m.group(1)), m.group(0)) for m in map(_SLIDE_PART.match, package.namelist()) if m)
+        return [name for _, name in slides], _A + 't', _A + 'p'
+    if file_type == 'xlsx':
+        return ['xl/sharedStrings.xml'], _S + 't', _S + 'si'
+    return [], None, None
+
+def iter_text(fileobj, file_type, chunk_size=65536):
+    """Yield the text of a seekable OOXML file piece by piece, paragraphs separated by newlines.
+    
+    Covers word/document.xml, the slides in order, or xl/sharedStrings.xml.
+    Stop iterating to stop reading. Raises MetadataError for unreadable files.
+    """
+    try:
+        package = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile as e:
+        raise MetadataError(f'Not a ZIP package: {e}')
+    
+    with package:
+        names, text_tag, break_tag = _text_parts(package, file_type)
+        for name in names:
+            if name not in package.NameToInfo:
+                continue
+            pieces = []
+            in_text = False
+            
+            def start(tag, attrs):
+                nonlocal in_text
+                in_text = in_text or tag == text_tag
+            
+            def end(tag):
+                nonlocal in_text
+                if tag == text_tag:
+                    in_text = False
+                elif tag == break_tag:
+                    pieces.append('\n')
+            
+            def data(text):
+                if in_text:
+                    pieces.append(text)
+            
+            parser = expat.ParserCreate(namespace_separator='}')
+            parser.StartElementHandler, parser.EndElementHandler, parser.CharacterDataHandler = start, end, data
+            with package.open(name) as part:
+                while True:
+                    chunk = part.read(chunk_size)
+                    try:
+                        parser.Parse(chunk, not chunk)
+                    except expat.ExpatError as e:
+                        raise MetadataError(f'{name} is not well-formed XML: {e}')
+                    if pieces:
+                        yield ''.join(pieces)
+                        pieces.clear()
+                    if not chunk:
+                        break
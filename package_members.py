@@ -0,0 +1,176 @@
+"""
+Random access to the members of stored ZIP packages
+
+Reading one member of a ZIP with zipfile means parsing the whole central
+directory and then the member's local header on every open. Instead the
+central directory of each stored file is indexed once into package_members,
+together with each member's resolved data offset (past its local header),
+so serving a member is one indexed lookup and one seek into the stored file,
+after which the member's bytes are streamed (and inflated) as they are sent.
+"""
+
+from models import db, PackageMember
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime
+import io
+import struct
+import zipfile
+import zlib
+
+# Local file header: signature, version, flags, method, time, date, crc, sizes, name length, extra length
+_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+_LOCAL_SIGNATURE = b'PK\x03\x04'
+# Gaps between local headers up to this size are read through rather than seeked over,
+# which keeps a remote object's ranged GET going while the index is built
+_MAX_SKIP = 256 * 1024
+
+SUPPORTED_COMPRESSION = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)
+
+class MemberError(ValueError):
+    """The package or a member's bytes do not match its central directory"""
+
+def read_member_index(fileobj):
+    """Return a PackageMember (without file_id) for every member of a seekable ZIP file"""
+    try:
+        with zipfile.ZipFile(fileobj) as package:
+            infos = [info for info in package.infolist() if not info.is_dir()]
+    except zipfile.BadZipFile as e:
+        raise MemberError(f'Not a ZIP package: {e}')
+    
+    # Part names are unique in a valid package; a repeated one is ambiguous (zipfile
+    # would serve the last, other readers the first) and could not be indexed
+    names = set()
+    for info in infos:
+        if info.filename in names:
+            raise MemberError(f'Duplicate member name {info.filename}')
+        names.add(info.filename)
+    
+    members = []
+    for info in sorted(infos, key=lambda info: info.header_offset):
+        gap = info.header_offset - fileobj.tell()
+        if 0 <= gap <= _MAX_SKIP:
+            fileobj.read(gap)
+        else:
+            fileobj.seek(info.header_offset)
+        header = fileobj.read(_LOCAL_HEADER.size)
+        if len(header) != _LOCAL_HEADER.size or not header.startswith(_LOCAL_SIGNATURE):
+            raise MemberError(f'Bad local header for {info.filename}')
+        name_length, extra_length = _LOCAL_HEADER.unpack(header)[9:]
+        members.append(PackageMember(
+            name=info.filename,
+            compress_type=info.compress_type if not info.flag_bits & 0x1 else -1,  # -1: encrypted member
+            compressed_size=info.compress_size,
+            file_size=info.file_size,
+            crc=info.CRC,
+            data_offset=info.header_offset + _LOCAL_HEADER.size + name_length + extra_length
+        ))
+    return members
+
+def index_members(file, blob_store):
+    """(Re)build the member index of an uploaded file; the caller commits"""
+    with blob_store.open_file(file.file_path, file.encrypted) as f:
+        members = read_member_index(f)
+    PackageMember.query.filter_by(file_id=file.id).delete()
+    for member in members:
+        member.file_id = file.id
+        db.session.add(member)
+    file.members_indexed_at = datetime.utcnow()
+
+def ensure_member_index(file, blob_store):
+    """Index a file's members on first use if post-upload processing has not done it yet"""
+    if file.members_indexed_at is not None:
+        return
+    index_members(file, blob_store)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # indexed concurrently by another request or worker
+
+class MemberReader(io.RawIOBase):
+    """Uncompressed bytes of one member, read from its data offset in the stored file.
+    
+    The output is checked against the recorded size and CRC-32 while it is
+    read, so a corrupt or tampered package never passes silently. Stored
+    (uncompressed) members are seekable, so Range requests read only what
+    they cover.
+    """
+    
+    def __init__(self, raw, member: PackageMember, buffer_size: int = 65536):
+        if member.compress_type not in SUPPORTED_COMPRESSION:
+            raise MemberError(f'Unsupported compression for {member.name}')
+        self.raw = raw
+        self.member = member
+        self.buffer_size = buffer_size
+        self.position = 0  # in the uncompressed output
+        self.consumed = 0  # compressed bytes read
+        self.crc = 0
+        self.check_crc = True  # only when the member is read from its start
+        self.inflater = zlib.decompressobj(-15) if member.compress_type == zipfile.ZIP_DEFLATED else None
+        self.pending = b''
+        raw.seek(member.data_offset)
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return self.inflater is None
+    
+    def tell(self):
+        return self.position
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if self.inflater is not None:
+            raise io.UnsupportedOperation('compressed members are not seekable')
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.member.file_size
+        offset = max(0, min(offset, self.member.file_size))
+        if offset != self.position:
+            self.check_crc = False
+            self.raw.seek(self.member.data_offset + offset)
+            self.position = self.consumed = offset
+            self.pending = b''
+        return self.position
+    
+    def _fill(self):
+        """Produce the next piece of output, at most buffer_size bytes; b'' at the end of the member"""
+        while True:
+            if self.inflater is not None and self.inflater.unconsumed_tail:
+                # Input held back by the output limit is inflated before more is read,
+                # so a highly compressed member never expands a whole read at once
+                chunk = self.inflater.unconsumed_tail
+            else:
+                remaining = self.member.compressed_size - self.consumed
+                if remaining <= 0:
+                    return self.inflater.flush() if self.inflater is not None else b''
+                chunk = self.raw.read(min(self.buffer_size, remaining))
+                if not chunk:
+                    raise MemberError(f'Stored file ends inside {self.member.name}')
+                self.consumed += len(chunk)
+                if self.inflater is None:
+                    return chunk
+            data = self.inflater.decompress(chunk, self.buffer_size)
+            if data:
+                return data
+    
+    def readinto(self, buffer):
+        if not self.pending:
+            self.pending = self._fill()
+            if self.check_crc:
+                self.crc = zlib.crc32(self.pending, self.crc)
+            if self.position + len(self.pending) > self.member.file_size:
+                raise MemberError(f'{self.member.name} is larger than recorded')
+            if not self.pending:
+                if self.position != self.member.file_size or (self.check_crc and self.crc != self.member.crc):
+                    raise MemberError(f'{self.member.name} does not match its recorded size or CRC')
+                return 0
+        n = min(len(buffer), len(self.pending))
+        buffer[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        self.position += n
+        return n
+    
+    def close(self):
+        self.raw.close()
+        super().close()
@@ -0,0 +1,83 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import check_password_hash, generate_password_hash
+import multiprocessing
+import os
+import threading
+
+class HasherBusy(Exception):
+    """Raised when too many password hashing jobs are already queued"""
+    
+    def __init__(self, retry_after: int):
+        super().__init__('Password hashing queue is full')
+        self.retry_after = retry_after
+
+class PasswordHasher:
+    """Runs password hashing off the request thread in a bounded worker pool.
+    
+    Hashing is CPU-bound, so by default it runs in worker processes where it
+    does not hold the GIL of the web worker. At most ``max_pending`` jobs may be
+    queued or running; beyond that callers get HasherBusy instead of piling up.
+    """
+    
+    def __init__(self, method: str = 'pbkdf2:sha256:600000', executor: str = 'process',
+                 workers: int = None, max_pending: int = None, retry_after: int = 1):
+        self.method = method
+        # Canonical "<method>:<params>" prefix of hashes produced with the current settings
+        self.method_prefix = generate_password_hash('', method=method).split('$', 1)[0]
+        self.executor_type = executor
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+    
+    def hash(self, password: str) -> str:
+        """Hash a password with the configured method"""
+        return self._run(generate_password_hash, password, self.method)
+    
+    def verify(self, password_hash: str, password: str) -> bool:
+        """Check a password against a stored hash"""
+        return self._run(check_password_hash, password_hash, password)
+    
+    def needs_rehash(self, password_hash: str) -> bool:
+        """True if a stored hash was made with different method or parameters"""
+        return password_hash.split('$', 1)[0] != self.method_prefix
+    
+    def _run(self, func, *args):
+        if self.executor_type == 'inline':
+            return func(*args)
+        
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy(self.retry_after)
+        try:
+            executor = self._get_executor()
+            try:
+                return executor.submit(func, *args).result()
+            except BrokenProcessPool:
+                # A worker died (e.g. killed by the OOM killer); start a new pool and retry once
+                self._discard_executor(executor)
+                return self._get_executor().submit(func, *args).result()
+        finally:
+            self._slots.release()
+    
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                if self.executor_type == 'process':
+                    # Never fork the multi-threaded web process: a child could inherit a lock
+                    # held by another thread and deadlock. forkserver (or spawn) starts the
+                    # workers from a clean single-threaded process instead.
+                    methods = multiprocessing.get_all_start_methods()
+                    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            return self._executor
+    
+    def _discard_executor(self, executor):
+        with self._executor_lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
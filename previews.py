@@ -0,0 +1,194 @@
+"""
+Document thumbnails for the file grid
+
+A preview is built on its first request: the thumbnail Office embeds in the
+package (docProps/thumbnail.jpeg or .png, read through the member index
+with one seek) when there is one, otherwise an SVG placeholder showing the
+document type, title and size. Previews are stored in a size-bounded
+on-disk cache under a key derived from what they show, which doubles as
+their ETag, and concurrent requests for a preview that is not cached yet
+wait for a single generation instead of each starting their own.
+"""
+
+from models import PackageMember
+from package_members import ensure_member_index, MemberReader, MemberError, SUPPORTED_COMPRESSION
+from collections import OrderedDict
+from concurrent.futures import Future
+from xml.sax.saxutils import escape
+import hashlib
+import json
+import os
+import tempfile
+import textwrap
+import threading
+
+# Embedded thumbnails browsers can show (Office may also embed .emf/.wmf, which they cannot)
+THUMBNAIL_MEMBERS = {
+    'docProps/thumbnail.jpeg': 'image/jpeg',
+    'docProps/thumbnail.jpg': 'image/jpeg',
+    'docProps/thumbnail.png': 'image/png',
+}
+
+# Bump when the placeholder drawing changes, so cached placeholders are replaced
+PLACEHOLDER_VERSION = 1
+PLACEHOLDER_COLORS = {'docx': '#2b579a', 'xlsx': '#217346', 'pptx': '#d24726'}
+
+class PreviewCache:
+    """Size-bounded on-disk cache of rendered previews, evicting the least recently used.
+    
+    Recency is kept in the files' modification times (touched on every hit),
+    so it survives restarts and is shared by every process using the folder;
+    when a write takes the folder over max_bytes, the oldest entries are
+    removed until it is back under 90% of the limit.
+    """
+    
+    def __init__(self, folder: str, max_bytes: int):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # name -> size, least recently used first
+        self._size = 0
+        self._inflight = {}  # key -> Future of a generation in progress
+        os.makedirs(folder, exist_ok=True)
+        self._load()
+    
+    def _load(self):
+        """Rebuild the recency order from the folder (which other processes may have written to)"""
+        entries = []
+        with os.scandir(self.folder) as listing:
+            for entry in listing:
+                if entry.is_file() and not entry.name.startswith('.'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+        entries.sort()
+        self._entries = OrderedDict((name, size) for _, name, size in entries)
+        self._size = sum(size for _, _, size in entries)
+    
+    def get(self, key: str):
+        """Return a cached preview and mark it as recently used, or None"""
+        path = os.path.join(self.folder, key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._size -= self._entries.pop(key, 0)
+            return None
+        with self._lock:
+            self._size += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+        return data
+    
+    def put(self, key: str, data: bytes):
+        """Store a preview (atomically, so readers never see a partial file), evicting if over the limit"""
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, os.path.join(self.folder, key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        with self._lock:
+            self._size += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+    
+    def _evict(self):
+        self._load()
+        target = self.max_bytes * 0.9
+        while self._size > target and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self._size -= size
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                pass
+    
+    def get_or_create(self, key: str, generate):
+        """Return the cached preview, or call ``generate()`` once however many threads ask for it at a time"""
+        data = self.get(key)
+        if data is not None:
+            return data
+        
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+        
+        try:
+            data = self.get(key)  # finished by another thread between the lookup and the claim
+            if data is None:
+                data = generate()
+                self.put(key, data)
+            future.set_result(data)
+            return data
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+def _embedded_thumbnail(file, blob_store, max_size):
+    """The file's embedded thumbnail member, if it has a usable one"""
+    try:
+        ensure_member_index(file, blob_store)
+    except MemberError:
+        return None  # not a readable package: it gets a placeholder
+    return (PackageMember.query
+            .filter(PackageMember.file_id == file.id, PackageMember.name.in_(THUMBNAIL_MEMBERS),
+                    PackageMember.file_size <= max_size, PackageMember.compress_type.in_(SUPPORTED_COMPRESSION))
+            .order_by(PackageMember.name)
+            .first())
+
+def _count_label(file):
+    for count, unit in ((file.page_count, 'page'), (file.slide_count, 'slide'), (file.sheet_count, 'sheet')):
+        if count is not None:
+            return f"{count} {unit}{'s' if count != 1 else ''}"
+    return ''
+
+def render_placeholder(file_type, label, detail):
+    """SVG card with the document type, its title (up to three lines) and a detail line"""
+    color = PLACEHOLDER_COLORS.get(file_type, '#667eea')
+    lines = textwrap.wrap(label, 18, max_lines=3, placeholder='...') or ['']
+    text = ''.join(f'<text x="16" y="{104 + 20 * i}" font-size="15" fill="#333">{escape(line)}</text>'
+                   for i, line in enumerate(lines))
+    return (
+        '<svg xmlns="http://www.w3.org/2000/svg" width="192" height="240" viewBox="0 0 192 240">'
+        '<rect width="192" height="240" rx="12" fill="#f8f9fa" stroke="#e0e0e0"/>'
+        f'<rect width="192" height="64" rx="12" fill="{color}"/><rect y="52" width="192" height="12" fill="{color}"/>'
+        f'<text x="16" y="44" font-family="sans-serif" font-size="26" font-weight="bold" fill="#fff">'
+        f'{escape(file_type.upper())}</text>'
+        f'<g font-family="sans-serif">{text}'
+        f'<text x="16" y="220" font-size="13" fill="#666">{escape(detail)}</text></g>'
+        '</svg>'
+    ).encode()
+
+def preview_source(file, blob_store, config):
+    """Return ``(cache key, mimetype, generate)`` for a file's preview.
+    
+    The key changes whenever what the preview shows does (the stored content
+    for embedded thumbnails; type, title and counts for placeholders), so it
+    serves as the ETag too. Apart from indexing the package's members on
+    first use, only database rows are read until ``generate()`` is called.
+    """
+    member = _embedded_thumbnail(file, blob_store, config['PREVIEW_MAX_SOURCE_SIZE'])
+    if member is not None:
+        extension = '.png' if member.name.endswith('.png') else '.jpg'
+        key = f"{file.blob_digest or f'file-{file.id}'}-{member.crc:08x}{extension}"
+        
+        def generate():
+            with MemberReader(blob_store.open_file(file.file_path, file.encrypted), member) as reader:
+                return reader.read()
+        return key, THUMBNAIL_MEMBERS[member.name], generate
+    
+    # Placeholders depend only on what they show, so files that look alike share one
+    parts = (file.file_type or '', file.title or file.original_filename, _count_label(file))
+    digest = hashlib.sha256(json.dumps([PLACEHOLDER_VERSION, *parts]).encode()).hexdigest()[:32]
+    return f'placeholder-{digest}.svg', 'image/svg+xml', lambda: render_placeholder(*parts)
@@ -0,0 +1,274 @@
+"""
+Post-upload processing pipeline
+
+Uploads only store the bytes, register the file and queue a ProcessingJob in
+the same transaction, so the upload response never waits for processing.
+Worker threads claim due jobs with a lease (a conditional UPDATE, so two
+workers never run the same job, and a crashed worker's job is retried once
+its lease expires) and run every registered stage in order, recording the
+duration and outcome of each one in processing_stage_runs. A job that fails
+is retried with exponential backoff, resuming at the first stage that has
+not succeeded yet; a stage that raises StageError (bad content, not a
+transient fault) fails the job at once.
+
+Usage: python processing.py [--workers N] [--backfill]  (a dedicated worker
+process; set PROCESSING_WORKERS=0 on the web processes to keep processing out
+of them. --backfill first queues files uploaded before a stage was added)
+"""
+
+from models import db, ProcessingJob, ProcessingStageRun, UploadedFile
+from ooxml import extract_metadata, iter_text, MetadataError
+from search import available as search_available, collect_text, index_file
+from package_members import index_members, MemberError
+from sqlalchemy import update, select, or_, and_
+from contextlib import closing
+from datetime import datetime, timedelta
+import hashlib
+import os
+import socket
+import threading
+import time
+import zipfile
+
+# Identifies this process in job leases
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Wakes this process's workers as soon as something is queued
+_processing_event = threading.Event()
+
+class StageError(Exception):
+    """The file itself is bad; retrying the stage would not help"""
+
+# name -> function(app, blob_store, file), run in registration order
+STAGES = {}
+
+def stage(name):
+    """Register a processing stage; stages must be idempotent, as a retried job may run them again"""
+    def register(func):
+        STAGES[name] = func
+        return func
+    return register
+
+@stage('verify_digest')
+def verify_digest(app, blob_store, file):
+    """Re-read the stored content and check it against the digest and size recorded at upload"""
+    sha256 = hashlib.sha256()
+    size = 0
+    with blob_store.open_file(file.file_path, file.encrypted) as f:
+        while True:
+            chunk = f.read(app.config['UPLOAD_STREAM_BUFFER'])
+            if not chunk:
+                break
+            sha256.update(chunk)
+            size += len(chunk)
+    if size != file.file_size:
+        raise StageError(f'Stored size {size} does not match the recorded {file.file_size}')
+    if file.blob_digest and sha256.hexdigest() != file.blob_digest:
+        raise StageError('Stored content does not match its SHA-256 digest')
+
+# Part every valid document of each type contains, besides [Content_Types].xml
+OOXML_MAIN_PARTS = {
+    'docx': 'word/document.xml',
+    'xlsx': 'xl/workbook.xml',
+    'pptx': 'ppt/presentation.xml',
+}
+
+@stage('validate_format')
+def validate_format(app, blob_store, file):
+    """Check that the file is an Office Open XML package of the type its extension claims"""
+    with blob_store.open_file(file.file_path, file.encrypted) as f:
+        try:
+            with zipfile.ZipFile(f) as package:
+                names = set(package.namelist())
+        except zipfile.BadZipFile:
+            raise StageError(f'Not a valid .{file.file_type} file (not a ZIP package)')
+    main_part = OOXML_MAIN_PARTS.get(file.file_type)
+    if '[Content_Types].xml' not in names or (main_part and main_part not in names):
+        raise StageError(f'Not a valid .{file.file_type} file (missing document parts)')
+
+@stage('extract_metadata')
+def extract_document_properties(app, blob_store, file):
+    """Store the title, author, dates and page/word/slide/sheet counts in the file's row"""
+    with blob_store.open_file(file.file_path, file.encrypted) as f:
+        try:
+            properties = extract_metadata(f, file.file_type)
+        except MetadataError as e:
+            raise StageError(str(e))
+    for column, value in properties.items():
+        setattr(file, column, value)
+    file.metadata_extracted_at = datetime.utcnow()
+
+@stage('index_content')
+def index_content(app, blob_store, file):
+    """Add the document text (and the properties found above) to the full-text search index"""
+    if not search_available():
+        return
+    with blob_store.open_file(file.file_path, file.encrypted) as f, closing(iter_text(f, file.file_type)) as pieces:
+        try:
+            content = collect_text(pieces, app.config['SEARCH_MAX_TEXT'])
+        except MetadataError as e:
+            raise StageError(str(e))
+    index_file(file, content)
+
+@stage('index_members')
+def index_package_members(app, blob_store, file):
+    """Record the package's members and their data offsets for the member API"""
+    try:
+        index_members(file, blob_store)
+    except MemberError as e:
+        raise StageError(str(e))
+
+def enqueue_processing(uploaded_file):
+    """Queue processing of a newly registered file; it runs once the caller's transaction commits"""
+    job = ProcessingJob(file=uploaded_file)
+    db.session.add(job)
+    return job
+
+def enqueue_backfill():
+    """Queue a job for every file that lacks a successful run of one of the current stages.
+    
+    Covers files uploaded before a stage was added; files with an unfinished
+    or failed job are left alone. Returns how many files were queued.
+    """
+    other_jobs = select(ProcessingJob.id).where(ProcessingJob.file_id == UploadedFile.id,
+                                                ProcessingJob.status != 'done').exists()
+    stage_missing = or_(*(
+        ~select(ProcessingStageRun.id).join(ProcessingJob)
+        .where(ProcessingJob.file_id == UploadedFile.id, ProcessingStageRun.stage == name,
+               ProcessingStageRun.error.is_(None)).exists()
+        for name in STAGES
+    ))
+    file_ids = [row.id for row in db.session.query(UploadedFile.id).filter(stage_missing, ~other_jobs)]
+    for file_id in file_ids:
+        db.session.add(ProcessingJob(file_id=file_id))
+    db.session.commit()
+    return len(file_ids)
+
+def notify_processing():
+    """Wake this process's workers after queued jobs have been committed"""
+    _processing_event.set()
+
+def _claim_job(lease_seconds):
+    """Claim the oldest due job; returns its id, or None if there is nothing to do"""
+    now = datetime.utcnow()
+    due = or_(
+        and_(ProcessingJob.status == 'pending', ProcessingJob.next_attempt_at <= now),
+        and_(ProcessingJob.status == 'running', ProcessingJob.locked_until < now)  # lease of a crashed worker
+    )
+    candidates = [row.id for row in db.session.query(ProcessingJob.id).filter(due)
+                  .order_by(ProcessingJob.next_attempt_at).limit(8)]
+    
+    for job_id in candidates:
+        result = db.session.execute(
+            update(ProcessingJob)
+            .where(ProcessingJob.id == job_id, due)
+            .values(status='running', locked_until=now + timedelta(seconds=lease_seconds), locked_by=WORKER_ID)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            return job_id
+    return None
+
+def _record_failure(job, error, permanent, config):
+    job.attempts += 1
+    job.last_error = error
+    job.locked_until = None
+    job.locked_by = None
+    if permanent or job.attempts >= config['PROCESSING_MAX_ATTEMPTS']:
+        job.status = 'failed'
+        job.finished_at = datetime.utcnow()
+    else:
+        # Exponential backoff: base, 2 x base, 4 x base, ... capped
+        delay = min(config['PROCESSING_RETRY_BACKOFF'] * 2 ** (job.attempts - 1), config['PROCESSING_RETRY_BACKOFF_MAX'])
+        job.status = 'pending'
+        job.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+
+def run_processing_job(app, blob_store, job_id):
+    """Run the stages of a claimed job that have not succeeded yet, recording each one"""
+    config = app.config
+    job = db.session.get(ProcessingJob, job_id)
+    succeeded = {run.stage for run in job.stage_runs if run.error is None}
+    
+    for name, func in STAGES.items():
+        if name in succeeded:
+            continue
+        started_at = datetime.utcnow()
+        start = time.perf_counter()
+        try:
+            func(app, blob_store, job.file)
+            # A stage's own changes to the file commit together with its run record
+            db.session.add(ProcessingStageRun(job_id=job_id, stage=name, started_at=started_at,
+                                              duration_ms=int((time.perf_counter() - start) * 1000)))
+            job.locked_until = datetime.utcnow() + timedelta(seconds=config['PROCESSING_JOB_LEASE'])
+            db.session.commit()
+        except Exception as e:
+            # Nothing a failed stage did is kept, whether the stage or its commit failed
+            db.session.rollback()
+            permanent = isinstance(e, StageError)
+            error = (str(e) if permanent else f'{type(e).__name__}: {e}')[:1000]
+            app.logger.warning('Processing stage %s failed for file %s: %s', name, job.file_id, error)
+            db.session.add(ProcessingStageRun(job_id=job_id, stage=name, started_at=started_at,
+                                              duration_ms=int((time.perf_counter() - start) * 1000), error=error))
+            _record_failure(job, error, permanent, config)
+            db.session.commit()
+            return False
+    
+    job.status = 'done'
+    job.finished_at = datetime.utcnow()
+    job.locked_until = None
+    job.locked_by = None
+    db.session.commit()
+    return True
+
+def process_next_job(app, blob_store):
+    """Claim and run one due job; returns False when there was none"""
+    job_id = _claim_job(app.config['PROCESSING_JOB_LEASE'])
+    if job_id is None:
+        return False
+    run_processing_job(app, blob_store, job_id)
+    return True
+
+def _worker_loop(app, blob_store):
+    while True:
+        _processing_event.wait(app.config['PROCESSING_POLL_INTERVAL'])
+        _processing_event.clear()
+        try:
+            with app.app_context():
+                # Keep draining while there are due jobs
+                while process_next_job(app, blob_store):
+                    pass
+        except Exception as e:
+            app.logger.warning('Processing worker error: %s', e)
+
+def start_processing_workers(app, blob_store, workers=None):
+    """Start the worker threads that process uploaded files"""
+    threads = []
+    for i in range(app.config['PROCESSING_WORKERS'] if workers is None else workers):
+        thread = threading.Thread(target=_worker_loop, args=(app, blob_store), name=f'processing-worker-{i}', daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
+
+if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Run post-upload processing workers')
+    parser.add_argument('--workers', type=int, default=4, help='worker threads (default: 4)')
+    parser.add_argument('--backfill', action='store_true', help='queue files processed before the current stages existed')
+    args = parser.parse_args()
+    
+    os.environ['PROCESSING_WORKERS'] = '0'  # the app itself starts none; this process runs them
+    from app import create_app
+    import processing  # the importable module (not __main__) holds the stage registry other modules add to
+    import routes
+    
+    app = create_app()
+    if args.backfill:
+        with app.app_context():
+            print(f"Queued {processing.enqueue_backfill()} files for processing")
+    threads = processing.start_processing_workers(app, routes.blob_store, args.workers)
+    print(f"Processing uploads with {args.workers} workers ({WORKER_ID})")
+    processing.notify_processing()  # start on the backlog right away
+    for thread in threads:
+        thread.join()
@@ -0,0 +1,217 @@
+"""
+Reconciliation between the upload directories and the uploaded_files table
+
+A run first walks the stored files in sorted order and checks each batch
+against the database with indexed lookups; files nothing references (left
+behind by an upload that failed before its commit) are quarantined, deleted
+or only reported. It then walks uploaded_files by id and flags rows whose
+file has disappeared (from disk or from the storage backend). The position
+is saved in the job's cursor after every batch, so a scan over millions of
+files resumes where the previous run stopped instead of starting over.
+"""
+
+from models import db, Blob, UploadedFile, UploadSession, DownloadToken, MaintenanceJob, ProcessingJob, PackageMember
+from storage import shard_path, create_blob_store
+from sqlalchemy import select
+from datetime import datetime
+import heapq
+import itertools
+import os
+import shutil
+import time
+
+JOB_NAME = 'reconcile_uploads'
+
+def _scan_roots(config):
+    """Directories to walk; BLOB_FOLDER only when it lives outside UPLOAD_FOLDER"""
+    roots = [config['UPLOAD_FOLDER']]
+    upload_root = os.path.abspath(config['UPLOAD_FOLDER'])
+    if os.path.commonpath([upload_root, os.path.abspath(config['BLOB_FOLDER'])]) != upload_root:
+        roots.append(config['BLOB_FOLDER'])
+    return roots
+
+def _walk_sorted(root, after=(), skip=(), prefix=()):
+    """Yield ``(parts, DirEntry)`` for the files under root in sorted order, strictly after ``after``"""
+    # Entries before the cursor are dropped while listing, and the rest come off a heap
+    # as they are consumed, so a resumed run does not sort the whole directory again
+    bound = after[:len(prefix) + 1]
+    try:
+        with os.scandir(os.path.join(root, *prefix)) as entries:
+            heap = [(entry.name, entry) for entry in entries if prefix + (entry.name,) >= bound]
+    except FileNotFoundError:
+        return
+    heapq.heapify(heap)
+    while heap:
+        _, entry = heapq.heappop(heap)
+        parts = prefix + (entry.name,)
+        if entry.is_dir(follow_symlinks=False):
+            # Subtrees that sort before the cursor were finished by an earlier run
+            if parts >= after[:len(parts)] and os.path.abspath(entry.path) not in skip:
+                yield from _walk_sorted(root, after, skip, parts)
+        elif entry.is_file(follow_symlinks=False) and parts > after:
+            yield parts, entry
+
+def _iter_positions(config, cursor):
+    """Yield ``(cursor, kind, item)`` for every file on disk, then every uploaded_files row"""
+    roots = _scan_roots(config)
+    skip = {os.path.abspath(config['QUARANTINE_FOLDER']), os.path.abspath(config['PREVIEW_CACHE_FOLDER'])}
+    phase, _, position = (cursor or 'files:0:').partition(':')
+    
+    last_id = 0
+    if phase == 'files':
+        start, _, relative_path = position.partition(':')
+        for index in range(int(start), len(roots)):
+            after = tuple(relative_path.split('/')) if relative_path and index == int(start) else ()
+            for parts, entry in _walk_sorted(roots[index], after, skip):
+                yield f"files:{index}:{'/'.join(parts)}", 'file', (roots[index], entry)
+    else:
+        last_id = int(position)
+    
+    while True:
+        rows = db.session.execute(
+            select(UploadedFile.id, UploadedFile.file_path, UploadedFile.missing_at)
+            .where(UploadedFile.id > last_id)
+            .order_by(UploadedFile.id)
+            .limit(config['MAINTENANCE_BATCH_SIZE'])
+        ).all()
+        if not rows:
+            return
+        for row in rows:
+            yield f'rows:{row.id}', 'row', row
+        last_id = rows[-1].id
+
+def _path_forms(path):
+    """Spellings a stored file_path may use for a file: as walked, absolute, real, and relative to the working directory"""
+    absolute = os.path.abspath(path)
+    forms = {path, os.path.normpath(path), absolute, os.path.realpath(path)}
+    try:
+        forms.add(os.path.relpath(absolute))
+    except ValueError:
+        pass  # on another drive (Windows)
+    return forms
+
+def _referenced(paths, config):
+    """Return the subset of on-disk paths the database still points at"""
+    # Rows store the path as UPLOAD_FOLDER was configured when the file was written,
+    # so a folder changed from relative to absolute (or behind a symlink) still matches
+    forms = {form: path for path in paths for form in _path_forms(path)}
+    referenced = {forms[stored] for stored in
+                  db.session.scalars(select(UploadedFile.file_path).where(UploadedFile.file_path.in_(list(forms))))}
+    
+    # Blobs at their current layout position and partial uploads are also known by name,
+    # whatever form the stored path has
+    blob_root = os.path.abspath(config['BLOB_FOLDER'])
+    partial_root = os.path.abspath(os.path.join(config['UPLOAD_FOLDER'], '.partial'))
+    blobs, sessions = {}, {}
+    for path in paths:
+        parent, name = os.path.split(os.path.abspath(path))
+        if shard_path(blob_root, name, config['STORAGE_SHARD_DEPTH']) == os.path.abspath(path):
+            blobs[name] = path
+        elif parent == partial_root and name.endswith('.part'):
+            sessions[name[:-len('.part')]] = path
+    if blobs:
+        referenced.update(blobs[digest] for digest in
+                          db.session.scalars(select(Blob.digest).where(Blob.digest.in_(list(blobs)))))
+    if sessions:
+        referenced.update(sessions[upload_id] for upload_id in
+                          db.session.scalars(select(UploadSession.id).where(UploadSession.id.in_(list(sessions)))))
+    return referenced
+
+def _dispose(app, root, path):
+    """Quarantine, delete or report one orphaned file"""
+    config = app.config
+    action = config['RECONCILE_ACTION']
+    if action == 'report':
+        app.logger.warning('Orphaned upload file: %s', path)
+        return
+    if action == 'delete':
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return
+    
+    target = os.path.join(config['QUARANTINE_FOLDER'], os.path.basename(os.path.abspath(root)),
+                          os.path.relpath(path, root))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    shutil.move(path, target)
+    # An upload may have claimed the content while it was being moved
+    if _referenced([path], config):
+        shutil.move(target, path)
+
+def _reconcile_files(app, files):
+    """Dispose of the orphans among a batch of ``(root, DirEntry)``; returns how many were found"""
+    cutoff = time.time() - app.config['RECONCILE_GRACE']
+    candidates = {}
+    for root, entry in files:
+        try:
+            if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                candidates[entry.path] = root
+        except FileNotFoundError:
+            continue
+    if not candidates:
+        return 0
+    
+    orphans = sorted(set(candidates) - _referenced(list(candidates), app.config))
+    for path in orphans:
+        _dispose(app, candidates[path], path)
+    return len(orphans)
+
+def _reconcile_rows(app, store, rows):
+    """Flag (or delete) rows whose file is gone; returns how many are missing"""
+    now = datetime.utcnow()
+    missing = 0
+    for row in rows:
+        exists = store.file_exists(row.file_path)
+        if exists and row.missing_at is not None:
+            db.session.get(UploadedFile, row.id).missing_at = None
+        elif not exists:
+            missing += 1
+            if row.missing_at is None:
+                # Only flagged the first time: a failed check (e.g. a storage hiccup) must not delete anything
+                app.logger.warning('Uploaded file %s is missing from disk: %s', row.id, row.file_path)
+                db.session.get(UploadedFile, row.id).missing_at = now
+            elif app.config['RECONCILE_ACTION'] == 'delete':
+                # Still missing on a later run
+                file = db.session.get(UploadedFile, row.id)
+                DownloadToken.query.filter_by(file_id=row.id).delete()
+                ProcessingJob.delete_for_file(row.id)
+                PackageMember.query.filter_by(file_id=row.id).delete()
+                db.session.delete(file)
+                # The content is already gone, so an unused blob row can go in the same transaction
+                if file.blob_digest and Blob.release(file.blob_digest):
+                    Blob.drop_if_unused(file.blob_digest)
+    return missing
+
+def _save_cursor(cursor):
+    job = db.session.get(MaintenanceJob, JOB_NAME)
+    if job is None:
+        job = MaintenanceJob(name=JOB_NAME)
+        db.session.add(job)
+    job.cursor = cursor
+
+def reconcile_uploads(app):
+    """Examine up to RECONCILE_SCAN_LIMIT files and rows from the saved cursor; returns the mismatches found"""
+    config = app.config
+    job = db.session.get(MaintenanceJob, JOB_NAME)
+    positions = _iter_positions(config, job.cursor if job else None)
+    store = create_blob_store(config)
+    
+    mismatches = 0
+    remaining = config['RECONCILE_SCAN_LIMIT']
+    while remaining > 0:
+        batch = list(itertools.islice(positions, min(config['MAINTENANCE_BATCH_SIZE'], remaining)))
+        if not batch:
+            _save_cursor(None)  # full pass finished; the next run starts over
+            db.session.commit()
+            break
+        remaining -= len(batch)
+        
+        mismatches += _reconcile_files(app, [item for _, kind, item in batch if kind == 'file'])
+        mismatches += _reconcile_rows(app, store, [item for _, kind, item in batch if kind == 'row'])
+        _save_cursor(batch[-1][0])
+        db.session.commit()
+        
+        # Throttle the scan so it does not compete with request I/O
+        time.sleep(config['MAINTENANCE_BATCH_PAUSE'])
+    return mismatches
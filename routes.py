@@ -1,12 +1,25 @@
-from flask import Blueprint, request, jsonify, current_app, send_file
-from flask_jwt_extended import jwt_required, get_jwt_identity, create_access_token
-from werkzeug.security import check_password_hash, generate_password_hash
+from flask import Blueprint, request, jsonify, current_app, send_file, Response
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt, create_access_token
 from werkzeug.utils import secure_filename
-from flask_mail import Message
-from models import db, User, UploadedFile, DownloadToken
-from utils import EncryptionService, TokenService, allowed_file, generate_secure_filename, ensure_upload_directory
+from werkzeug.wsgi import wrap_file
+from sqlalchemy import or_, and_, event, select
+from sqlalchemy.orm import contains_eager
+from models import db, User, UploadedFile, DownloadToken, UploadSession, Blob, ProcessingJob, PackageMember
+from storage import create_blob_store
+from passwords import PasswordHasher, HasherBusy
+from mailer import enqueue_email, notify_outbox
+from processing import enqueue_processing, notify_processing
+import search
+from package_members import ensure_member_index, MemberReader, MemberError, SUPPORTED_COMPRESSION
+from previews import PreviewCache, preview_source
+from utils import EncryptionService, TokenService, ReplayFilter, IdentityCache, HotFileCache, parse_keyring, allowed_file, ensure_upload_directory, generate_upload_id, stream_to_file, iter_zip_stream, encode_cursor, decode_cursor
+from functools import wraps
+import mimetypes
 import os
-from datetime import datetime, timedelta
+import re
+from datetime import datetime, timedelta, timezone
+
+SHA256_HEX = re.compile(r'[0-9a-f]{64}')
 
 # Create blueprints
 auth_bp = Blueprint('auth', __name__)
@@ -16,13 +29,85 @@ client_bp = Blueprint('client', __name__)
 # Initialize services (will be set in app factory)
 encryption_service = None
 token_service = None
+replay_filter = None
+blob_store = None
+password_hasher = None
+identity_cache = None
+preview_cache = None
+hot_file_cache = None
 
 def init_services(app):
     """Initialize services with app config"""
-    global encryption_service, token_service
-    encryption_key = app.config.get('ENCRYPTION_KEY', 'default-key')
-    encryption_service = EncryptionService(encryption_key)
+    global encryption_service, token_service, replay_filter, blob_store, password_hasher, identity_cache, preview_cache, hot_file_cache
+    if app.config.get('ENCRYPTION_KEYS'):
+        encryption_service = EncryptionService(keys=parse_keyring(app.config['ENCRYPTION_KEYS']),
+                                               active_key_id=app.config.get('ENCRYPTION_ACTIVE_KEY_ID'))
+    else:
+        encryption_key = app.config.get('ENCRYPTION_KEY', 'default-key')
+        encryption_service = EncryptionService(encryption_key)
     token_service = TokenService(encryption_service)
+    replay_filter = ReplayFilter(app.config['TOKEN_REPLAY_FILTER_CAPACITY'],
+                                 app.config['TOKEN_REPLAY_FILTER_ERROR_RATE'])
+    blob_store = create_blob_store(app.config, encryption_service)
+    password_hasher = PasswordHasher(
+        method=app.config['PASSWORD_HASH_METHOD'],
+        executor=app.config['PASSWORD_HASH_EXECUTOR'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+        retry_after=app.config['PASSWORD_HASH_RETRY_AFTER']
+    )
+    identity_cache = IdentityCache(ttl=app.config['IDENTITY_CACHE_TTL'])
+    preview_cache = PreviewCache(app.config['PREVIEW_CACHE_FOLDER'], app.config['PREVIEW_CACHE_MAX_BYTES'])
+    hot_file_cache = HotFileCache(app.config['HOT_FILE_CACHE_MAX_BYTES'],
+                                  app.config['HOT_FILE_CACHE_MAX_OBJECT']) if app.config['HOT_FILE_CACHE'] else None
+
+def _load_identity(user_id):
+    """Fetch the (role, token version) of a user for the identity cache"""
+    row = db.session.query(User.user_type, User.token_version).filter(User.id == user_id).first()
+    return tuple(row) if row else None
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_identity(mapper, connection, user):
+    if identity_cache is not None:
+        identity_cache.invalidate(user.id)
+
+def role_required(role):
+    """Require a valid JWT whose role claim matches; the user row is only read on a cache miss"""
+    def decorator(fn):
+        @wraps(fn)
+        @jwt_required()
+        def wrapper(*args, **kwargs):
+            claims = get_jwt()
+            identity = identity_cache.get(int(get_jwt_identity()), _load_identity)
+            if not identity:
+                return jsonify({'message': 'Unauthorized'}), 403
+            
+            current_role, current_version = identity
+            # Tokens issued before role claims existed are checked against the stored role only
+            if 'ver' in claims and (claims.get('role') != current_role or claims['ver'] != current_version):
+                return jsonify({'message': 'Unauthorized'}), 403
+            if current_role != role:
+                return jsonify({'message': 'Unauthorized'}), 403
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _verify_password(user, password):
+    """Check a login password and transparently upgrade hashes made with old parameters"""
+    if not password_hasher.verify(user.password_hash, password):
+        return False
+    if password_hasher.needs_rehash(user.password_hash):
+        user.password_hash = password_hasher.hash(password)
+        db.session.commit()
+    return True
+
+@auth_bp.errorhandler(HasherBusy)
+def password_hasher_busy(error):
+    """Shed login load instead of queueing unbounded hashing work"""
+    response = jsonify({'message': 'Server is busy, please retry shortly'})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
 
 # Authentication Routes
 @auth_bp.route('/ops/login', methods=['POST'])
@@ -35,8 +120,8 @@ def ops_login():
     
     user = User.query.filter_by(email=data['email'], user_type='ops').first()
     
-    if user and check_password_hash(user.password_hash, data['password']):
-        access_token = create_access_token(identity=str(user.id))
+    if user and _verify_password(user, data['password']):
+        access_token = create_access_token(identity=str(user.id), additional_claims=user.jwt_claims())
         return jsonify({
             'access_token': access_token,
             'user_type': 'ops',
@@ -60,7 +145,7 @@ def client_signup():
     # Create new user
     user = User(
         email=data['email'],
-        password_hash=generate_password_hash(data['password']),
+        password_hash=password_hasher.hash(data['password']),
         user_type='client',
         is_verified=True
     )
@@ -68,19 +153,18 @@ def client_signup():
     # Generate verification token
     verification_token = user.generate_verification_token()
     
+    # The verification email goes through the outbox in the same transaction;
+    # the background sender delivers it without holding up the response
     db.session.add(user)
+    send_verification_email(user.email, verification_token)
     db.session.commit()
+    notify_outbox()
     
-    # Send verification email
-    try:
-        send_verification_email(user.email, verification_token)
-        encrypted_url = encryption_service.encrypt(f"verify:{verification_token}")
-        return jsonify({
-            'message': 'User created successfully. Please check your email for verification.',
-            'encrypted_verification_url': encrypted_url
-        }), 201
-    except Exception as e:
-        return jsonify({'message': 'User created but email sending failed'}), 201
+    encrypted_url = encryption_service.encrypt(f"verify:{verification_token}")
+    return jsonify({
+        'message': 'User created successfully. Please check your email for verification.',
+        'encrypted_verification_url': encrypted_url
+    }), 201
 
 @auth_bp.route('/client/verify-email', methods=['POST'])
 def verify_email():
@@ -117,8 +201,8 @@ def client_login():
     if not user.is_verified:
         return jsonify({'message': 'Please verify your email before logging in'}), 401
     
-    if check_password_hash(user.password_hash, data['password']):
-        access_token = create_access_token(identity=str(user.id))
+    if _verify_password(user, data['password']):
+        access_token = create_access_token(identity=str(user.id), additional_claims=user.jwt_claims())
         return jsonify({
             'access_token': access_token,
             'user_type': 'client',
@@ -129,14 +213,10 @@ def client_login():
 
 # Ops Routes
 @ops_bp.route('/upload', methods=['POST'])
-@jwt_required()
+@role_required('ops')
 def upload_file():
     """Ops user file upload"""
     user_id = int(get_jwt_identity())
-    user = User.query.get(user_id)
-    
-    if not user or user.user_type != 'ops':
-        return jsonify({'message': 'Unauthorized'}), 403
     
     if 'file' not in request.files:
         return jsonify({'message': 'No file provided'}), 400
@@ -150,88 +230,595 @@ def upload_file():
         return jsonify({'message': 'File type not allowed. Only .pptx, .docx, .xlsx files are permitted'}), 400
     
     try:
-        # Ensure upload directory exists
-        ensure_upload_directory(current_app.config['UPLOAD_FOLDER'])
-        
-        # Generate secure filename
-        stored_filename = generate_secure_filename(file.filename)
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], stored_filename)
+        # Hash the content while streaming it into the blob store
+        digest, file_size, file_path = blob_store.store_stream(file.stream)
         
-        # Save file
-        file.save(file_path)
-        
-        # Get file size
-        file_size = os.path.getsize(file_path)
-        
-        # Save file info to database
-        uploaded_file = UploadedFile(
+        return _register_upload(
             original_filename=secure_filename(file.filename),
-            stored_filename=stored_filename,
-            file_path=file_path,
-            file_size=file_size,
             file_type=file.filename.rsplit('.', 1)[1].lower(),
-            uploaded_by=user_id
+            digest=digest,
+            file_size=file_size,
+            file_path=file_path,
+            user_id=user_id
         )
         
-        db.session.add(uploaded_file)
-        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Upload failed: {str(e)}'}), 500
+
+def _register_upload(original_filename, file_type, digest, file_size, file_path, user_id, extra=None):
+    """Create the UploadedFile row for stored content and take a reference on its blob"""
+    uploaded_file = UploadedFile(
+        original_filename=original_filename,
+        stored_filename=digest,
+        file_path=file_path,
+        file_size=file_size,
+        file_type=file_type,
+        uploaded_by=user_id,
+        blob_digest=digest
+    )
+    
+    Blob.acquire(digest, file_size, blob_store.stored_encrypted)
+    if not blob_store.exists(digest):
+        # The content was reused from a blob that a concurrent delete removed before
+        # this reference was taken; the upload's own copy was already discarded
+        db.session.rollback()
+        return jsonify({'message': 'Stored content was removed concurrently, please retry the upload'}), 409
+    # Reused content keeps the form it was first stored in, encrypted or not
+    uploaded_file.encrypted = Blob.is_encrypted(digest)
+    db.session.add(uploaded_file)
+    # Hashing, validation and the like run in the processing workers, not in this request
+    enqueue_processing(uploaded_file)
+    db.session.commit()
+    notify_processing()
+    
+    return jsonify({
+        'message': 'File uploaded successfully',
+        'file_id': uploaded_file.id,
+        'original_filename': uploaded_file.original_filename,
+        'file_size': uploaded_file.file_size,
+        'sha256': digest,
+        'processing': 'pending',
+        **(extra or {})
+    }), 201
+
+@ops_bp.route('/files/<int:file_id>', methods=['DELETE'])
+@role_required('ops')
+def delete_file(file_id):
+    """Ops user file deletion; the stored blob is only removed once nothing references it"""
+    file = UploadedFile.query.get(file_id)
+    if not file:
+        return jsonify({'message': 'File not found'}), 404
+    
+    digest = file.blob_digest
+    legacy_path = None if digest else file.file_path
+    
+    DownloadToken.query.filter_by(file_id=file_id).delete()
+    ProcessingJob.delete_for_file(file_id)
+    PackageMember.query.filter_by(file_id=file_id).delete()
+    db.session.delete(file)
+    blob_unused = Blob.release(digest) if digest else False
+    db.session.commit()
+    
+    # Only touch the disk once the database no longer points at the content, and only
+    # if no upload has taken a new reference on the blob since
+    if blob_unused and Blob.purge(digest, blob_store.remove):
+        if hot_file_cache is not None:
+            hot_file_cache.invalidate(digest)
+    elif legacy_path and os.path.exists(legacy_path):
+        os.remove(legacy_path)
+    
+    return jsonify({'message': 'File deleted successfully'}), 200
+
+@ops_bp.route('/hot-file-cache', methods=['GET'])
+@role_required('ops')
+def get_hot_file_cache_stats():
+    """Hit, miss, eviction and bypass counters of this process's hot-file cache"""
+    if hot_file_cache is None:
+        return jsonify({'enabled': False}), 200
+    return jsonify({'enabled': True, **hot_file_cache.stats()}), 200
+
+@ops_bp.route('/files/<int:file_id>/processing', methods=['GET'])
+@role_required('ops')
+def get_processing_status(file_id):
+    """Status of a file's post-upload processing, with the duration and outcome of each stage"""
+    job = ProcessingJob.query.filter_by(file_id=file_id).order_by(ProcessingJob.id.desc()).first()
+    if not job:
+        return jsonify({'message': 'File not found'}), 404
+    
+    return jsonify(job.to_dict()), 200
+
+# Resumable (chunked) upload routes
+def _get_upload_session(upload_id, user_id):
+    """Load an upload session owned by the given ops user"""
+    upload = UploadSession.query.get(upload_id)
+    if not upload or upload.uploaded_by != user_id:
+        return None
+    return upload
+
+@ops_bp.route('/uploads', methods=['POST'])
+@role_required('ops')
+def create_upload():
+    """Start a resumable upload; chunks are then appended with PATCH"""
+    user_id = int(get_jwt_identity())
+    
+    data = request.get_json()
+    
+    if not data or not data.get('filename') or data.get('size') is None:
+        return jsonify({'message': 'Filename and size are required'}), 400
+    
+    filename = data['filename']
+    if not isinstance(filename, str) or not allowed_file(filename, current_app.config['ALLOWED_EXTENSIONS']):
+        return jsonify({'message': 'File type not allowed. Only .pptx, .docx, .xlsx files are permitted'}), 400
+    
+    # bool is an int subclass, so true/false would otherwise pass as 1/0
+    if isinstance(data['size'], bool):
+        return jsonify({'message': 'Size must be an integer'}), 400
+    try:
+        total_size = int(data['size'])
+    except (TypeError, ValueError):
+        return jsonify({'message': 'Size must be an integer'}), 400
+    
+    if total_size <= 0 or total_size > current_app.config['MAX_UPLOAD_SIZE']:
+        return jsonify({'message': 'File size not allowed'}), 413
+    
+    # Known content can be registered without sending any bytes
+    digest = data.get('sha256')
+    if digest not in (None, ''):
+        if not isinstance(digest, str) or not SHA256_HEX.fullmatch(digest.lower()):
+            return jsonify({'message': 'sha256 must be 64 hexadecimal characters'}), 400
+        digest = digest.lower()
+        blob = Blob.query.get(digest)
+        if blob and blob.size == total_size and blob_store.exists(digest):
+            return _register_upload(
+                original_filename=secure_filename(filename),
+                file_type=filename.rsplit('.', 1)[1].lower(),
+                digest=digest,
+                file_size=total_size,
+                file_path=blob_store.path_for(digest),
+                user_id=user_id,
+                extra={'deduplicated': True}
+            )
+    
+    partial_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], '.partial')
+    ensure_upload_directory(partial_folder)
+    
+    upload_id = generate_upload_id()
+    temp_path = os.path.join(partial_folder, f"{upload_id}.part")
+    open(temp_path, 'wb').close()
+    
+    upload = UploadSession(
+        id=upload_id,
+        original_filename=secure_filename(filename),
+        file_type=filename.rsplit('.', 1)[1].lower(),
+        total_size=total_size,
+        temp_path=temp_path,
+        uploaded_by=user_id
+    )
+    db.session.add(upload)
+    db.session.commit()
+    
+    response = jsonify({
+        **upload.to_dict(),
+        'chunk_size': current_app.config['UPLOAD_CHUNK_SIZE'],
+        'message': 'Upload created'
+    })
+    response.headers['Upload-Offset'] = '0'
+    return response, 201
+
+@ops_bp.route('/uploads/<upload_id>', methods=['GET', 'HEAD'])
+@role_required('ops')
+def get_upload_offset(upload_id):
+    """Report how many bytes of a resumable upload have been received"""
+    upload = _get_upload_session(upload_id, int(get_jwt_identity()))
+    if not upload:
+        return jsonify({'message': 'Upload not found'}), 404
+    
+    response = jsonify({**upload.to_dict(), 'message': 'success'})
+    response.headers['Upload-Offset'] = str(upload.offset)
+    response.headers['Upload-Length'] = str(upload.total_size)
+    response.headers['Cache-Control'] = 'no-store'
+    return response, 200
+
+@ops_bp.route('/uploads/<upload_id>', methods=['PATCH'])
+@role_required('ops')
+def append_upload_chunk(upload_id):
+    """Append a chunk at the offset given in the Upload-Offset header"""
+    upload = _get_upload_session(upload_id, int(get_jwt_identity()))
+    if not upload:
+        return jsonify({'message': 'Upload not found'}), 404
+    
+    try:
+        client_offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return jsonify({'message': 'Upload-Offset header is required'}), 400
+    
+    # Only one request may append to an upload at a time; a concurrent PATCH for the
+    # same offset would otherwise interleave its bytes with this one
+    holder = UploadSession.claim_writer(upload_id, current_app.config['UPLOAD_CHUNK_LEASE'])
+    if holder is None:
+        response = jsonify({'message': 'Another chunk of this upload is being written', 'offset': upload.offset})
+        response.headers['Upload-Offset'] = str(upload.offset)
+        return response, 409
+    
+    try:
+        current_offset = upload.offset
+        if client_offset != current_offset:
+            # The client is out of sync (e.g. a retried chunk); tell it where to resume
+            response = jsonify({'message': 'Offset mismatch', 'offset': current_offset})
+            response.headers['Upload-Offset'] = str(current_offset)
+            return response, 409
         
-        return jsonify({
-            'message': 'File uploaded successfully',
-            'file_id': uploaded_file.id,
-            'original_filename': uploaded_file.original_filename,
-            'file_size': uploaded_file.file_size
-        }), 201
+        remaining = upload.total_size - current_offset
+        with open(upload.temp_path, 'r+b') as part:
+            part.seek(current_offset)
+            written = stream_to_file(request.stream, part,
+                                     remaining, current_app.config['UPLOAD_STREAM_BUFFER'])
+            if written < 0:
+                part.truncate(current_offset)
+                return jsonify({'message': 'Chunk exceeds declared upload size'}), 413
+    finally:
+        UploadSession.release_writer(upload_id, holder)
+    
+    new_offset = current_offset + written
+    response = jsonify({'message': 'Chunk received', 'offset': new_offset})
+    response.headers['Upload-Offset'] = str(new_offset)
+    return response, 200
+
+@ops_bp.route('/uploads/<upload_id>/complete', methods=['POST'])
+@role_required('ops')
+def complete_upload(upload_id):
+    """Finalize a fully received upload and register the file"""
+    user_id = int(get_jwt_identity())
+    upload = _get_upload_session(upload_id, user_id)
+    if not upload:
+        return jsonify({'message': 'Upload not found'}), 404
+    
+    # Hold the write lease so no chunk can be appended while the file is stored
+    holder = UploadSession.claim_writer(upload_id, current_app.config['UPLOAD_CHUNK_LEASE'])
+    if holder is None:
+        return jsonify({'message': 'A chunk of this upload is still being written'}), 409
+    
+    if upload.offset != upload.total_size:
+        UploadSession.release_writer(upload_id, holder)
+        response = jsonify({'message': 'Upload incomplete', 'offset': upload.offset})
+        response.headers['Upload-Offset'] = str(upload.offset)
+        return response, 409
+    
+    temp_path = upload.temp_path
+    try:
+        digest, file_size, file_path = blob_store.store_file(temp_path)
+        
+        db.session.delete(upload)
+        response, status = _register_upload(
+            original_filename=upload.original_filename,
+            file_type=upload.file_type,
+            digest=digest,
+            file_size=file_size,
+            file_path=file_path,
+            user_id=user_id
+        )
+        if status != 201:
+            # The session survives the rollback; its bytes were consumed, so it restarts from 0
+            open(temp_path, 'wb').close()
+            UploadSession.release_writer(upload_id, holder)
+            response.headers['Upload-Offset'] = '0'
+        return response, status
         
     except Exception as e:
-        return jsonify({'message': f'Upload failed: {str(e)}'}), 500
+        db.session.rollback()
+        # If the bytes were already consumed by the store, the session restarts from 0
+        if not os.path.exists(temp_path):
+            open(temp_path, 'wb').close()
+        UploadSession.release_writer(upload_id, holder)
+        response = jsonify({'message': f'Upload failed: {str(e)}'})
+        response.headers['Upload-Offset'] = str(os.path.getsize(temp_path))
+        return response, 500
+
+@ops_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+@role_required('ops')
+def abort_upload(upload_id):
+    """Abort a resumable upload and discard the received bytes"""
+    upload = _get_upload_session(upload_id, int(get_jwt_identity()))
+    if not upload:
+        return jsonify({'message': 'Upload not found'}), 404
+    
+    if UploadSession.claim_writer(upload_id, current_app.config['UPLOAD_CHUNK_LEASE']) is None:
+        return jsonify({'message': 'A chunk of this upload is still being written'}), 409
+    
+    if os.path.exists(upload.temp_path):
+        os.remove(upload.temp_path)
+    db.session.delete(upload)
+    db.session.commit()
+    
+    return jsonify({'message': 'Upload aborted'}), 200
 
 # Client Routes
 @client_bp.route('/files', methods=['GET'])
-@jwt_required()
+@role_required('client')
 def list_files():
-    """Client user list all uploaded files"""
-    user_id = int(get_jwt_identity())
-    user = User.query.get(user_id)
+    """Client user list uploaded files, one keyset-paginated page at a time"""
+    args = request.args
+    
+    sort = args.get('sort', 'uploaded_at')
+    if sort not in FILE_SORT_COLUMNS:
+        return jsonify({'message': f"sort must be one of: {', '.join(FILE_SORT_COLUMNS)}"}), 400
+    order = args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        return jsonify({'message': 'order must be asc or desc'}), 400
+    
+    try:
+        limit = min(int(args.get('limit', current_app.config['FILES_PAGE_SIZE'])),
+                    current_app.config['FILES_MAX_PAGE_SIZE'])
+        uploaded_after = _parse_datetime_arg('uploaded_after')
+        uploaded_before = _parse_datetime_arg('uploaded_before')
+        uploaded_by = int(args['uploaded_by']) if 'uploaded_by' in args else None
+        count_bounds = {name: (int(args[f'min_{name}']) if f'min_{name}' in args else None,
+                               int(args[f'max_{name}']) if f'max_{name}' in args else None)
+                        for name in FILE_COUNT_FILTERS}
+    except ValueError:
+        return jsonify({'message': 'Invalid limit, uploaded_by, count or date filter'}), 400
+    if limit <= 0:
+        return jsonify({'message': 'limit must be positive'}), 400
+    
+    # One query per page: the uploader is joined in rather than lazy-loaded per row
+    sort_column = FILE_SORT_COLUMNS[sort]
+    query = UploadedFile.query.join(UploadedFile.uploader).options(contains_eager(UploadedFile.uploader))
+    
+    if args.get('file_type'):
+        query = query.filter(UploadedFile.file_type == args['file_type'].lower())
+    if args.get('uploader'):
+        query = query.filter(User.email == args['uploader'])
+    if uploaded_by is not None:
+        query = query.filter(UploadedFile.uploaded_by == uploaded_by)
+    if uploaded_after:
+        query = query.filter(UploadedFile.uploaded_at >= uploaded_after)
+    if uploaded_before:
+        query = query.filter(UploadedFile.uploaded_at < uploaded_before)
     
-    if not user or user.user_type != 'client':
-        return jsonify({'message': 'Unauthorized'}), 403
+    # Document properties (filled in after upload by the extract_metadata processing stage)
+    if args.get('title'):
+        # Prefix match written as a range so the (title, id) index serves it
+        query = query.filter(UploadedFile.title >= args['title'], UploadedFile.title < args['title'] + '\U0010ffff')
+    if args.get('author'):
+        query = query.filter(UploadedFile.author == args['author'])
+    for name, (low, high) in count_bounds.items():
+        if low is not None:
+            query = query.filter(FILE_COUNT_FILTERS[name] >= low)
+        if high is not None:
+            query = query.filter(FILE_COUNT_FILTERS[name] <= high)
     
-    files = UploadedFile.query.all()
+    # Keyset pagination on (sort column, id): resume strictly after the last row of the previous page
+    if args.get('cursor'):
+        cursor = decode_cursor(args['cursor'])
+        if not cursor or cursor.get('sort') != sort or cursor.get('order') != order:
+            return jsonify({'message': 'Invalid cursor'}), 400
+        try:
+            last_value = datetime.fromisoformat(cursor['value']) if sort == 'uploaded_at' else cursor['value']
+            last_id = int(cursor['id'])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'message': 'Invalid cursor'}), 400
+        if order == 'asc':
+            query = query.filter(or_(sort_column > last_value,
+                                     and_(sort_column == last_value, UploadedFile.id > last_id)))
+        else:
+            query = query.filter(or_(sort_column < last_value,
+                                     and_(sort_column == last_value, UploadedFile.id < last_id)))
+    
+    if order == 'asc':
+        query = query.order_by(sort_column.asc(), UploadedFile.id.asc())
+    else:
+        query = query.order_by(sort_column.desc(), UploadedFile.id.desc())
+    
+    files = query.limit(limit + 1).all()
+    has_more = len(files) > limit
+    files = files[:limit]
+    
+    next_cursor = None
+    if has_more:
+        last = files[-1]
+        last_value = getattr(last, sort)
+        next_cursor = encode_cursor({
+            'sort': sort,
+            'order': order,
+            'value': last_value.isoformat() if sort == 'uploaded_at' else last_value,
+            'id': last.id
+        })
     
     return jsonify({
         'files': [file.to_dict() for file in files],
+        'next_cursor': next_cursor,
+        'message': 'success'
+    }), 200
+
+@client_bp.route('/search', methods=['GET'])
+@role_required('client')
+def search_files():
+    """Client user full-text search over file names, document properties and contents, best match first"""
+    args = request.args
+    if not search.available():
+        return jsonify({'message': 'Search is not available with this database'}), 501
+    
+    match_query = search.build_match_query(args.get('q', ''))
+    if not match_query:
+        return jsonify({'message': 'q must contain at least one word'}), 400
+    try:
+        limit = min(int(args.get('limit', current_app.config['SEARCH_PAGE_SIZE'])),
+                    current_app.config['SEARCH_MAX_PAGE_SIZE'])
+    except ValueError:
+        return jsonify({'message': 'Invalid limit'}), 400
+    if limit <= 0:
+        return jsonify({'message': 'limit must be positive'}), 400
+    
+    # Keyset pagination on (rank, id), like list_files; the cursor also keeps the candidate floor
+    after = None
+    if args.get('cursor'):
+        cursor = decode_cursor(args['cursor'])
+        if not cursor or cursor.get('q') != match_query:
+            return jsonify({'message': 'Invalid cursor'}), 400
+        try:
+            after = (float(cursor['rank']), int(cursor['id']))
+            floor = int(cursor['floor'])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'message': 'Invalid cursor'}), 400
+    else:
+        floor = search.candidate_floor(match_query, current_app.config['SEARCH_MAX_CANDIDATES'])
+    
+    matches = search.search(match_query, limit + 1, floor, after)
+    has_more = len(matches) > limit
+    matches = matches[:limit]
+    
+    # One query for the page's files, with their uploaders joined in
+    ids = [file_id for file_id, _, _ in matches]
+    files = {file.id: file for file in UploadedFile.query.join(UploadedFile.uploader)
+             .options(contains_eager(UploadedFile.uploader)).filter(UploadedFile.id.in_(ids))} if ids else {}
+    
+    results = [{**files[file_id].to_dict(), 'score': -rank, 'snippet': snippet}
+               for file_id, rank, snippet in matches if file_id in files]
+    
+    next_cursor = None
+    if has_more:
+        file_id, rank, _ = matches[-1]
+        next_cursor = encode_cursor({'q': match_query, 'floor': floor, 'rank': rank, 'id': file_id})
+    
+    return jsonify({
+        'files': results,
+        'next_cursor': next_cursor,
         'message': 'success'
     }), 200
 
+@client_bp.route('/files/<int:file_id>/members', methods=['GET'])
+@role_required('client')
+def list_package_members(file_id):
+    """Client user list the members (parts) of a stored package, from its persisted member index"""
+    file = UploadedFile.query.get(file_id)
+    if not file or not blob_store.file_exists(file.file_path):
+        return jsonify({'message': 'File not found'}), 404
+    
+    try:
+        ensure_member_index(file, blob_store)
+    except MemberError as e:
+        return jsonify({'message': f'Not a readable package: {e}'}), 422
+    
+    members = PackageMember.query.filter_by(file_id=file_id).order_by(PackageMember.name).all()
+    return jsonify({
+        'file_id': file_id,
+        'members': [member.to_dict() for member in members],
+        'message': 'success'
+    }), 200
+
+@client_bp.route('/files/<int:file_id>/members/<path:name>', methods=['GET'])
+@role_required('client')
+def get_package_member(file_id, name):
+    """Client user stream one member of a stored package: one indexed lookup and one seek into the file"""
+    file = UploadedFile.query.get(file_id)
+    if not file or not blob_store.file_exists(file.file_path):
+        return jsonify({'message': 'File not found'}), 404
+    
+    try:
+        ensure_member_index(file, blob_store)
+    except MemberError as e:
+        return jsonify({'message': f'Not a readable package: {e}'}), 422
+    
+    member = PackageMember.query.filter_by(file_id=file_id, name=name).first()
+    if not member:
+        return jsonify({'message': 'Member not found'}), 404
+    if member.compress_type not in SUPPORTED_COMPRESSION:
+        return jsonify({'message': 'Member compression method is not supported'}), 415
+    
+    reader = MemberReader(blob_store.open_file(file.file_path, file.encrypted), member, current_app.config['UPLOAD_STREAM_BUFFER'])
+    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    response = Response(
+        wrap_file(request.environ, reader, current_app.config['UPLOAD_STREAM_BUFFER']),
+        mimetype=mimetype,
+        direct_passthrough=True
+    )
+    # Only images are shown inline; the sandbox CSP keeps other parts (XML, SVG, HTML) from running script
+    disposition = 'inline' if mimetype.startswith('image/') and mimetype != 'image/svg+xml' else 'attachment'
+    response.headers.set('Content-Disposition', disposition, filename=os.path.basename(name))
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['Content-Security-Policy'] = 'sandbox'
+    response.content_length = member.file_size
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config['MEMBER_CACHE_MAX_AGE']
+    response.set_etag(f'{file.blob_digest or file.id}-{member.crc:08x}')
+    # Range requests are only honoured for stored (uncompressed) members, which the reader can seek in
+    return response.make_conditional(request.environ, accept_ranges=reader.seekable(), complete_length=member.file_size)
+
+@client_bp.route('/files/<int:file_id>/preview', methods=['GET'])
+@role_required('client')
+def get_file_preview(file_id):
+    """Client user thumbnail of a file: its embedded thumbnail or a placeholder, built once and cached"""
+    file = UploadedFile.query.get(file_id)
+    if not file:
+        return jsonify({'message': 'File not found'}), 404
+    
+    try:
+        key, mimetype, generate = preview_source(file, blob_store, current_app.config)
+        # A revalidation with the current ETag is answered without touching the cache
+        data = b'' if key in request.if_none_match else preview_cache.get_or_create(key, generate)
+    except Exception as e:
+        return jsonify({'message': f'Preview failed: {str(e)}'}), 500
+    
+    response = Response(data, mimetype=mimetype)
+    response.set_etag(key)
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config['PREVIEW_CACHE_MAX_AGE']
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['Content-Security-Policy'] = 'sandbox'
+    return response.make_conditional(request)
+
+FILE_SORT_COLUMNS = {
+    'uploaded_at': UploadedFile.uploaded_at,
+    'original_filename': UploadedFile.original_filename,
+    'file_size': UploadedFile.file_size
+}
+
+# min_<name> / max_<name> filters of list_files (inclusive)
+FILE_COUNT_FILTERS = {
+    'pages': UploadedFile.page_count,
+    'slides': UploadedFile.slide_count,
+    'sheets': UploadedFile.sheet_count
+}
+
+def _parse_datetime_arg(name):
+    """Parse an optional ISO 8601 query argument into a naive UTC datetime"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
 @client_bp.route('/download-file/<int:assignment_id>', methods=['GET'])
-@jwt_required()
+@role_required('client')
 def get_download_link(assignment_id):
     """Generate secure download link for client"""
     user_id = int(get_jwt_identity())
-    user = User.query.get(user_id)
-    
-    if not user or user.user_type != 'client':
-        return jsonify({'message': 'Unauthorized'}), 403
     
     # Check if file exists
     file = UploadedFile.query.get(assignment_id)
     if not file:
         return jsonify({'message': 'File not found'}), 404
     
-    # Generate encrypted download token
-    download_token = token_service.generate_download_token(assignment_id, user_id)
-    
-    # Store token in database
-    db_token = DownloadToken(
-        token=download_token,
-        file_id=assignment_id,
-        user_id=user_id,
-        expires_at=datetime.utcnow() + timedelta(hours=24)
-    )
-    
-    db.session.add(db_token)
-    db.session.commit()
+    if current_app.config['DOWNLOAD_TOKEN_FORMAT'] == 'compact':
+        # Signed, self-contained token: issuing a link needs no database write
+        download_token = token_service.generate_compact_token(assignment_id, user_id)
+    else:
+        # Generate encrypted download token
+        download_token = token_service.generate_download_token(assignment_id, user_id)
+        
+        # Store token in database
+        db_token = DownloadToken(
+            token=download_token,
+            file_id=assignment_id,
+            user_id=user_id,
+            expires_at=datetime.utcnow() + timedelta(hours=24)
+        )
+        
+        db.session.add(db_token)
+        db.session.commit()
     
     download_url = f"{request.host_url}download-file/{download_token}"
     
@@ -240,6 +827,46 @@ def get_download_link(assignment_id):
         'message': 'success'
     }), 200
 
+@client_bp.route('/download-zip', methods=['POST'])
+@role_required('client')
+def download_zip():
+    """Stream several files as one ZIP archive, built while it is sent"""
+    data = request.get_json()
+    file_ids = data.get('file_ids') if data else None
+    
+    if not isinstance(file_ids, list) or not file_ids or not all(isinstance(i, int) for i in file_ids):
+        return jsonify({'message': 'file_ids must be a non-empty list of file ids'}), 400
+    
+    file_ids = list(dict.fromkeys(file_ids))
+    if len(file_ids) > current_app.config['BULK_DOWNLOAD_MAX_FILES']:
+        return jsonify({'message': f"At most {current_app.config['BULK_DOWNLOAD_MAX_FILES']} files can be downloaded at once"}), 400
+    
+    files = {f.id: f for f in UploadedFile.query.filter(UploadedFile.id.in_(file_ids)).all()}
+    missing = [i for i in file_ids if i not in files or not blob_store.file_exists(files[i].file_path)]
+    if missing:
+        return jsonify({'message': 'File not found', 'missing_file_ids': missing}), 404
+    
+    # Resolve everything up front so the generator never touches the database
+    entries = []
+    used_names = set()
+    for file_id in file_ids:
+        file = files[file_id]
+        arcname = file.original_filename
+        if arcname in used_names:
+            stem, ext = os.path.splitext(arcname)
+            arcname = f"{stem} ({file.id}){ext}"
+        used_names.add(arcname)
+        entries.append((arcname, file.file_path, file.file_size, file.uploaded_at.timetuple()[:6]))
+    encrypted = {file.file_path: file.encrypted for file in files.values()}
+    
+    response = Response(
+        iter_zip_stream(entries, current_app.config['UPLOAD_STREAM_BUFFER'],
+                        open_file=lambda path: blob_store.open_file(path, encrypted[path])),
+        mimetype='application/zip'
+    )
+    response.headers['Content-Disposition'] = 'attachment; filename="files.zip"'
+    return response
+
 @client_bp.route('/download-file/<token>', methods=['GET'])
 def download_file(token):
     """Download file using encrypted token"""
@@ -249,49 +876,148 @@ def download_file(token):
     if not token_data:
         return jsonify({'message': 'Invalid or expired token'}), 401
     
-    # Check if token exists in database and is not used
-    db_token = DownloadToken.query.filter_by(token=token, is_used=False).first()
+    # A used token may only resume (Range) or revalidate (If-None-Match) the same
+    # download, which needs the file's digest and size before it is redeemed
+    allow_resume = False
+    if 'Range' in request.headers or 'If-None-Match' in request.headers:
+        target = db.session.execute(
+            select(UploadedFile.blob_digest, UploadedFile.file_size).where(UploadedFile.id == token_data['file_id'])
+        ).first()
+        allow_resume = target is not None and _is_resume_request(target.blob_digest, target.file_size)
     
-    if not db_token:
-        return jsonify({'message': 'Token not found or already used'}), 401
+    if token_data['format'] == 'compact':
+        # Stateless token: one-time use is enforced by the in-process replay filter
+        if not replay_filter.redeem(
+            token_data['token_id'],
+            token_data['expires_timestamp'],
+            allow_resume=allow_resume,
+            resume_window=current_app.config['DOWNLOAD_RESUME_WINDOW']
+        ):
+            return jsonify({'message': 'Token not found or already used'}), 401
+        file = UploadedFile.query.get(token_data['file_id'])
+    else:
+        # Redeem the token in a single conditional UPDATE
+        file = DownloadToken.redeem(
+            token,
+            token_data['file_id'],
+            token_data['user_id'],
+            allow_resume=allow_resume,
+            resume_window=current_app.config['DOWNLOAD_RESUME_WINDOW']
+        )
     
-    # Verify token matches the requesting conditions
-    if (db_token.file_id != token_data['file_id'] or 
-        db_token.user_id != token_data['user_id']):
-        return jsonify({'message': 'Token validation failed'}), 401
+    if not file:
+        return jsonify({'message': 'Token not found or already used'}), 401
     
-    # Get the file
-    file = UploadedFile.query.get(token_data['file_id'])
+    if _is_revalidation(file.blob_digest):
+        # Answered here rather than by the serve mode, so a proxy never sends the body
+        response = Response(status=304)
+        response.set_etag(file.blob_digest)
+        return response
     
-    if not file or not os.path.exists(file.file_path):
+    if not blob_store.file_exists(file.file_path):
         return jsonify({'message': 'File not found'}), 404
     
-    # Mark token as used
-    db_token.is_used = True
-    db.session.commit()
-    
     try:
-        return send_file(
-            file.file_path,
-            as_attachment=True,
-            download_name=file.original_filename,
-            mimetype='application/octet-stream'
-        )
+        return _serve_file(file)
     except Exception as e:
         return jsonify({'message': f'Download failed: {str(e)}'}), 500
 
-def send_verification_email(email, verification_token):
-    """Send verification email to user"""
-    from models import mail
+def _serve_file(file):
+    """Send a stored file, or hand the transfer to the front proxy in x-accel-redirect/x-sendfile mode"""
+    serve_mode = current_app.config['DOWNLOAD_SERVE_MODE']
+    local_path = blob_store.local_path(file.file_path, file.encrypted)
+    
+    # Small popular files are served from memory (only content-addressed files, whose bytes never change)
+    if hot_file_cache is not None and file.blob_digest and (serve_mode == 'direct' or local_path is None):
+        data = hot_file_cache.get_or_load(file.blob_digest, file.file_size, lambda: _read_file(file))
+        if data is not None:
+            return _send_cached_file(file, data)
+    
+    if local_path is None:
+        return _stream_file(file)
+    
+    if serve_mode in ('x-accel-redirect', 'x-sendfile'):
+        response = Response(status=200, mimetype='application/octet-stream')
+        response.headers['Content-Disposition'] = f'attachment; filename="{file.original_filename}"'
+        if file.blob_digest:
+            response.headers['ETag'] = f'"{file.blob_digest}"'
+        
+        if serve_mode == 'x-accel-redirect':
+            relative_path = os.path.relpath(local_path, current_app.config['UPLOAD_FOLDER'])
+            prefix = current_app.config['X_ACCEL_REDIRECT_PREFIX'].rstrip('/')
+            response.headers['X-Accel-Redirect'] = f"{prefix}/{relative_path.replace(os.sep, '/')}"
+        else:
+            response.headers['X-Sendfile'] = os.path.abspath(local_path)
+        return response
     
-    msg = Message(
-        'Verify Your Email - File Sharing System',
-        recipients=[email]
+    # Werkzeug answers Range/If-Range with 206 and If-None-Match with 304
+    # when the response is conditional; the content digest is a strong ETag
+    # (files stored before deduplication get an mtime/size ETag and cannot resume)
+    return send_file(
+        local_path,
+        as_attachment=True,
+        download_name=file.original_filename,
+        mimetype='application/octet-stream',
+        conditional=True,
+        etag=file.blob_digest or True
     )
+
+def _stream_file(file):
+    """Stream a remote or encrypted file; Range requests only read (and decrypt) the parts they cover"""
+    response = Response(
+        wrap_file(request.environ, blob_store.open_file(file.file_path, file.encrypted), current_app.config['UPLOAD_STREAM_BUFFER']),
+        mimetype='application/octet-stream',
+        direct_passthrough=True
+    )
+    response.headers.set('Content-Disposition', 'attachment', filename=file.original_filename)
+    response.content_length = file.file_size
+    response.cache_control.no_cache = True
+    if file.blob_digest:
+        response.set_etag(file.blob_digest)
+    return response.make_conditional(request.environ, accept_ranges=True, complete_length=file.file_size)
+
+def _read_file(file):
+    with blob_store.open_file(file.file_path, file.encrypted) as f:
+        return f.read()
+
+def _send_cached_file(file, data):
+    """Send file bytes held in memory, with the same headers and Range/ETag handling as _stream_file"""
+    response = Response(data, mimetype='application/octet-stream')
+    response.headers.set('Content-Disposition', 'attachment', filename=file.original_filename)
+    response.cache_control.no_cache = True
+    response.set_etag(file.blob_digest)
+    return response.make_conditional(request.environ, accept_ranges=True, complete_length=len(data))
+
+def _is_resume_request(digest, file_size):
+    """True for requests that resume or revalidate a download rather than start a new one.
+    
+    Only content-addressed files qualify, since their ETag is the digest rather
+    than one derived from the file's mtime and size. The request must either
+    name that ETag in If-None-Match (answered with 304 and no body) or ask only
+    for ranges that skip the start of the file; anything else would let a used
+    token fetch the whole file again.
+    """
+    if not digest:
+        return False
+    if _is_revalidation(digest):
+        return True
+    ranges = request.range
+    if ranges is None or ranges.units != 'bytes':
+        return False
+    # Suffix ranges ("bytes=-500") are stored with a negative start
+    return all(start > 0 if start >= 0 else -start < file_size for start, _ in ranges.ranges)
+
+def _is_revalidation(digest):
+    """True for a conditional GET naming the file's current ETag"""
+    etags = request.if_none_match
+    return bool(digest) and not etags.star_tag and etags.contains(digest)
+
+def send_verification_email(email, verification_token):
+    """Queue the verification email for a user in the outbox"""
     # this may be wrong 
     verification_url = f"{verification_token}"
     
-    msg.body = f"""
+    body = f"""
     Welcome to our File Sharing System!
     
     Please click the following link to verify your email address:
@@ -302,7 +1028,7 @@ def send_verification_email(email, verification_token):
     If you did not create an account, please ignore this email.
     """
     
-    msg.html = f"""
+    html = f"""
     <h2>Welcome to our File Sharing System!</h2>
     
     <p>Please click the button below to verify your email address:</p>
@@ -319,4 +1045,4 @@ def send_verification_email(email, verification_token):
     <p>If you did not create an account, please ignore this email.</p>
     """
     
-    mail.send(msg)
+    enqueue_email('Verify Your Email - File Sharing System', [email], body=body, html=html)
@@ -0,0 +1,110 @@
+"""
+Full-text search over file names and document contents (SQLite FTS5)
+
+file_search holds one row per uploaded file, keyed by its id (the rowid),
+with the file name, the document title and author, and the document text.
+Rows are written and removed together with their UploadedFile (mapper
+events, so in the same transaction); the text is added by the index_content
+processing stage once the file has been stored. Results are ranked with
+BM25 (name matches weigh most) and paginated with a keyset cursor on
+(rank, id), so a page costs the same whatever its depth.
+
+Ranking has to score every match, so a word found in most documents would
+make a query as slow as the index is large. Only the newest max_candidates
+matches are ranked: the id of the oldest of them (the floor) is found by
+walking the match list in id order, which reads no positions and is cheap,
+and FTS5 then restricts the ranked query to ids at or above it. The floor
+travels in the cursor, so later pages rank the same candidates.
+"""
+
+from models import db, UploadedFile
+from sqlalchemy import event, text
+import re
+
+# bm25() weights of the file_search columns, in order
+RANKING = 'bm25(10.0, 5.0, 2.0, 1.0)'
+SNIPPET_TOKENS = 12
+
+def create_search_index(connection):
+    """Create the FTS5 table and index the names and properties of existing files (SQLite only)"""
+    if connection.dialect.name != 'sqlite':
+        return
+    connection.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS file_search USING fts5("
+        "original_filename, title, author, content, "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"  # prefix indexes for term* queries
+    ))
+    connection.execute(text(
+        'INSERT INTO file_search (rowid, original_filename, title, author) '
+        'SELECT id, original_filename, title, author FROM uploaded_files '
+        'WHERE id NOT IN (SELECT rowid FROM file_search)'
+    ))
+
+def available():
+    return db.engine.dialect.name == 'sqlite'
+
+@event.listens_for(UploadedFile, 'after_insert')
+def _index_new_file(mapper, connection, file):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('INSERT INTO file_search (rowid, original_filename, title, author) '
+                                'VALUES (:id, :name, :title, :author)'),
+                           {'id': file.id, 'name': file.original_filename, 'title': file.title, 'author': file.author})
+
+@event.listens_for(UploadedFile, 'after_delete')
+def _unindex_deleted_file(mapper, connection, file):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('DELETE FROM file_search WHERE rowid = :id'), {'id': file.id})
+
+def index_file(file, content):
+    """Replace a file's search row with its current name and properties and the given document text"""
+    params = {'id': file.id, 'name': file.original_filename, 'title': file.title,
+              'author': file.author, 'content': content}
+    db.session.execute(text('DELETE FROM file_search WHERE rowid = :id'), params)
+    db.session.execute(text('INSERT INTO file_search (rowid, original_filename, title, author, content) '
+                            'VALUES (:id, :name, :title, :author, :content)'), params)
+
+def collect_text(pieces, max_chars):
+    """Join streamed text pieces, stopping (and so stopping the reading) after ``max_chars`` characters"""
+    collected = []
+    total = 0
+    for piece in pieces:
+        collected.append(piece[:max_chars - total])
+        total += len(collected[-1])
+        if total >= max_chars:
+            break
+    return ''.join(collected)
+
+def build_match_query(query: str) -> str:
+    """Turn user input into an FTS5 query: every word must match; a trailing * makes it a prefix.
+    
+    Words are quoted, so FTS5 operators and punctuation in the input cannot cause syntax errors.
+    Returns '' if the input has no words.
+    """
+    terms = re.findall(r'\w+\*?', query)
+    return ' '.join(f'"{term.rstrip("*")}"' + ('*' if term.endswith('*') else '') for term in terms)
+
+# Id of the max_candidates-th newest match (:offset = max_candidates - 1)
+FLOOR_SQL = 'SELECT rowid FROM file_search WHERE file_search MATCH :query ORDER BY rowid DESC LIMIT 1 OFFSET :offset'
+
+def search_sql(keyset: bool) -> str:
+    """The ranked search statement (named parameters :query, :floor, :limit and, with ``keyset``, :rank and :id)"""
+    sql = (f"SELECT rowid, rank, snippet(file_search, -1, '[', ']', '...', {SNIPPET_TOKENS}) "
+           f"FROM file_search WHERE file_search MATCH :query AND rank MATCH '{RANKING}' AND rowid >= :floor")
+    if keyset:
+        sql += ' AND (rank > :rank OR (rank = :rank AND rowid > :id))'
+    return sql + ' ORDER BY rank, rowid LIMIT :limit'
+
+def candidate_floor(match_query, max_candidates):
+    """Lowest file id among the newest ``max_candidates`` matches (0 when there are fewer)"""
+    row = db.session.execute(text(FLOOR_SQL), {'query': match_query, 'offset': max_candidates - 1}).first()
+    return row[0] if row else 0
+
+def search(match_query, limit, floor, after=None):
+    """Return up to ``limit`` ``(file_id, rank, snippet)`` rows, best first.
+    
+    Only ids from ``floor`` are ranked; ``after`` is the ``(rank, id)`` keyset position of the previous page.
+    """
+    params = {'query': match_query, 'floor': floor, 'limit': limit}
+    if after is not None:
+        params['rank'], params['id'] = after
+    return db.session.execute(text(search_sql(after is not None)), params).all()
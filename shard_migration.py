@@ -0,0 +1,155 @@
+"""
+Online migration of stored files into the sharded directory layout
+
+Moves blobs to ``BLOB_FOLDER/ab/cd/<digest>`` (STORAGE_SHARD_DEPTH levels)
+and files stored before deduplication to ``UPLOAD_FOLDER/ab/cd/<name>``,
+updating UploadedFile.file_path in small batches while the app keeps
+serving. Each file is first hard-linked (or copied) to its new path and the
+rows are committed; the old path is removed only after a grace period, so a
+download that read the old row just before the commit (and opens the file
+later, or hands the path to the web server with X-Accel-Redirect) still
+finds it. Old paths left behind by an interrupted run are reported by the
+upload reconciler as orphans. The migration is idempotent: run it again
+after an interruption or after changing STORAGE_SHARD_DEPTH.
+
+Usage: python shard_migration.py [--batch-size N] [--pause SECONDS] [--grace SECONDS]
+"""
+
+from models import db, Blob, UploadedFile
+from storage import shard_path
+from sqlalchemy import select, update
+import collections
+import hashlib
+import os
+import shutil
+import time
+
+def _place(source, target):
+    """Make ``target`` a second name for ``source`` without removing it"""
+    if os.path.exists(target):
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        # Different filesystem (or no hard link support): copy, then publish atomically
+        tmp_target = f'{target}.migrating'
+        shutil.copy2(source, tmp_target)
+        os.replace(tmp_target, target)
+
+def _remove_old(pending, paths=(), keep=(), grace=0, wait=False):
+    """Queue old paths for removal after ``grace`` seconds and remove those that are due.
+    
+    With ``wait`` the remaining paths are removed once their grace period is over.
+    """
+    if paths:
+        pending.append((time.monotonic() + grace, set(paths) - set(keep)))
+    while pending:
+        due, old_paths = pending[0]
+        delay = due - time.monotonic()
+        if delay > 0:
+            if not wait:
+                return
+            time.sleep(delay)
+        pending.popleft()
+        for path in old_paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def legacy_path_for(config, stored_filename):
+    """Sharded path of a file stored before deduplication (random names are hashed for the prefix)"""
+    key = hashlib.sha256(stored_filename.encode()).hexdigest()
+    return shard_path(config['UPLOAD_FOLDER'], stored_filename, config['STORAGE_SHARD_DEPTH'], key=key)
+
+def migrate_blobs(config, batch_size=500, pause=0.05, grace=60):
+    """Move blobs to their sharded path; returns the number of rows updated"""
+    depth = config['STORAGE_SHARD_DEPTH']
+    updated, last_digest = 0, ''
+    pending = collections.deque()
+    while True:
+        digests = db.session.scalars(
+            select(Blob.digest).where(Blob.digest > last_digest).order_by(Blob.digest).limit(batch_size)
+        ).all()
+        if not digests:
+            _remove_old(pending, wait=True)
+            return updated
+        last_digest = digests[-1]
+        
+        rows = db.session.execute(
+            select(UploadedFile.id, UploadedFile.blob_digest, UploadedFile.file_path)
+            .where(UploadedFile.blob_digest.in_(digests))
+        ).all()
+        old_paths, new_paths = set(), set()
+        for digest in digests:
+            target = shard_path(config['BLOB_FOLDER'], digest, depth)
+            sources = [row.file_path for row in rows if row.blob_digest == digest and row.file_path != target]
+            sources.append(os.path.join(config['BLOB_FOLDER'], digest))  # original flat layout
+            source = next((path for path in sources if path != target and os.path.exists(path)), None)
+            if source is None:
+                continue
+            _place(source, target)
+            new_paths.add(target)
+            old_paths.update(path for path in sources if path != target)
+            result = db.session.execute(
+                update(UploadedFile)
+                .where(UploadedFile.blob_digest == digest, UploadedFile.file_path != target)
+                .values(file_path=target)
+                .execution_options(synchronize_session=False)
+            )
+            updated += result.rowcount
+        db.session.commit()
+        _remove_old(pending, old_paths, new_paths, grace)
+        time.sleep(pause)
+
+def migrate_legacy_files(config, batch_size=500, pause=0.05, grace=60):
+    """Move files stored before deduplication to their sharded path; returns the number of rows updated"""
+    updated, last_id = 0, 0
+    pending = collections.deque()
+    while True:
+        files = db.session.execute(
+            select(UploadedFile.id, UploadedFile.stored_filename, UploadedFile.file_path)
+            .where(UploadedFile.blob_digest.is_(None), UploadedFile.id > last_id)
+            .order_by(UploadedFile.id)
+            .limit(batch_size)
+        ).all()
+        if not files:
+            _remove_old(pending, wait=True)
+            return updated
+        last_id = files[-1].id
+        
+        old_paths, new_paths = set(), set()
+        for file in files:
+            target = legacy_path_for(config, file.stored_filename)
+            if file.file_path == target or not os.path.exists(file.file_path):
+                continue
+            _place(file.file_path, target)
+            new_paths.add(target)
+            old_paths.add(file.file_path)
+            db.session.execute(
+                update(UploadedFile).where(UploadedFile.id == file.id).values(file_path=target)
+                .execution_options(synchronize_session=False)
+            )
+            updated += 1
+        db.session.commit()
+        _remove_old(pending, old_paths, new_paths, grace)
+        time.sleep(pause)
+
+if __name__ == '__main__':
+    import argparse
+    from app import create_app
+    
+    parser = argparse.ArgumentParser(description='Move stored files into the sharded directory layout')
+    parser.add_argument('--batch-size', type=int, default=500, help='rows updated per transaction')
+    parser.add_argument('--pause', type=float, default=0.05, help='seconds to sleep between batches')
+    parser.add_argument('--grace', type=float, default=60,
+                        help='seconds to keep an old path after its rows moved, for downloads already in flight')
+    args = parser.parse_args()
+    
+    app = create_app()
+    with app.app_context():
+        blobs = migrate_blobs(app.config, args.batch_size, args.pause, args.grace)
+        legacy = migrate_legacy_files(app.config, args.batch_size, args.pause, args.grace)
+    print(f"Moved {blobs} deduplicated and {legacy} legacy file rows "
+          f"(shard depth {app.config['STORAGE_SHARD_DEPTH']})")
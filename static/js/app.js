@@ -434,7 +434,7 @@ function resetUploadForm() {
 // File Loading Functions
 async function loadOpsFiles() {
     try {
-        const response = await fetch(`${API_BASE_URL}/client/files`, {
+        const response = await fetch(`${API_BASE_URL}/client/files?limit=5`, {
             headers: {
                 'Authorization': `Bearer ${authToken}`,
             },
@@ -450,11 +450,45 @@ async function loadOpsFiles() {
     }
 }
 
+// The listing is keyset-paginated: the first page is shown at once and the next
+// one is fetched with next_cursor when "Load more" is clicked or scrolled into view
+let clientFilesCursor = null;
+let clientFilesLoading = false;
+let clientFilesGeneration = 0;
+
+const clientFilesObserver = 'IntersectionObserver' in window ? new IntersectionObserver(entries => {
+    if (entries.some(entry => entry.isIntersecting)) {
+        loadMoreClientFiles();
+    }
+}, { rootMargin: '400px' }) : null;
+
 async function loadClientFiles() {
+    clientFilesGeneration++;
+    clientFilesCursor = null;
+    clientFilesLoading = false;
     showLoading(true);
     
     try {
-        const response = await fetch(`${API_BASE_URL}/client/files`, {
+        await fetchClientFilesPage(false);
+    } finally {
+        showLoading(false);
+    }
+}
+
+async function loadMoreClientFiles() {
+    if (clientFilesCursor && !clientFilesLoading) {
+        await fetchClientFilesPage(true);
+    }
+}
+
+async function fetchClientFilesPage(append) {
+    const generation = clientFilesGeneration;
+    clientFilesLoading = true;
+    updateLoadMoreButton();
+    
+    try {
+        const query = append ? `?cursor=${encodeURIComponent(clientFilesCursor)}` : '';
+        const response = await fetch(`${API_BASE_URL}/client/files${query}`, {
             headers: {
                 'Authorization': `Bearer ${authToken}`,
             },
@@ -462,16 +496,38 @@ async function loadClientFiles() {
         
         const data = await response.json();
         
-        if (response.ok) {
-            displayClientFiles(data.files);
-        } else {
+        if (generation !== clientFilesGeneration) {
+            return; // a refresh started while this page was loading
+        }
+        
+        if (!response.ok) {
             showToast(data.message, 'error');
+            return;
         }
+        
+        clientFilesCursor = data.next_cursor;
+        displayClientFiles(data.files, append);
     } catch (error) {
         showToast('Failed to load files', 'error');
         console.error('Error loading client files:', error);
     } finally {
-        showLoading(false);
+        if (generation === clientFilesGeneration) {
+            clientFilesLoading = false;
+            updateLoadMoreButton();
+        }
+    }
+}
+
+function updateLoadMoreButton() {
+    const button = document.getElementById('clientFilesMore');
+    button.hidden = !clientFilesCursor;
+    button.disabled = clientFilesLoading;
+    
+    if (clientFilesObserver) {
+        clientFilesObserver.disconnect();
+        if (clientFilesCursor && !clientFilesLoading) {
+            clientFilesObserver.observe(button);
+        }
     }
 }
 
@@ -496,17 +552,18 @@ function displayOpsFiles(files) {
     `).join('');
 }
 
-function displayClientFiles(files) {
+function displayClientFiles(files, append = false) {
     const container = document.getElementById('clientFilesList');
     
-    if (files.length === 0) {
+    if (!append && files.length === 0) {
         container.innerHTML = '<div class="file-item"><p>No files available for download.</p></div>';
         return;
     }
     
-    container.innerHTML = files.map(file => `
+    const html = files.map(file => `
         <div class="file-item">
             <div class="file-info">
+                <img class="file-thumbnail" data-file-id="${file.id}" alt="" hidden>
                 <i class="fas ${getFileIcon(file.file_type)} file-icon"></i>
                 <div class="file-details">
                     <h4>${file.original_filename}</h4>
@@ -522,6 +579,56 @@ function displayClientFiles(files) {
             </div>
         </div>
     `).join('');
+    
+    if (append) {
+        container.insertAdjacentHTML('beforeend', html);
+    } else {
+        container.innerHTML = html;
+    }
+    
+    loadThumbnails(container);
+}
+
+// Thumbnails are fetched (with the JWT) as they scroll into view; the browser
+// cache and the ETag keep repeat visits from downloading them again
+const thumbnailObserver = 'IntersectionObserver' in window ? new IntersectionObserver(entries => {
+    entries.filter(entry => entry.isIntersecting).forEach(entry => {
+        thumbnailObserver.unobserve(entry.target);
+        loadThumbnail(entry.target);
+    });
+}, { rootMargin: '200px' }) : null;
+
+function loadThumbnails(container) {
+    // Only images added since the last call; appended pages keep the earlier ones
+    container.querySelectorAll('img.file-thumbnail:not([data-queued])').forEach(img => {
+        img.dataset.queued = 'true';
+        if (thumbnailObserver) {
+            thumbnailObserver.observe(img);
+        } else {
+            loadThumbnail(img);
+        }
+    });
+}
+
+async function loadThumbnail(img) {
+    try {
+        const response = await fetch(`${API_BASE_URL}/client/files/${img.dataset.fileId}/preview`, {
+            headers: {
+                'Authorization': `Bearer ${authToken}`,
+            },
+        });
+        
+        if (!response.ok) {
+            return; // keep the file type icon
+        }
+        
+        img.onload = () => URL.revokeObjectURL(img.src);
+        img.src = URL.createObjectURL(await response.blob());
+        img.hidden = false;
+        img.nextElementSibling.style.display = 'none';
+    } catch (error) {
+        console.error('Error loading thumbnail:', error);
+    }
 }
 
 async function generateDownloadLink(fileId) {
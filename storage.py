@@ -0,0 +1,403 @@
+from file_encryption import FileCipher
+import hashlib
+import io
+import os
+import tempfile
+import uuid
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # only needed for STORAGE_BACKEND=s3
+    boto3 = None
+
+def shard_path(root: str, name: str, depth: int, key: str = None) -> str:
+    """Place ``name`` under ``depth`` levels of two-character subdirectories taken from ``key``.
+    
+    ``key`` must be a hex hash (it defaults to ``name``, which suits digests); with two hex
+    characters per level each directory fans out to at most 256 entries.
+    """
+    key = key or name
+    return os.path.join(root, *(key[level * 2:level * 2 + 2] for level in range(depth)), name)
+
+class LocalBackend:
+    """Storage backend keeping objects as files under a local directory.
+    
+    Objects are addressed by a locator stored in ``UploadedFile.file_path``; for
+    this backend the locator is simply the file's path.
+    """
+    
+    def __init__(self, root: str):
+        self.root = root
+        self.tmp_dir = os.path.join(root, '.tmp')
+    
+    def locator(self, key: str) -> str:
+        """Return the locator of the object stored under ``key`` (a '/'-separated relative name)"""
+        return os.path.join(self.root, *key.split('/'))
+    
+    def owns(self, locator: str) -> bool:
+        return '://' not in locator
+    
+    def exists(self, locator: str) -> bool:
+        return os.path.exists(locator)
+    
+    def open(self, locator: str):
+        """Open an object for reading; the returned file is seekable"""
+        return open(locator, 'rb')
+    
+    def local_path(self, locator: str) -> str:
+        """Path on this machine's filesystem, or None for remote objects"""
+        return locator
+    
+    def delete(self, locator: str):
+        try:
+            os.remove(locator)
+        except FileNotFoundError:
+            pass
+    
+    def start_upload(self):
+        """Begin writing an object whose key is only known once all of it has been written"""
+        return _LocalUpload(self)
+    
+    def put_file(self, path: str, key: str) -> str:
+        """Move a finished local file to ``key``; ``path`` is consumed either way"""
+        target = self.locator(key)
+        if os.path.exists(target):
+            os.remove(path)
+        else:
+            # Uploads are acknowledged once this returns, so the bytes must be on disk first
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+        return target
+
+class _LocalUpload:
+    def __init__(self, backend: LocalBackend):
+        self.backend = backend
+        os.makedirs(backend.tmp_dir, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=backend.tmp_dir, suffix='.blob')
+        self.file = os.fdopen(fd, 'wb')
+    
+    def write(self, chunk: bytes):
+        self.file.write(chunk)
+    
+    def commit(self, key: str) -> str:
+        self.file.close()
+        return self.backend.put_file(self.tmp_path, key)
+    
+    def abort(self):
+        self.file.close()
+        os.remove(self.tmp_path)
+
+class S3Backend:
+    """Storage backend for Amazon S3 and S3-compatible servers (MinIO, Ceph, moto).
+    
+    Streams are sent with multipart uploads of ``part_size`` bytes, so memory use
+    does not grow with the file, and reads use ranged GETs from the current offset.
+    Locators have the form ``s3://<bucket>/<prefix><key>``.
+    """
+    
+    def __init__(self, bucket: str, prefix: str = '', endpoint_url: str = None, region_name: str = None,
+                 access_key_id: str = None, secret_access_key: str = None,
+                 part_size: int = 8 * 1024 * 1024, client=None):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError('STORAGE_BACKEND=s3 requires boto3 (pip install boto3)')
+            client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region_name,
+                                  aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.part_size = max(part_size, 5 * 1024 * 1024)  # S3 minimum for every part but the last
+        self.transfer_config = TransferConfig(multipart_threshold=self.part_size, multipart_chunksize=self.part_size)
+    
+    def locator(self, key: str) -> str:
+        return f's3://{self.bucket}/{self.prefix}{key}'
+    
+    def owns(self, locator: str) -> bool:
+        return locator.startswith(f's3://{self.bucket}/')
+    
+    def _object_key(self, locator: str) -> str:
+        return locator[len(f's3://{self.bucket}/'):]
+    
+    def exists(self, locator: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(locator))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+    
+    def open(self, locator: str):
+        return _S3Reader(self.client, self.bucket, self._object_key(locator))
+    
+    def local_path(self, locator: str) -> str:
+        return None
+    
+    def delete(self, locator: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(locator))
+    
+    def start_upload(self):
+        return _S3Upload(self)
+    
+    def put_file(self, path: str, key: str) -> str:
+        locator = self.locator(key)
+        if not self.exists(locator):
+            self.client.upload_file(path, self.bucket, self._object_key(locator), Config=self.transfer_config)
+        os.remove(path)
+        return locator
+
+class _S3Upload:
+    """Multipart upload to a temporary key, published under the content's key on commit"""
+    
+    def __init__(self, backend: S3Backend):
+        self.backend = backend
+        self.tmp_key = f'{backend.prefix}.tmp/{uuid.uuid4().hex}'
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+    
+    def write(self, chunk: bytes):
+        self.buffer += chunk
+        while len(self.buffer) >= self.backend.part_size:
+            self._upload_part(bytes(self.buffer[:self.backend.part_size]))
+            del self.buffer[:self.backend.part_size]
+    
+    def _upload_part(self, data: bytes):
+        client, bucket = self.backend.client, self.backend.bucket
+        if self.upload_id is None:
+            self.upload_id = client.create_multipart_upload(Bucket=bucket, Key=self.tmp_key)['UploadId']
+        part_number = len(self.parts) + 1
+        response = client.upload_part(Bucket=bucket, Key=self.tmp_key, UploadId=self.upload_id,
+                                      PartNumber=part_number, Body=data)
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+    
+    def commit(self, key: str) -> str:
+        client, bucket = self.backend.client, self.backend.bucket
+        locator = self.backend.locator(key)
+        if self.upload_id is None:
+            # Smaller than one part: a single PUT straight to the final key, unless the
+            # content is already there (other rows share it and readers may be streaming it)
+            if not self.backend.exists(locator):
+                client.put_object(Bucket=bucket, Key=self.backend._object_key(locator), Body=bytes(self.buffer))
+            return locator
+        
+        if self.buffer:
+            self._upload_part(bytes(self.buffer))
+        client.complete_multipart_upload(Bucket=bucket, Key=self.tmp_key, UploadId=self.upload_id,
+                                         MultipartUpload={'Parts': self.parts})
+        if not self.backend.exists(locator):
+            client.copy({'Bucket': bucket, 'Key': self.tmp_key}, bucket, self.backend._object_key(locator),
+                        Config=self.backend.transfer_config)
+        client.delete_object(Bucket=bucket, Key=self.tmp_key)
+        return locator
+    
+    def abort(self):
+        if self.upload_id is not None:
+            self.backend.client.abort_multipart_upload(Bucket=self.backend.bucket, Key=self.tmp_key,
+                                                       UploadId=self.upload_id)
+
+class _S3Reader(io.RawIOBase):
+    """Seekable read-only view of an S3 object; each seek starts a new ranged GET"""
+    
+    def __init__(self, client, bucket: str, key: str):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.position = 0
+        self.body = None
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def tell(self):
+        return self.position
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.client.head_object(Bucket=self.bucket, Key=self.key)['ContentLength']
+        if offset != self.position:
+            self._close_body()
+            self.position = offset
+        return self.position
+    
+    def readinto(self, buffer):
+        if self.body is None:
+            request = {'Bucket': self.bucket, 'Key': self.key}
+            if self.position:
+                request['Range'] = f'bytes={self.position}-'
+            self.body = self.client.get_object(**request)['Body']
+        data = self.body.read(len(buffer))
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+    
+    def _close_body(self):
+        if self.body is not None:
+            self.body.close()
+            self.body = None
+    
+    def close(self):
+        self._close_body()
+        super().close()
+
+class BlobStore:
+    """Content-addressed file store: every distinct content is kept once, named by its SHA-256 digest"""
+    
+    def __init__(self, backend, buffer_size: int = 65536, shard_depth: int = 2, cipher=None, encrypt: bool = False):
+        self.backend = backend
+        self.buffer_size = buffer_size
+        self.shard_depth = shard_depth
+        # With a FileCipher, encrypted files are decrypted on read; new files are encrypted if ``encrypt``
+        self.cipher = cipher
+        self.encrypt = encrypt and cipher is not None
+        # Files stored before a switch to a remote backend stay readable from local paths
+        self.local = backend if isinstance(backend, LocalBackend) else LocalBackend('')
+    
+    def key_for(self, digest: str) -> str:
+        """Return the backend key of a blob (``ab/cd/abcd...``)"""
+        return '/'.join([digest[level * 2:level * 2 + 2] for level in range(self.shard_depth)] + [digest])
+    
+    def path_for(self, digest: str) -> str:
+        """Return the locator of the blob with the given digest, as stored in ``file_path``"""
+        return self.backend.locator(self.key_for(digest))
+    
+    def exists(self, digest: str) -> bool:
+        return self.backend.exists(self.path_for(digest))
+    
+    def store_stream(self, stream) -> tuple:
+        """Write a stream to the store, hashing it as it is written.
+        
+        Returns ``(digest, size, locator)``. If the content is already stored the
+        freshly written copy is discarded and the existing blob is reused as it
+        is, so content first stored before encryption was enabled stays plaintext
+        (``Blob.encrypted`` records which form it has).
+        """
+        upload = self.backend.start_upload()
+        encryptor = self.cipher.encryptor() if self.encrypt else None
+        sha256 = hashlib.sha256()
+        size = 0
+        try:
+            if encryptor:
+                upload.write(encryptor.header)
+            while True:
+                chunk = stream.read(self.buffer_size)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+                upload.write(encryptor.update(chunk) if encryptor else chunk)
+                size += len(chunk)
+            if encryptor:
+                upload.write(encryptor.finalize())
+        except Exception:
+            upload.abort()
+            raise
+        
+        # The digest (and so the ETag) is always that of the plaintext
+        digest = sha256.hexdigest()
+        return digest, size, upload.commit(self.key_for(digest))
+    
+    def store_file(self, path: str) -> tuple:
+        """Move an already written local file (e.g. a finished chunked upload) into the store.
+        
+        Returns ``(digest, size, locator)``; ``path`` is consumed either way.
+        """
+        if self.encrypt:
+            with open(path, 'rb') as f:
+                result = self.store_stream(f)
+            os.remove(path)
+            return result
+        digest, size = self.hash_file(path)
+        return digest, size, self.backend.put_file(path, self.key_for(digest))
+    
+    def hash_file(self, path: str) -> tuple:
+        """Return ``(digest, size)`` of a file, reading it with a bounded buffer"""
+        sha256 = hashlib.sha256()
+        size = 0
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(self.buffer_size)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+                size += len(chunk)
+        return sha256.hexdigest(), size
+    
+    def remove(self, digest: str):
+        """Delete a blob; callers must ensure it is no longer referenced"""
+        self.backend.delete(self.path_for(digest))
+    
+    def _backend_for(self, locator: str):
+        return self.backend if self.backend.owns(locator) else self.local
+    
+    def file_exists(self, locator: str) -> bool:
+        """True if the object behind a ``file_path`` locator exists"""
+        return bool(locator) and self._backend_for(locator).exists(locator)
+    
+    def open_file(self, locator: str, encrypted: bool = None):
+        """Open the object behind a ``file_path`` locator as a seekable binary file of its plaintext.
+        
+        ``encrypted`` is the file's recorded ``UploadedFile.encrypted``; only files
+        stored before it was recorded (None) have their header checked.
+        """
+        raw = self._backend_for(locator).open(locator)
+        if encrypted is False or (encrypted is None and not self.cipher):
+            return raw
+        if not self.cipher:
+            raw.close()
+            raise ValueError('Stored file is encrypted but no keyring was given')
+        return self.cipher.open(raw, probe=encrypted is None)
+    
+    def stored_encrypted(self, digest: str) -> bool:
+        """Whether a blob's stored content is encrypted, read from its header (None if it is gone).
+        
+        Used once, when a blob's row is created: the object may have been kept
+        from an earlier write (made with encryption on or off) rather than
+        written by the current upload. Without a keyring the form is unknown (None).
+        """
+        if not self.cipher or not self.exists(digest):
+            return None
+        with self.backend.open(self.path_for(digest)) as raw:
+            return self.cipher.is_encrypted(raw)
+    
+    def local_path(self, locator: str, encrypted: bool = None) -> str:
+        """Filesystem path of a ``file_path`` locator, or None when its bytes are remote or encrypted"""
+        path = self._backend_for(locator).local_path(locator)
+        if path and encrypted is None and self.cipher:
+            with open(path, 'rb') as raw:
+                encrypted = self.cipher.is_encrypted(raw)
+        return None if path and encrypted else path
+
+def create_blob_store(config, encryption_service=None) -> BlobStore:
+    """Build the BlobStore for the configured STORAGE_BACKEND ('local' or 's3').
+    
+    Stored files can only be decrypted when ``encryption_service`` (the application keyring) is given.
+    """
+    if config['STORAGE_BACKEND'] == 's3':
+        backend = S3Backend(
+            bucket=config['S3_BUCKET'],
+            prefix=config['S3_PREFIX'],
+            endpoint_url=config['S3_ENDPOINT_URL'],
+            region_name=config['S3_REGION'],
+            access_key_id=config['S3_ACCESS_KEY_ID'],
+            secret_access_key=config['S3_SECRET_ACCESS_KEY'],
+            part_size=config['S3_PART_SIZE']
+        )
+    else:
+        backend = LocalBackend(config['BLOB_FOLDER'])
+    cipher = None
+    if encryption_service is not None:
+        cipher = FileCipher.from_encryption_service(encryption_service, config['STORAGE_ENCRYPTION_SEGMENT_SIZE'])
+    return BlobStore(backend, config['UPLOAD_STREAM_BUFFER'], config['STORAGE_SHARD_DEPTH'],
+                     cipher=cipher, encrypt=config['STORAGE_ENCRYPTION'])
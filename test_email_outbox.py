@@ -0,0 +1,151 @@
+"""
+Tests for the email outbox sender against a fake SMTP server
+Checks that a refused recipient only fails its own message, that a dropped
+connection does not use up the attempts of messages that were never sent, and
+that a server that cannot be reached makes the whole batch back off
+"""
+
+import os
+import socketserver
+import sys
+import threading
+
+# A fake SMTP server: refuses some recipients with 550, drops the connection on others,
+# and hangs up before its greeting while UNREACHABLE is set
+REFUSED = {'nobody@example.com'}
+DISCONNECT = {'hangup@example.com'}
+DELIVERED = []
+UNREACHABLE = threading.Event()
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+    
+    def handle(self):
+        if UNREACHABLE.is_set():
+            return
+        self._reply('220 fake ESMTP')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'RCPT':
+                address = command.split(':', 1)[1].strip().strip('<>')
+                if address in DISCONNECT:
+                    return
+                if address in REFUSED:
+                    self._reply('550 No such user')
+                else:
+                    recipients.append(address)
+                    self._reply('250 OK')
+            elif verb == 'DATA':
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                DELIVERED.extend(recipients)
+                self._reply('250 OK')
+            elif verb in ('MAIL', 'RSET'):
+                recipients = []
+                self._reply('250 OK')
+            elif verb == 'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('250 OK')
+
+SMTP_SERVER = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _SMTPHandler)
+SMTP_SERVER.daemon_threads = True
+threading.Thread(target=SMTP_SERVER.serve_forever, daemon=True).start()
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from datetime import datetime
+from app import create_app
+from models import db, OutboxEmail
+from mailer import enqueue_email, send_outbox_batch
+from testing import isolated_config
+
+def _create_app():
+    """An app with its own database that sends through the fake server; batches are sent by the tests"""
+    return create_app(isolated_config(
+        'email-outbox-',
+        MAIL_SERVER='127.0.0.1',
+        MAIL_PORT=SMTP_SERVER.server_address[1],
+        MAIL_USE_TLS=False,
+        MAIL_USERNAME=None,  # no AUTH
+        MAIL_DEFAULT_SENDER='noreply@example.com',
+        PROCESSING_WORKERS=0,
+        MAINTENANCE_SCHEDULER=False
+    ))
+
+def _queue(app, recipients):
+    """Queue one message per recipient; returns their ids in order"""
+    with app.app_context():
+        emails = [enqueue_email(f'Message for {recipient}', [recipient], body='Hello') for recipient in recipients]
+        db.session.commit()
+        return [email.id for email in emails]
+
+def _states(app, ids):
+    with app.app_context():
+        return [(email.status, email.attempts) for email in (db.session.get(OutboxEmail, i) for i in ids)]
+
+def test_refused_recipient_fails_only_its_message():
+    """One refused recipient in a batch of four: the other three are sent"""
+    app = _create_app()
+    DELIVERED.clear()
+    ids = _queue(app, ['a@example.com', 'nobody@example.com', 'b@example.com', 'c@example.com'])
+    
+    with app.app_context():
+        assert send_outbox_batch(app) == 3
+    
+    assert DELIVERED == ['a@example.com', 'b@example.com', 'c@example.com']
+    assert _states(app, ids) == [('sent', 0), ('pending', 1), ('sent', 0), ('sent', 0)]
+
+def test_dropped_connection_releases_untried_messages():
+    """A lost connection fails the message in flight; the untried rest keep their attempts and go out next"""
+    app = _create_app()
+    DELIVERED.clear()
+    ids = _queue(app, ['a@example.com', 'hangup@example.com', 'b@example.com', 'c@example.com'])
+    
+    with app.app_context():
+        assert send_outbox_batch(app) == 1
+    assert _states(app, ids) == [('sent', 0), ('pending', 1), ('pending', 0), ('pending', 0)]
+    
+    # The failed message backs off; the released ones are due again at once
+    with app.app_context():
+        assert send_outbox_batch(app) == 2
+    assert DELIVERED == ['a@example.com', 'b@example.com', 'c@example.com']
+    assert _states(app, ids) == [('sent', 0), ('pending', 1), ('sent', 0), ('sent', 0)]
+
+def test_unreachable_server_backs_off():
+    """When no connection can be made, every claimed message uses an attempt and fails after the last one"""
+    app = _create_app()
+    DELIVERED.clear()
+    ids = _queue(app, ['a@example.com', 'b@example.com'])
+    
+    UNREACHABLE.set()
+    try:
+        with app.app_context():
+            assert send_outbox_batch(app) == 0
+            assert all(db.session.get(OutboxEmail, i).next_attempt_at > datetime.utcnow() for i in ids)
+        assert _states(app, ids) == [('pending', 1), ('pending', 1)]
+        
+        # Once the backoff is over the batch is tried again, until the attempts run out
+        for attempt in range(2, app.config['MAIL_MAX_ATTEMPTS'] + 1):
+            with app.app_context():
+                OutboxEmail.query.update({'next_attempt_at': datetime.utcnow()})
+                db.session.commit()
+                assert send_outbox_batch(app) == 0
+        assert _states(app, ids) == [('failed', app.config['MAIL_MAX_ATTEMPTS'])] * 2
+    finally:
+        UNREACHABLE.clear()
+    assert DELIVERED == []
+
+if __name__ == '__main__':
+    test_refused_recipient_fails_only_its_message()
+    test_dropped_connection_releases_untried_messages()
+    test_unreachable_server_backs_off()
+    print("✅ Email outbox handled refused recipients and dropped connections")
@@ -0,0 +1,139 @@
+"""
+Tests for the segmented at-rest encryption format
+Checks that files round-trip through DecryptingReader, that truncated or reordered
+segments are rejected, that seeking reads the right bytes, that plaintext files are never
+mistaken for encrypted ones, and that uploads of the same content with
+encryption toggled stay readable
+"""
+
+import io
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app
+from testing import isolated_config
+from file_encryption import FileCipher, HEADER_SIZE, MAGIC, TAG_SIZE
+from storage import BlobStore, LocalBackend
+import routes
+
+# A throwaway database and upload folder shared by this module's tests only
+CONFIG = isolated_config('file-encryption-', ENCRYPTION_KEY='file-encryption-test-key')
+SEGMENT_SIZE = 64
+CIPHER = FileCipher({0: os.urandom(32)}, 0, SEGMENT_SIZE)
+
+def _encrypt(plaintext):
+    encryptor = CIPHER.encryptor()
+    return encryptor.header + encryptor.update(plaintext) + encryptor.finalize()
+
+def _open(stored):
+    return CIPHER.open(io.BytesIO(stored), probe=False)
+
+def _segments(stored):
+    """Split a stored file into its header and sealed segments"""
+    sealed = SEGMENT_SIZE + TAG_SIZE
+    body = stored[HEADER_SIZE:]
+    return stored[:HEADER_SIZE], [body[i:i + sealed] for i in range(0, len(body), sealed)]
+
+def test_round_trip():
+    """Files of every size relative to the segment size decrypt to their plaintext"""
+    for size in (0, 1, SEGMENT_SIZE - 1, SEGMENT_SIZE, SEGMENT_SIZE + 1, 3 * SEGMENT_SIZE, 3 * SEGMENT_SIZE + 5):
+        plaintext = os.urandom(size)
+        with _open(_encrypt(plaintext)) as reader:
+            assert reader.read() == plaintext, size
+            assert reader.seek(0, io.SEEK_END) == size
+
+def test_truncation_is_rejected():
+    """Dropping the final segment, or cutting one short, fails instead of returning a shorter file"""
+    stored = _encrypt(os.urandom(3 * SEGMENT_SIZE + 5))
+    header, segments = _segments(stored)
+    
+    for truncated in (header + b''.join(segments[:-1]), stored[:-7]):
+        with pytest.raises(ValueError):
+            _open(truncated).read()
+
+def test_reordered_segments_are_rejected():
+    """Swapping two segments fails authentication"""
+    header, segments = _segments(_encrypt(os.urandom(3 * SEGMENT_SIZE + 5)))
+    segments[0], segments[1] = segments[1], segments[0]
+    
+    with pytest.raises(ValueError):
+        _open(header + b''.join(segments)).read()
+
+def test_seek_reads_any_range():
+    """Reads after seeking (from the start, the current position or the end) match the plaintext"""
+    plaintext = os.urandom(5 * SEGMENT_SIZE + 17)
+    reader = _open(_encrypt(plaintext))
+    
+    for offset, length in ((0, 10), (SEGMENT_SIZE - 3, 6), (2 * SEGMENT_SIZE, SEGMENT_SIZE), (len(plaintext) - 4, 100)):
+        reader.seek(offset)
+        assert reader.read(length) == plaintext[offset:offset + length]
+    
+    reader.seek(-SEGMENT_SIZE - 1, io.SEEK_END)
+    assert reader.read() == plaintext[-SEGMENT_SIZE - 1:]
+    reader.seek(SEGMENT_SIZE)
+    reader.seek(5, io.SEEK_CUR)
+    assert reader.tell() == SEGMENT_SIZE + 5
+    assert reader.read(3) == plaintext[SEGMENT_SIZE + 5:SEGMENT_SIZE + 8]
+    reader.seek(len(plaintext) + 10)
+    assert reader.read() == b''
+
+def test_plaintext_with_magic_is_served_as_is():
+    """A plaintext file that happens to start with the magic bytes is not decrypted when recorded as plaintext"""
+    store = BlobStore(LocalBackend(tempfile.mkdtemp(prefix='file-encryption-')), cipher=CIPHER, encrypt=False)
+    plaintext = MAGIC + os.urandom(HEADER_SIZE + SEGMENT_SIZE)
+    _, _, locator = store.store_stream(io.BytesIO(plaintext))
+    
+    assert store.local_path(locator, encrypted=False) == locator
+    with store.open_file(locator, encrypted=False) as f:
+        assert f.read() == plaintext
+
+def _login(client, user_type, email, password):
+    response = client.post(f'/api/auth/{user_type}/login', json={'email': email, 'password': password})
+    assert response.status_code == 200, response.get_json()
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+def _upload_and_download(client, ops_headers, client_headers, content, name):
+    upload = client.post('/api/ops/upload', headers=ops_headers, data={'file': (io.BytesIO(content), name)})
+    assert upload.status_code == 201, upload.get_json()
+    link = client.get(f"/api/client/download-file/{upload.get_json()['file_id']}", headers=client_headers)
+    download = client.get('/download-file/' + link.get_json()['download-link'].rsplit('/', 1)[1])
+    assert download.status_code == 200
+    return download.get_data()
+
+def test_same_content_with_encryption_toggled():
+    """Content uploaded with encryption off and again with it on (and the reverse) reads back every time"""
+    app = create_app(CONFIG)
+    client = app.test_client()
+    ops_headers = _login(client, 'ops', 'ops@example.com', 'ops123')
+    client.post('/api/auth/client/signup', json={'email': 'toggle@example.com', 'password': 'toggle123'})
+    client_headers = _login(client, 'client', 'toggle@example.com', 'toggle123')
+    encrypt = routes.blob_store.encrypt
+    try:
+        for settings in ((False, True), (True, False)):
+            content = MAGIC + os.urandom(3000)
+            for i, setting in enumerate(settings):
+                routes.blob_store.encrypt = setting
+                assert _upload_and_download(client, ops_headers, client_headers, content, f'toggle{i}.docx') == content
+        
+        # An object kept from a write that never got its row (stored encrypted) is recorded as it is on disk
+        content = os.urandom(3000)
+        routes.blob_store.encrypt = True
+        routes.blob_store.store_stream(io.BytesIO(content))
+        routes.blob_store.encrypt = False
+        assert _upload_and_download(client, ops_headers, client_headers, content, 'orphan.docx') == content
+    finally:
+        routes.blob_store.encrypt = encrypt
+
+if __name__ == '__main__':
+    test_round_trip()
+    test_truncation_is_rejected()
+    test_reordered_segments_are_rejected()
+    test_seek_reads_any_range()
+    test_plaintext_with_magic_is_served_as_is()
+    test_same_content_with_encryption_toggled()
+    print("✅ File encryption format passed")
@@ -0,0 +1,89 @@
+"""
+Tests for the ZIP member index and MemberReader
+Checks that a highly compressible member is inflated a bounded piece at a time,
+that packages repeating a member name are rejected and that a package whose
+stored file has gone missing is answered with a 404
+"""
+
+import io
+import os
+import sys
+import warnings
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app
+from models import UploadedFile
+from package_members import read_member_index, MemberReader, MemberError
+from testing import isolated_config
+
+BUFFER_SIZE = 64 * 1024
+
+def _package(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as package:
+        for name, data in members:
+            package.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+def test_compressible_member_is_inflated_in_bounded_pieces():
+    """16 MB of zeros (about 16 KB deflated) is read back without holding more than one buffer of output"""
+    size = 16 * 1024 * 1024
+    package = _package([('[Content_Types].xml', b'<Types/>'), ('word/media/zeros.bin', bytes(size))])
+    member = next(m for m in read_member_index(package) if m.name == 'word/media/zeros.bin')
+    assert member.compressed_size < BUFFER_SIZE
+    
+    reader = MemberReader(package, member, BUFFER_SIZE)
+    total = 0
+    while True:
+        data = reader.read(BUFFER_SIZE)
+        assert len(reader.pending) <= BUFFER_SIZE
+        if not data:
+            break
+        assert not data.strip(b'\0')
+        total += len(data)
+    assert total == size  # the size and CRC-32 were checked at the end
+
+def test_duplicate_member_names_are_rejected():
+    """A package repeating a part name cannot be indexed"""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # zipfile warns about the duplicate
+        package = _package([('word/document.xml', b'first'), ('word/document.xml', b'second')])
+    
+    with pytest.raises(MemberError):
+        read_member_index(package)
+
+def _login(client, user_type, email, password):
+    response = client.post(f'/api/auth/{user_type}/login', json={'email': email, 'password': password})
+    assert response.status_code == 200, response.get_json()
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+def test_missing_package_file_is_not_found():
+    """Listing or reading members of a package whose stored file is gone returns 404, not a server error"""
+    app = create_app(isolated_config('package-members-', ENCRYPTION_KEY='package-members-test-key'))
+    client = app.test_client()
+    ops_headers = _login(client, 'ops', 'ops@example.com', 'ops123')
+    client.post('/api/auth/client/signup', json={'email': 'members@example.com', 'password': 'members123'})
+    client_headers = _login(client, 'client', 'members@example.com', 'members123')
+    
+    package = _package([('[Content_Types].xml', b'<Types/>'), ('word/document.xml', b'<document/>')])
+    upload = client.post('/api/ops/upload', headers=ops_headers, data={'file': (package, 'members.docx')})
+    assert upload.status_code == 201, upload.get_json()
+    file_id = upload.get_json()['file_id']
+    members_url = f'/api/client/files/{file_id}/members'
+    assert client.get(members_url, headers=client_headers).status_code == 200  # indexed while the file exists
+    
+    with app.app_context():
+        os.remove(UploadedFile.query.get(file_id).file_path)
+    assert client.get(members_url, headers=client_headers).status_code == 404
+    assert client.get(f'{members_url}/word/document.xml', headers=client_headers).status_code == 404
+
+if __name__ == '__main__':
+    test_compressible_member_is_inflated_in_bounded_pieces()
+    test_duplicate_member_names_are_rejected()
+    test_missing_package_file_is_not_found()
+    print("✅ Package members passed")
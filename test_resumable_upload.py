@@ -0,0 +1,178 @@
+"""
+Tests for resumable (chunked) uploads
+Covers offset mismatches, resuming after an interruption, the per-upload write lease,
+a failure while registering a completed upload and the purge of abandoned uploads
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app
+from testing import isolated_config
+from models import db, UploadSession
+from maintenance import purge_upload_sessions
+import routes
+
+# A throwaway database and upload folder shared by this module's tests only
+CONFIG = isolated_config('resumable-upload-', ENCRYPTION_KEY='resumable-upload-test-key')
+CONTENT = os.urandom(300 * 1024)
+
+def _login(client, user_type, email, password):
+    response = client.post(f'/api/auth/{user_type}/login', json={'email': email, 'password': password})
+    assert response.status_code == 200, response.get_json()
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+def _start(client, headers, size=len(CONTENT)):
+    response = client.post('/api/ops/uploads', headers=headers, json={'filename': 'chunked.docx', 'size': size})
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['upload_id']
+
+def _patch(client, headers, upload_id, offset, data):
+    return client.patch(f'/api/ops/uploads/{upload_id}', data=data,
+                        headers={**headers, 'Upload-Offset': str(offset)})
+
+def test_invalid_upload_parameters_are_refused():
+    """A boolean size or a sha256 that is not 64 hex characters is a 400, not a server error"""
+    app = create_app(CONFIG)
+    client = app.test_client()
+    headers = _login(client, 'ops', 'ops@example.com', 'ops123')
+    
+    for body in ({'size': True}, {'size': 1000, 'sha256': 123}, {'size': 1000, 'sha256': ['a' * 64]},
+                 {'size': 1000, 'sha256': 'a' * 63}, {'size': 1000, 'sha256': 'g' * 64}):
+        response = client.post('/api/ops/uploads', headers=headers, json={'filename': 'chunked.docx', **body})
+        assert response.status_code == 400, (body, response.get_json())
+    
+    response = client.post('/api/ops/uploads', headers=headers,
+                           json={'filename': 'chunked.docx', 'size': 1000, 'sha256': 'A' * 64})
+    assert response.status_code == 201, response.get_json()
+
+def test_offset_mismatch_reports_current_offset():
+    """A chunk sent for the wrong offset is rejected with the offset to resume from"""
+    app = create_app(CONFIG)
+    client = app.test_client()
+    headers = _login(client, 'ops', 'ops@example.com', 'ops123')
+    upload_id = _start(client, headers)
+    
+    assert _patch(client, headers, upload_id, 0, CONTENT[:1000]).status_code == 200
+    
+    # A retried first chunk and a chunk from the future are both refused
+    for offset in (0, 5000):
+        response = _patch(client, headers, upload_id, offset, CONTENT[offset:offset + 1000])
+        assert response.status_code == 409, response.get_json()
+        assert response.headers['Upload-Offset'] == '1000'
+    
+    assert client.head(f'/api/ops/uploads/{upload_id}', headers=headers).headers['Upload-Offset'] == '1000'
+
+def test_resume_after_interruption():
+    """An upload resumed from the offset reported by HEAD completes with the original bytes"""
+    app = create_app(CONFIG)
+    client = app.test_client()
+    headers = _login(client, 'ops', 'ops@example.com', 'ops123')
+    client.post('/api/auth/client/signup', json={'email': 'resume@example.com', 'password': 'resume123'})
+    client_headers = _login(client, 'client', 'resume@example.com', 'resume123')
+    upload_id = _start(client, headers)
+    
+    assert _patch(client, headers, upload_id, 0, CONTENT[:100 * 1024]).status_code == 200
+    incomplete = client.post(f'/api/ops/uploads/{upload_id}/complete', headers=headers)
+    assert incomplete.status_code == 409
+    
+    # The client lost track of its progress: ask the server, then send the rest
+    offset = int(client.head(f'/api/ops/uploads/{upload_id}', headers=headers).headers['Upload-Offset'])
+    assert offset == 100 * 1024
+    while offset < len(CONTENT):
+        response = _patch(client, headers, upload_id, offset, CONTENT[offset:offset + 64 * 1024])
+        assert response.status_code == 200, response.get_json()
+        offset = int(response.headers['Upload-Offset'])
+    
+    complete = client.post(f'/api/ops/uploads/{upload_id}/complete', headers=headers)
+    assert complete.status_code == 201, complete.get_json()
+    
+    link = client.get(f"/api/client/download-file/{complete.get_json()['file_id']}", headers=client_headers)
+    download = client.get('/download-file/' + link.get_json()['download-link'].rsplit('/', 1)[1])
+    assert download.status_code == 200
+    assert download.get_data() == CONTENT
+
+def test_concurrent_chunk_is_refused():
+    """While one request holds an upload's write lease, other chunks, completion and abort are refused"""
+    app = create_app(CONFIG)
+    client = app.test_client()
+    headers = _login(client, 'ops', 'ops@example.com', 'ops123')
+    upload_id = _start(client, headers)
+    
+    with app.app_context():
+        holder = UploadSession.claim_writer(upload_id, 60)
+        assert holder is not None
+        assert UploadSession.claim_writer(upload_id, 60) is None
+    
+    response = _patch(client, headers, upload_id, 0, CONTENT[:1000])
+    assert response.status_code == 409, response.get_json()
+    assert client.post(f'/api/ops/uploads/{upload_id}/complete', headers=headers).status_code == 409
+    assert client.delete(f'/api/ops/uploads/{upload_id}', headers=headers).status_code == 409
+    
+    with app.app_context():
+        UploadSession.release_writer(upload_id, holder)
+    assert _patch(client, headers, upload_id, 0, CONTENT[:1000]).status_code == 200
+
+def test_failed_registration_restarts_upload():
+    """If registering a stored upload fails, the session restarts from offset 0 and can still complete"""
+    app = create_app(CONFIG)
+    client = app.test_client()
+    headers = _login(client, 'ops', 'ops@example.com', 'ops123')
+    upload_id = _start(client, headers)
+    assert _patch(client, headers, upload_id, 0, CONTENT).status_code == 200
+    
+    def fail(**kwargs):
+        raise RuntimeError('database unavailable')
+    register_upload = routes._register_upload
+    routes._register_upload = fail
+    try:
+        response = client.post(f'/api/ops/uploads/{upload_id}/complete', headers=headers)
+    finally:
+        routes._register_upload = register_upload
+    assert response.status_code == 500
+    assert response.headers['Upload-Offset'] == '0'
+    
+    assert client.head(f'/api/ops/uploads/{upload_id}', headers=headers).headers['Upload-Offset'] == '0'
+    assert _patch(client, headers, upload_id, 0, CONTENT).status_code == 200
+    complete = client.post(f'/api/ops/uploads/{upload_id}/complete', headers=headers)
+    assert complete.status_code == 201, complete.get_json()
+
+def test_purge_removes_abandoned_uploads():
+    """The maintenance purge deletes idle upload sessions and their partial files, but not active ones"""
+    app = create_app(CONFIG)
+    client = app.test_client()
+    headers = _login(client, 'ops', 'ops@example.com', 'ops123')
+    abandoned_id = _start(client, headers)
+    active_id = _start(client, headers)
+    _patch(client, headers, abandoned_id, 0, CONTENT[:1000])
+    
+    with app.app_context():
+        abandoned = db.session.get(UploadSession, abandoned_id)
+        abandoned_path = abandoned.temp_path
+        abandoned.updated_at = datetime.utcnow() - timedelta(seconds=app.config['UPLOAD_SESSION_TTL'] + 60)
+        db.session.commit()
+        
+        # A partial file whose session was never committed
+        orphan_path = os.path.join(os.path.dirname(abandoned_path), 'orphan.part')
+        open(orphan_path, 'wb').close()
+        old = datetime.utcnow().timestamp() - app.config['UPLOAD_SESSION_TTL'] - 60
+        os.utime(orphan_path, (old, old))
+        
+        assert purge_upload_sessions(app) == 2
+        assert db.session.get(UploadSession, abandoned_id) is None
+        assert db.session.get(UploadSession, active_id) is not None
+    assert not os.path.exists(abandoned_path)
+    assert not os.path.exists(orphan_path)
+    assert client.head(f'/api/ops/uploads/{abandoned_id}', headers=headers).status_code == 404
+
+if __name__ == '__main__':
+    test_invalid_upload_parameters_are_refused()
+    test_offset_mismatch_reports_current_offset()
+    test_resume_after_interruption()
+    test_concurrent_chunk_is_refused()
+    test_failed_registration_restarts_upload()
+    test_purge_removes_abandoned_uploads()
+    print("✅ Resumable uploads passed")
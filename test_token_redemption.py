@@ -0,0 +1,111 @@
+"""
+Concurrency test for single-use download tokens
+Fires hundreds of parallel redemptions at one token and checks that exactly one succeeds
+"""
+
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app
+from testing import isolated_config
+
+# A throwaway database and upload folder shared by this module's tests only
+CONFIG = isolated_config('token-redemption-', ENCRYPTION_KEY='token-redemption-test-key')
+PARALLEL_REQUESTS = 300
+WORKERS = 64
+
+def _login(client, user_type, email, password):
+    response = client.post(f'/api/auth/{user_type}/login', json={'email': email, 'password': password})
+    assert response.status_code == 200, response.get_json()
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+def _race(token_format):
+    """Fire parallel downloads at one token and return the response status counts"""
+    app = create_app(CONFIG)
+    app.config['DOWNLOAD_TOKEN_FORMAT'] = token_format
+    client = app.test_client()
+    
+    ops_headers = _login(client, 'ops', 'ops@example.com', 'ops123')
+    client.post('/api/auth/client/signup', json={'email': 'race@example.com', 'password': 'race123'})
+    client_headers = _login(client, 'client', 'race@example.com', 'race123')
+    
+    upload = client.post('/api/ops/upload', headers=ops_headers,
+                         data={'file': (io.BytesIO(b'race condition'), 'race.docx')})
+    assert upload.status_code == 201, upload.get_json()
+    
+    link = client.get(f"/api/client/download-file/{upload.get_json()['file_id']}", headers=client_headers)
+    assert link.status_code == 200, link.get_json()
+    path = '/download-file/' + link.get_json()['download-link'].rsplit('/', 1)[1]
+    
+    def redeem(_):
+        with app.test_client() as worker_client:
+            return worker_client.get(path).status_code
+    
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        statuses = list(pool.map(redeem, range(PARALLEL_REQUESTS)))
+    
+    counts = {code: statuses.count(code) for code in sorted(set(statuses))}
+    print(f"{token_format} token statuses: {counts}")
+    return counts
+
+def test_parallel_redemption_succeeds_once():
+    """Exactly one of many concurrent downloads with the same database-backed token may succeed"""
+    assert _race('legacy') == {200: 1, 401: PARALLEL_REQUESTS - 1}
+
+def test_parallel_compact_redemption_succeeds_once():
+    """The replay filter gives compact tokens the same guarantee within one process"""
+    assert _race('compact') == {200: 1, 401: PARALLEL_REQUESTS - 1}
+
+def _resume_attempts(token_format):
+    """Redeem a token once, then return the statuses of follow-up requests with the same token"""
+    app = create_app(CONFIG)
+    app.config['DOWNLOAD_TOKEN_FORMAT'] = token_format
+    client = app.test_client()
+    
+    ops_headers = _login(client, 'ops', 'ops@example.com', 'ops123')
+    client.post('/api/auth/client/signup', json={'email': 'resume@example.com', 'password': 'resume123'})
+    client_headers = _login(client, 'client', 'resume@example.com', 'resume123')
+    
+    upload = client.post('/api/ops/upload', headers=ops_headers,
+                         data={'file': (io.BytesIO(b'resumable content' * 100), 'resume.docx')})
+    link = client.get(f"/api/client/download-file/{upload.get_json()['file_id']}", headers=client_headers)
+    path = '/download-file/' + link.get_json()['download-link'].rsplit('/', 1)[1]
+    
+    first = client.get(path)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    
+    statuses = {}
+    for name, headers in [('range from 0', {'Range': 'bytes=0-'}),
+                          ('whole suffix', {'Range': 'bytes=-1700'}),
+                          ('wrong etag', {'If-None-Match': '"not-the-digest"'}),
+                          ('any etag', {'If-None-Match': '*'}),
+                          ('resume', {'Range': 'bytes=100-'}),
+                          ('revalidate', {'If-None-Match': etag})]:
+        response = client.get(path, headers=headers)
+        statuses[name] = (response.status_code, len(response.get_data()) if response.status_code != 401 else None)
+    return statuses
+
+def test_used_token_only_resumes():
+    """A used token may resume past the first byte or revalidate its ETag, but never refetch the file"""
+    for token_format in ('legacy', 'compact'):
+        statuses = _resume_attempts(token_format)
+        print(f"{token_format} follow-up statuses: {statuses}")
+        assert statuses == {
+            'range from 0': (401, None),
+            'whole suffix': (401, None),
+            'wrong etag': (401, None),
+            'any etag': (401, None),
+            'resume': (206, 1600),
+            'revalidate': (304, 0)
+        }
+
+if __name__ == '__main__':
+    test_parallel_redemption_succeeds_once()
+    test_parallel_compact_redemption_succeeds_once()
+    test_used_token_only_resumes()
+    print("✅ Exactly one parallel redemption succeeded")
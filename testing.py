@@ -0,0 +1,25 @@
+"""
+Settings for running the app under test
+Every call gets its own throwaway database and storage folders, passed to create_app as
+overrides, so test modules never share state through the environment or the Config class
+"""
+
+import os
+import tempfile
+
+def isolated_config(prefix, **settings):
+    """Config overrides for a fresh database and upload folder, plus any other `settings`"""
+    work_dir = tempfile.mkdtemp(prefix=prefix)
+    upload_folder = os.path.join(work_dir, 'uploads')
+    config = {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(work_dir, 'test.db')}",
+        'UPLOAD_FOLDER': upload_folder,
+        # Config derives these from UPLOAD_FOLDER when the class is loaded
+        'BLOB_FOLDER': os.path.join(upload_folder, 'blobs'),
+        'QUARANTINE_FOLDER': os.path.join(upload_folder, '.quarantine'),
+        'PREVIEW_CACHE_FOLDER': os.path.join(upload_folder, '.previews'),
+        'STORAGE_BACKEND': 'local',
+        'MAIL_OUTBOX_SENDER': False  # tests that need mail send their batches themselves
+    }
+    config.update(settings)
+    return config
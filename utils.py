@@ -1,43 +1,120 @@
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from collections import OrderedDict
 import base64
+import hashlib
+import hmac
+import json
+import math
 import secrets
 import string
+import struct
+import threading
+import time
 from datetime import datetime, timedelta
 import os
+import zipfile
+
+def derive_key(password: str, salt: bytes = b'salt_', iterations: int = 100000) -> bytes:
+    """Derive 32 bytes of key material from a password.
+    
+    PBKDF2 is deliberately slow; EncryptionService derives each keyring entry
+    once and keeps the result, so no secret has to be cached here.
+    """
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,  # In production, use a random salt per encryption
+        iterations=iterations,
+    )
+    return kdf.derive(password if isinstance(password, bytes) else password.encode())
+
+def parse_keyring(spec: str) -> dict:
+    """Parse a keyring spec like ``"1:old-password,2:raw:<urlsafe base64 key>"`` into ``{key id: key}``.
+    
+    ``raw:`` keys become their 32 bytes of key material (e.g. a Fernet key); other
+    secrets stay passwords, which EncryptionService derives keys from.
+    """
+    keys = {}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        key_id, sep, secret = entry.partition(':')
+        if not sep or not key_id.isdigit() or not 0 <= int(key_id) <= 255:
+            raise ValueError(f"Invalid keyring entry '{entry}': expected <id 0-255>:<secret>")
+        if secret.startswith('raw:'):
+            material = base64.urlsafe_b64decode(secret[4:].encode())
+            if len(material) != 32:
+                raise ValueError(f"Raw key {key_id} must be 32 bytes of urlsafe base64")
+        else:
+            material = secret
+        keys[int(key_id)] = material
+    return keys
 
 class EncryptionService:
-    def __init__(self, password: str):
-        """Initialize encryption service with a password"""
-        password_bytes = password.encode()
-        salt = b'salt_'  # In production, use a random salt per encryption
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(password_bytes))
-        self.cipher_suite = Fernet(key)
+    def __init__(self, password: str = None, keys: dict = None, active_key_id: int = None):
+        """Initialize encryption service with a password, or with a keyring of ``{key id: key}``
+        
+        Keys are 32 bytes of key material or passwords; each password is derived
+        once, here, and only the derived material is kept. New data is encrypted
+        with the active key (the highest id by default); data encrypted with any
+        key in the ring can still be decrypted.
+        """
+        if keys is None:
+            keys = {0: password}
+        self.keys = {key_id: derive_key(key) if isinstance(key, str) else key for key_id, key in keys.items()}
+        self.active_key_id = max(keys) if active_key_id is None else active_key_id
+        if self.active_key_id not in keys:
+            raise ValueError(f"Active key id {self.active_key_id} is not in the keyring")
+        self._ciphers = {key_id: Fernet(base64.urlsafe_b64encode(material)) for key_id, material in self.keys.items()}
+        self.cipher_suite = self._ciphers[self.active_key_id]
+    
+    def derive_subkey(self, label: bytes, key_id: int = None) -> bytes:
+        """Derive an independent 32-byte key for another purpose (e.g. token signing)"""
+        material = self.keys[self.active_key_id if key_id is None else key_id]
+        return hmac.new(material, label, hashlib.sha256).digest()
     
     def encrypt(self, data: str) -> str:
-        """Encrypt a string and return base64 encoded result"""
+        """Encrypt a string and return base64 encoded result, prefixed with the key id"""
         encrypted_data = self.cipher_suite.encrypt(data.encode())
-        return base64.urlsafe_b64encode(encrypted_data).decode()
+        return f"{self.active_key_id}.{base64.urlsafe_b64encode(encrypted_data).decode()}"
     
     def decrypt(self, encrypted_data: str) -> str:
         """Decrypt base64 encoded data and return original string"""
         try:
-            decoded_data = base64.urlsafe_b64decode(encrypted_data.encode())
-            decrypted_data = self.cipher_suite.decrypt(decoded_data)
-            return decrypted_data.decode()
+            key_id, sep, body = encrypted_data.partition('.')
+            if sep:
+                ciphers = [self._ciphers[int(key_id)]]
+            else:
+                # Issued before tokens carried a key id: try every key in the ring
+                body = encrypted_data
+                ciphers = self._ciphers.values()
+            decoded_data = base64.urlsafe_b64decode(body.encode())
+            for cipher in ciphers:
+                try:
+                    return cipher.decrypt(decoded_data).decode()
+                except InvalidToken:
+                    continue
+            return None
         except Exception:
             return None
 
 class TokenService:
+    # Compact token: version, key id, file id, user id, expiry (epoch seconds), random token id,
+    # then a truncated HMAC. Version 1 tokens predate key ids and are signed with key 0.
+    COMPACT_VERSION = 2
+    COMPACT_PAYLOADS = {
+        1: struct.Struct('>BIII8s'),
+        2: struct.Struct('>BBIII8s'),
+    }
+    COMPACT_MAC_SIZE = 16
+    COMPACT_TOKEN_LENGTHS = {50: 1, 51: 2}  # unpadded base64url length of payload + MAC -> version
+    
     def __init__(self, encryption_service: EncryptionService):
         self.encryption_service = encryption_service
+        self.signing_keys = {
+            key_id: encryption_service.derive_subkey(b'download-token-v1', key_id)
+            for key_id in encryption_service.keys
+        }
     
     def generate_download_token(self, file_id: int, user_id: int, expires_in_hours: int = 24) -> str:
         """Generate an encrypted download token"""
@@ -47,8 +124,19 @@ class TokenService:
         token_data = f"{file_id}:{user_id}:{expires_timestamp}"
         return self.encryption_service.encrypt(token_data)
     
+    def generate_compact_token(self, file_id: int, user_id: int, expires_in_hours: int = 24) -> str:
+        """Generate a short signed download token that needs no database row"""
+        key_id = self.encryption_service.active_key_id
+        expires_timestamp = int(time.time()) + expires_in_hours * 3600
+        payload = self.COMPACT_PAYLOADS[self.COMPACT_VERSION].pack(
+            self.COMPACT_VERSION, key_id, file_id, user_id, expires_timestamp, secrets.token_bytes(8))
+        return base64.urlsafe_b64encode(payload + self._sign(payload, key_id)).decode().rstrip('=')
+    
     def validate_download_token(self, token: str) -> dict:
-        """Validate and decode download token"""
+        """Validate and decode download token (compact or legacy encrypted format)"""
+        if len(token) in self.COMPACT_TOKEN_LENGTHS:
+            return self._validate_compact_token(token, self.COMPACT_TOKEN_LENGTHS[len(token)])
+        
         decrypted_data = self.encryption_service.decrypt(token)
         if not decrypted_data:
             return None
@@ -64,10 +152,230 @@ class TokenService:
             return {
                 'file_id': int(file_id),
                 'user_id': int(user_id),
-                'expires_at': expires_at
+                'expires_at': expires_at,
+                'format': 'legacy'
             }
         except (ValueError, TypeError):
             return None
+    
+    def _validate_compact_token(self, token: str, version: int) -> dict:
+        try:
+            raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        except (ValueError, TypeError):
+            return None
+        
+        payload_format = self.COMPACT_PAYLOADS[version]
+        payload, mac = raw[:payload_format.size], raw[payload_format.size:]
+        if len(mac) != self.COMPACT_MAC_SIZE or payload[0] != version:
+            return None
+        
+        if version == 1:
+            _, file_id, user_id, expires_timestamp, token_id = payload_format.unpack(payload)
+            key_id = 0
+        else:
+            _, key_id, file_id, user_id, expires_timestamp, token_id = payload_format.unpack(payload)
+        
+        # The key id selects the signing key directly; unknown (retired) keys fail validation
+        if key_id not in self.signing_keys or not hmac.compare_digest(mac, self._sign(payload, key_id)):
+            return None
+        if time.time() > expires_timestamp:
+            return None
+        
+        return {
+            'file_id': file_id,
+            'user_id': user_id,
+            'expires_at': datetime.utcfromtimestamp(expires_timestamp),
+            'expires_timestamp': expires_timestamp,
+            'token_id': token_id,
+            'format': 'compact'
+        }
+    
+    def _sign(self, payload: bytes, key_id: int) -> bytes:
+        return hmac.new(self.signing_keys[key_id], payload, hashlib.sha256).digest()[:self.COMPACT_MAC_SIZE]
+
+class BloomFilter:
+    """Fixed-size Bloom filter over byte strings"""
+    
+    def __init__(self, capacity: int, error_rate: float):
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+    
+    def _positions(self, item: bytes):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        h1, h2 = struct.unpack('>QQ', digest)
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+    
+    def add(self, item: bytes):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+    
+    def __contains__(self, item: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+class ReplayFilter:
+    """In-process one-time-use filter for stateless download tokens.
+    
+    Redeemed token ids go into Bloom filters grouped by expiry bucket; a bucket
+    is dropped once every token in it has expired, so memory tracks the number
+    of live tokens. A small exact map keeps tokens redeemed within the resume
+    window so Range requests can reuse them. State is per process: with several
+    worker processes a token can be redeemed once per worker.
+    """
+    
+    def __init__(self, capacity: int = 100000, error_rate: float = 1e-6, bucket_seconds: int = 3600):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bucket_seconds = bucket_seconds
+        self._generations = {}
+        self._recent = {}
+        self._next_prune = 0
+        self._lock = threading.Lock()
+    
+    def redeem(self, token_id: bytes, expires_timestamp: int, allow_resume: bool = False, resume_window: int = 0) -> bool:
+        """Record a redemption; returns False if the token was already used (outside the resume window)"""
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            
+            recent = self._recent.get(token_id)
+            if recent is not None and recent[1] >= now:
+                return allow_resume and now - recent[0] <= resume_window
+            
+            bucket = expires_timestamp // self.bucket_seconds
+            generation = self._generations.get(bucket)
+            if generation is None:
+                generation = self._generations[bucket] = BloomFilter(self.capacity, self.error_rate)
+            elif token_id in generation:
+                return False
+            
+            generation.add(token_id)
+            self._recent[token_id] = (now, min(now + resume_window, expires_timestamp))
+            return True
+    
+    def _prune(self, now: float):
+        if now < self._next_prune:
+            return
+        self._next_prune = now + 1
+        expired_before = int(now) // self.bucket_seconds
+        for bucket in [b for b in self._generations if b < expired_before]:
+            del self._generations[bucket]
+        for token_id in [t for t, (_, until) in self._recent.items() if until < now]:
+            del self._recent[token_id]
+
+class IdentityCache:
+    """Small in-process TTL cache of ``(role, token version)`` per user id.
+    
+    Entries are dropped when the user row changes in this process; other
+    processes pick up changes once the TTL expires.
+    """
+    
+    def __init__(self, ttl: float = 30, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = {}
+        self._lock = threading.Lock()
+    
+    def get(self, user_id: int, loader):
+        """Return the cached identity of a user, calling ``loader(user_id)`` on a miss"""
+        now = time.monotonic()
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        
+        identity = loader(user_id)
+        if identity is not None and self.ttl > 0:
+            with self._lock:
+                if len(self._entries) >= self.max_size:
+                    self._entries.pop(next(iter(self._entries)))
+                self._entries[user_id] = (identity, now + self.ttl)
+        return identity
+    
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+class HotFileCache:
+    """Bounded in-process LRU cache of the bytes of small, frequently downloaded files.
+    
+    Entries are keyed by content digest: stored content never changes under
+    its digest, so an entry cannot go stale, and a new version of a file is a
+    new key (``invalidate`` only frees memory once a blob is removed). Files
+    larger than ``max_object_size`` bypass the cache. State is per process.
+    """
+    
+    def __init__(self, max_bytes: int, max_object_size: int):
+        self.max_bytes = max_bytes
+        self.max_object_size = min(max_object_size, max_bytes)
+        self._entries = OrderedDict()  # digest -> bytes, least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypasses = 0
+    
+    def get_or_load(self, key: str, size: int, loader):
+        """Return the bytes of ``key``, calling ``loader()`` on a miss; None if ``size`` is too large to cache"""
+        if size > self.max_object_size:
+            with self._lock:
+                self.bypasses += 1
+            return None
+        
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+        
+        # Loaded outside the lock; concurrent misses on one key may both load it
+        data = loader()
+        if len(data) > self.max_object_size:
+            return data
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = data
+                self._size += len(data)
+                while self._size > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._size -= len(evicted)
+                    self.evictions += 1
+        return data
+    
+    def invalidate(self, key: str):
+        with self._lock:
+            data = self._entries.pop(key, None)
+            if data is not None:
+                self._size -= len(data)
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'max_object_size': self.max_object_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'bypasses': self.bypasses,
+            }
+
+def encode_cursor(data: dict) -> str:
+    """Encode keyset pagination state as an opaque URL-safe cursor"""
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> dict:
+    """Decode a cursor produced by encode_cursor; returns None if it is malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return data if isinstance(data, dict) else None
+    except (ValueError, TypeError):
+        return None
 
 def allowed_file(filename, allowed_extensions):
     """Check if file extension is allowed"""
@@ -84,3 +392,64 @@ def ensure_upload_directory(upload_folder):
     """Ensure upload directory exists"""
     if not os.path.exists(upload_folder):
         os.makedirs(upload_folder)
+
+def generate_upload_id():
+    """Generate an identifier for a resumable upload session"""
+    return secrets.token_hex(16)
+
+def stream_to_file(stream, fileobj, limit, buffer_size=65536):
+    """Copy at most ``limit`` bytes from ``stream`` into ``fileobj`` using a bounded buffer.
+    
+    Returns the number of bytes written, or -1 if the stream holds more than ``limit`` bytes.
+    """
+    written = 0
+    while True:
+        chunk = stream.read(buffer_size)
+        if not chunk:
+            return written
+        if written + len(chunk) > limit:
+            return -1
+        fileobj.write(chunk)
+        written += len(chunk)
+
+class _ZipStreamBuffer:
+    """Write-only, unseekable sink for ZipFile whose contents are drained as they are produced"""
+    
+    def __init__(self):
+        self._parts = []
+    
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+def iter_zip_stream(entries, buffer_size=65536, open_file=None):
+    """Yield a ZIP archive built on the fly from ``(arcname, path, size, date_time)`` entries.
+    
+    Members are stored without recompression (OOXML files are already deflated),
+    and only one read buffer is held in memory at a time. ``open_file`` opens a
+    path for binary reading (default: the local filesystem).
+    """
+    open_file = open_file or (lambda path: open(path, 'rb'))
+    sink = _ZipStreamBuffer()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for arcname, path, size, date_time in entries:
+            info = zipfile.ZipInfo(arcname, date_time=date_time)
+            info.compress_type = zipfile.ZIP_STORED
+            info.file_size = size
+            with open_file(path) as src, archive.open(info, 'w', force_zip64=size >= zipfile.ZIP64_LIMIT) as dest:
+                while True:
+                    chunk = src.read(buffer_size)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()